@@ -0,0 +1,138 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Checks that example_serializer writes the same bytes as protobuf.
+
+Random prediction records, including empty labels, empty features, negative
+int64 values and arbitrary video ids, are serialized by example_serializer
+and compared to SerializeToString of the equivalent tf.train.Example. They
+are also parsed back with tf.parse_example.
+"""
+
+import numpy
+import tensorflow as tf
+from tensorflow import app
+from tensorflow import flags
+from tensorflow import logging
+
+import example_serializer
+
+FLAGS = flags.FLAGS
+
+if __name__ == "__main__":
+  flags.DEFINE_integer("num_batches", 20,
+                       "How many random batches to check.")
+  flags.DEFINE_integer("num_classes", 4716,
+                       "The number of classes of the labels.")
+  flags.DEFINE_integer("seed", 0, "The seed of the random records.")
+
+
+def get_example(video_id, labels, float_features, int64_features):
+  feature_maps = {
+      "video_id": tf.train.Feature(bytes_list=tf.train.BytesList(value=[video_id])),
+      "labels": tf.train.Feature(int64_list=tf.train.Int64List(value=labels))}
+  for name, values in float_features.items():
+    feature_maps[name] = tf.train.Feature(
+        float_list=tf.train.FloatList(value=values))
+  for name, values in int64_features.items():
+    feature_maps[name] = tf.train.Feature(
+        int64_list=tf.train.Int64List(value=values))
+  return tf.train.Example(features=tf.train.Features(feature=feature_maps))
+
+
+def serialize_deterministic(example):
+  try:
+    return example.SerializeToString(deterministic=True)
+  except TypeError:
+    # Protobuf versions without the argument write the entries of the
+    # feature map in an unspecified order.
+    return None
+
+
+def random_batch(rng, num_classes):
+  batch_size = rng.randint(1, 64)
+  video_ids = [rng.bytes(rng.randint(0, 32)) for _ in range(batch_size)]
+  labels = rng.rand(batch_size, num_classes) < rng.choice([0.0, 0.001, 0.1])
+  predictions = rng.rand(batch_size, rng.choice([0, 1, 31, 32, num_classes]))
+  top_k_classes = rng.randint(-2**40, 2**40, size=(batch_size, 3))
+  float_features = {"predictions": predictions,
+                    "floor": predictions[:, :1] - 0.5}
+  int64_features = {"top_k_classes": top_k_classes}
+  return video_ids, labels, float_features, int64_features
+
+
+def check_batch(video_ids, labels, float_features, int64_features):
+  serialized = list(example_serializer.serialize_examples(
+      video_ids, labels, float_features, int64_features))
+  num_mismatches = 0
+  for i, video_id in enumerate(video_ids):
+    example = get_example(
+        video_id, numpy.nonzero(labels[i])[0],
+        dict((name, values[i].astype(numpy.float32))
+             for name, values in float_features.items()),
+        dict((name, values[i]) for name, values in int64_features.items()))
+    expected = serialize_deterministic(example)
+    if expected is None:
+      parsed = tf.train.Example()
+      parsed.ParseFromString(serialized[i])
+      matches = parsed == example
+    else:
+      matches = serialized[i] == expected
+    if not matches:
+      num_mismatches += 1
+      logging.error("record %d of video %r differs from protobuf.", i,
+                    video_id)
+  return serialized, num_mismatches
+
+
+def check_parse(serialized, video_ids, float_features):
+  """Parses the records with tensorflow and compares the float features."""
+  float_features = dict((name, values)
+                        for name, values in float_features.items()
+                        if values.shape[1] > 0)
+  features = {"video_id": tf.FixedLenFeature([], tf.string),
+              "labels": tf.VarLenFeature(tf.int64)}
+  for name, values in float_features.items():
+    features[name] = tf.FixedLenFeature([values.shape[1]], tf.float32)
+  serialized_tensor = tf.placeholder(tf.string, shape=[None])
+  parsed = tf.parse_example(serialized_tensor, features=features)
+  with tf.Session() as sess:
+    parsed_val = sess.run(parsed, feed_dict={serialized_tensor: serialized})
+  if list(parsed_val["video_id"]) != list(video_ids):
+    return False
+  for name, values in float_features.items():
+    if not numpy.array_equal(parsed_val[name], values.astype(numpy.float32)):
+      return False
+  return True
+
+
+def main(unused_argv):
+  logging.set_verbosity(tf.logging.INFO)
+  rng = numpy.random.RandomState(FLAGS.seed)
+  total_mismatches = 0
+  for batch_index in range(FLAGS.num_batches):
+    video_ids, labels, float_features, int64_features = random_batch(
+        rng, FLAGS.num_classes)
+    serialized, num_mismatches = check_batch(
+        video_ids, labels, float_features, int64_features)
+    if not check_parse(serialized, video_ids, float_features):
+      logging.error("batch %d is not parsed back correctly.", batch_index)
+      num_mismatches += 1
+    total_mismatches += num_mismatches
+  if total_mismatches:
+    raise ValueError("%d records differ from protobuf." % total_mismatches)
+  logging.info("all records of %d batches match protobuf.", FLAGS.num_batches)
+
+
+if __name__ == "__main__":
+  app.run()
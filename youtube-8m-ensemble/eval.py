@@ -15,9 +15,12 @@
 
 import time
 
+import numpy
+
 import eval_util
 import losses
 import ensemble_level_models
+import dataset_input
 import readers
 import tensorflow as tf
 from tensorflow import app
@@ -43,6 +46,27 @@ if __name__ == "__main__":
   flags.DEFINE_string("feature_names", "predictions", "Name of the feature "
                       "to use for training.")
   flags.DEFINE_string("feature_sizes", "4716", "Length of the feature vectors.")
+  flags.DEFINE_bool(
+      "prediction_store", False,
+      "If set, the predictions are read from prediction_store shards and the "
+      "data patterns must match their *.index.npz files.")
+  flags.DEFINE_integer(
+      "sparse_predictions_top_k", 0,
+      "If positive, the predictions are read from sparse top-k tfrecords. "
+      "Must equal the --output_top_k they were written with, the top-k "
+      "features are parsed with a fixed length.")
+  flags.DEFINE_bool(
+      "join_inputs", False,
+      "If set, the predictions of all the data patterns and the "
+      "--input_data_pattern features are read by one EnsembleJoinReader and "
+      "joined by video_id, instead of one queue per data pattern kept in "
+      "lockstep. The epoch ends with the shortest source, so all the sources "
+      "must contain the same videos; the evaluation fails if some "
+      "videos were not joined. Cannot be used with --use_dataset.")
+  flags.DEFINE_bool(
+      "use_dataset", False,
+      "If set, the input is read by the tf.data pipeline of dataset_input.py "
+      "instead of queue runners. Requires TensorFlow 1.4 or later.")
 
   # Model flags.
   flags.DEFINE_string(
@@ -57,6 +81,21 @@ if __name__ == "__main__":
   flags.DEFINE_boolean("run_once", True, "Whether to run eval only once.")
   flags.DEFINE_boolean("echo_gap", False, "Whether to echo GAP at the end.")
   flags.DEFINE_integer("top_k", 20, "How many predictions to output per video.")
+  flags.DEFINE_string(
+      "output_metrics_file", "",
+      "If set, the metrics accumulated over the evaluation data are saved to "
+      "this .npz file, to be merged with those of other shards of the data by "
+      "merge-eval-metrics.py.")
+  flags.DEFINE_integer(
+      "gap_histogram_bins", 0,
+      "If positive, the GAP is estimated in fixed memory from a histogram of "
+      "this many score bins, and logged with its error bounds, instead of "
+      "keeping every top_k prediction of the evaluation data in memory.")
+  flags.DEFINE_string(
+      "eval_subset_video_ids", "",
+      "If set, a .npy file of video ids written by build-eval-subset.py, only "
+      "these videos of the evaluation data are evaluated. To also read only "
+      "them, point eval_data_pattern to the shards written by the tool.")
 
 def find_class_by_name(name, modules):
   """Searches the provided modules for the named class and returns it."""
@@ -64,6 +103,21 @@ def find_class_by_name(name, modules):
   return next(a for a in modules if a)
 
 
+def filter_by_video_ids(eval_data, subset_video_ids):
+  """Keeps the examples of eval_data whose video_id is in subset_video_ids.
+
+  Args:
+    eval_data: a list of tensors of examples, the first being the video ids.
+    subset_video_ids: a numpy vector of the video ids to keep.
+  """
+  subset_video_ids = numpy.unique(subset_video_ids)
+  def in_subset(video_ids):
+    return numpy.in1d(video_ids, subset_video_ids)
+  mask = tf.py_func(in_subset, [eval_data[0]], tf.bool, stateful=False)
+  mask.set_shape([None])
+  return [tf.boolean_mask(tensor, mask) for tensor in eval_data]
+
+
 def get_input_evaluation_tensors(reader,
                                  data_pattern,
                                  batch_size=256):
@@ -75,15 +129,63 @@ def get_input_evaluation_tensors(reader,
       raise IOError("Unable to find the evaluation files.")
     logging.info("number of evaluation files: " + str(len(files)))
     files.sort()
+    subset_video_ids = None
+    if FLAGS.eval_subset_video_ids:
+      subset_video_ids = numpy.load(FLAGS.eval_subset_video_ids)
+      logging.info("evaluating a subset of %d videos", len(subset_video_ids))
+      if FLAGS.use_dataset:
+        raise ValueError("--eval_subset_video_ids cannot be used with "
+                         "--use_dataset.")
+    if FLAGS.use_dataset:
+      # the predictions of the models are kept in lockstep, never shuffle
+      return dataset_input.get_input_tensors(
+          reader, files, batch_size, num_epochs=1)
     filename_queue = tf.train.string_input_producer(
         files, shuffle=False, num_epochs=1)
     eval_data = reader.prepare_reader(filename_queue)
-    return tf.train.batch(
+    if subset_video_ids is not None:
+      eval_data = filter_by_video_ids(eval_data, subset_video_ids)
+    batch = tf.train.batch(
         eval_data,
         batch_size=batch_size,
         capacity=3 * batch_size,
         allow_smaller_final_batch=True,
         enqueue_many=True)
+    return reader.prepare_batch(batch)
+
+
+def get_joined_input_evaluation_tensors(reader,
+                                        data_patterns,
+                                        batch_size=256):
+  """Reads all the sources of a EnsembleJoinReader through one batching queue."""
+  if FLAGS.use_dataset:
+    raise ValueError("--join_inputs cannot be used with --use_dataset.")
+  logging.info("Using batch size of " + str(batch_size) + " for evaluation.")
+  with tf.name_scope("eval_input"):
+    filename_queues = []
+    num_files = 0
+    for data_pattern in data_patterns:
+      files = gfile.Glob(data_pattern)
+      if not files:
+        raise IOError("Unable to find evaluation files. data_pattern='" +
+                      data_pattern + "'.")
+      num_files += len(files)
+      files.sort()
+      filename_queues.append(tf.train.string_input_producer(
+          files, num_epochs=1, shuffle=False))
+    logging.info("Number of evaluation files: %s.", str(num_files))
+    joined_data = reader.prepare_reader(filename_queues)
+    if FLAGS.eval_subset_video_ids:
+      joined_data = filter_by_video_ids(
+          joined_data, numpy.load(FLAGS.eval_subset_video_ids))
+
+    batch = tf.train.batch(
+        joined_data,
+        batch_size=batch_size,
+        capacity=3 * batch_size,
+        allow_smaller_final_batch=True,
+        enqueue_many=True)
+    return reader.prepare_batch(batch)
 
 
 def build_graph(all_readers,
@@ -110,26 +212,47 @@ def build_graph(all_readers,
   model_input_raw_tensors = []
   labels_batch_tensor = None
   video_id_batch = None
-  for reader, data_pattern in zip(all_readers, all_eval_data_patterns):
-    unused_video_id, model_input_raw, labels_batch, unused_num_frames = (
-        get_input_evaluation_tensors(
-            reader,
-            data_pattern,
-            batch_size=batch_size))
-    if labels_batch_tensor is None:
-      labels_batch_tensor = labels_batch
-    if video_id_batch is None:
-      video_id_batch = unused_video_id
-    model_input_raw_tensors.append(tf.expand_dims(model_input_raw, axis=2))
-
   original_input = None
-  if input_data_pattern is not None:
-    unused_video_id, original_input, unused_labels_batch, unused_num_frames = (
-        get_input_evaluation_tensors(
-            input_reader,
-            input_data_pattern,
-            batch_size=batch_size))
-  
+  if FLAGS.join_inputs:
+    # the original input is joined by video_id with the predictions
+    if input_data_pattern is not None:
+      reader = readers.EnsembleJoinReader(all_readers, input_reader)
+      all_eval_data_patterns = all_eval_data_patterns + [input_data_pattern]
+    else:
+      reader = readers.EnsembleJoinReader(all_readers)
+    joined_data = get_joined_input_evaluation_tensors(
+        reader,
+        all_eval_data_patterns,
+        batch_size=batch_size)
+    video_id_batch, model_input_raw, labels_batch_tensor, unused_num_frames = (
+        joined_data[:4])
+    model_input_raw_tensors.append(model_input_raw)
+
+    if input_data_pattern is not None:
+      original_video_id, original_input = joined_data[4:]
+      id_match = tf.cast(tf.equal(original_video_id, video_id_batch),
+                         dtype=tf.float32)
+      tf.summary.scalar("model/id_match", tf.reduce_mean(id_match))
+  else:
+    if input_data_pattern is not None:
+      unused_video_id, original_input, unused_labels_batch, unused_num_frames = (
+          get_input_evaluation_tensors(
+              input_reader,
+              input_data_pattern,
+              batch_size=batch_size))
+
+    for reader, data_pattern in zip(all_readers, all_eval_data_patterns):
+      unused_video_id, model_input_raw, labels_batch, unused_num_frames = (
+          get_input_evaluation_tensors(
+              reader,
+              data_pattern,
+              batch_size=batch_size))
+      if labels_batch_tensor is None:
+        labels_batch_tensor = labels_batch
+      if video_id_batch is None:
+        video_id_batch = unused_video_id
+      model_input_raw_tensors.append(tf.expand_dims(model_input_raw, axis=2))
+
   model_input = tf.concat(model_input_raw_tensors, axis=2)
   labels_batch = labels_batch_tensor
 
@@ -231,9 +354,12 @@ def evaluation_loop(video_id_batch, prediction_batch, label_batch, loss,
       logging.info(
           "Done with batched inference. Now calculating global performance "
           "metrics.")
+      readers.check_join_complete(sess)
       # calculate the metrics for the entire epoch
       epoch_info_dict = evl_metrics.get()
       epoch_info_dict["epoch_id"] = global_step_val
+      if FLAGS.output_metrics_file:
+        evl_metrics.save(FLAGS.output_metrics_file)
 
       summary_writer.add_summary(summary_val, global_step_val)
       epochinfo = utils.AddEpochSummary(
@@ -244,6 +370,9 @@ def evaluation_loop(video_id_batch, prediction_batch, label_batch, loss,
       if FLAGS.echo_gap:
         print "GAP =", epoch_info_dict["gap"]
       logging.info(epochinfo)
+      if "gap_bounds" in epoch_info_dict:
+        logging.info("GAP is within [%.6f, %.6f]",
+                     *epoch_info_dict["gap_bounds"])
       evl_metrics.clear()
     except Exception as e:  # pylint: disable=broad-except
       logging.info("Unexpected exception: " + str(e))
@@ -268,8 +397,14 @@ def evaluate():
     all_patterns = FLAGS.eval_data_patterns
     all_patterns = map(lambda x: x.strip(), all_patterns.strip().strip(",").split(","))
     for i in xrange(len(all_patterns)):
-      reader = readers.EnsembleReader(
-          feature_names=feature_names, feature_sizes=feature_sizes)
+      if FLAGS.prediction_store:
+        reader = readers.EnsemblePredictionStoreReader()
+      elif FLAGS.sparse_predictions_top_k > 0:
+        reader = readers.EnsembleSparseReader(
+            top_k=FLAGS.sparse_predictions_top_k)
+      else:
+        reader = readers.EnsembleReader(
+            feature_names=feature_names, feature_sizes=feature_sizes)
       all_readers.append(reader)
 
     input_reader = None
@@ -306,7 +441,8 @@ def evaluate():
     summary_writer = tf.summary.FileWriter(
         FLAGS.train_dir, graph=tf.get_default_graph())
 
-    evl_metrics = eval_util.EvaluationMetrics(FLAGS.num_classes, FLAGS.top_k)
+    evl_metrics = eval_util.EvaluationMetrics(FLAGS.num_classes, FLAGS.top_k,
+                                              FLAGS.gap_histogram_bins)
 
     last_global_step_val = -1
     last_global_step_val = evaluation_loop(video_id_batch, prediction_batch,
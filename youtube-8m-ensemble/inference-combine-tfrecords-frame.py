@@ -26,6 +26,7 @@ from tensorflow import flags
 from tensorflow import gfile
 from tensorflow import logging
 
+import shard_writer
 import utils
 import eval_util
 import losses
@@ -53,6 +54,11 @@ if __name__ == '__main__':
                        "How many examples to process per batch.")
   flags.DEFINE_integer("file_size", 4096,
                        "Number of frames per batch for DBoF.")
+  flags.DEFINE_integer(
+      "num_writer_threads", 2,
+      "The number of threads serializing and writing the output shards "
+      "while the next ones are computed, 0 to write them in the "
+      "inference loop.")
   flags.DEFINE_integer("file_num_mod", None,
                        "file_num % 3 == file_num_mod will be output.")
 
@@ -141,6 +147,10 @@ def inference_loop(video_ids_batch, labels_batch, rgbs_batch, audios_batch, pred
     if not os.path.exists(directory):
         os.makedirs(directory)
 
+    async_writer = shard_writer.AsyncShardWriter(
+        write_to_record, FLAGS.num_writer_threads)
+
+    finished = False
     try:
       threads = []
       for qr in tf.get_collection(tf.GraphKeys.QUEUE_RUNNERS):
@@ -183,7 +193,7 @@ def inference_loop(video_ids_batch, labels_batch, rgbs_batch, audios_batch, pred
             video_audios = np.concatenate(video_audios, axis=0)
             video_predictions = np.concatenate(video_predictions, axis=0)
             video_num_frames = np.concatenate(video_num_frames, axis=0)
-            write_to_record(video_ids, video_labels, video_rgbs, video_audios, video_predictions, video_num_frames, filenum, num_examples_processed)
+            async_writer.submit(video_ids, video_labels, video_rgbs, video_audios, video_predictions, video_num_frames, filenum, num_examples_processed)
 
           video_ids = []
           video_labels = []
@@ -197,6 +207,7 @@ def inference_loop(video_ids_batch, labels_batch, rgbs_batch, audios_batch, pred
           now = time.time()
           logging.info(str(num_examples_processed) + " examples written to file elapsed seconds: " + "{0:.2f}".format(now-start_time))
           num_examples_processed = 0
+      finished = True
 
     except tf.errors.OutOfRangeError as e:
       if ids_val is not None:
@@ -216,7 +227,7 @@ def inference_loop(video_ids_batch, labels_batch, rgbs_batch, audios_batch, pred
           video_audios = np.concatenate(video_audios, axis=0)
           video_predictions = np.concatenate(video_predictions, axis=0)
           video_num_frames = np.concatenate(video_num_frames, axis=0)
-          write_to_record(video_ids, video_labels, video_rgbs, video_audios, video_predictions, video_num_frames, filenum, num_examples_processed)
+          async_writer.submit(video_ids, video_labels, video_rgbs, video_audios, video_predictions, video_num_frames, filenum, num_examples_processed)
 
         total_num_examples_processed += num_examples_processed
 
@@ -225,10 +236,14 @@ def inference_loop(video_ids_batch, labels_batch, rgbs_batch, audios_batch, pred
         num_examples_processed = 0
 
       logging.info("Done with inference. %d samples was written to %s" % (total_num_examples_processed, FLAGS.output_dir))
+      finished = True
     except Exception as e:  # pylint: disable=broad-except
       logging.info("Unexpected exception: " + str(e))
+      finished = True
     finally:
       coord.request_stop()
+      # an error of the writer must not hide the one that stopped the loop
+      async_writer.close(raise_errors=finished)
 
     coord.join(threads, stop_grace_period_secs=10)
 
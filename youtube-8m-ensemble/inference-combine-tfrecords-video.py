@@ -25,6 +25,8 @@ from tensorflow import flags
 from tensorflow import gfile
 from tensorflow import logging
 
+import example_serializer
+import shard_writer
 import utils
 import eval_util
 import losses
@@ -52,6 +54,11 @@ if __name__ == '__main__':
                        "How many examples to process per batch.")
   flags.DEFINE_integer("file_size", 4096,
                        "Number of frames per batch for DBoF.")
+  flags.DEFINE_integer(
+      "num_writer_threads", 2,
+      "The number of threads serializing and writing the output shards "
+      "while the next ones are computed, 0 to write them in the "
+      "inference loop.")
 
 def find_class_by_name(name, modules):
   """Searches the provided modules for the named class and returns it."""
@@ -141,6 +148,10 @@ def inference_loop(video_ids_batch, labels_batch, inputs_batch, predictions_batc
     else:
         raise IOError("Output path exists! path='" + directory + "'")
 
+    async_writer = shard_writer.AsyncShardWriter(
+        write_to_record, FLAGS.num_writer_threads)
+
+    finished = False
     try:
       threads = []
       for qr in tf.get_collection(tf.GraphKeys.QUEUE_RUNNERS):
@@ -174,7 +185,7 @@ def inference_loop(video_ids_batch, labels_batch, inputs_batch, predictions_batc
           video_labels = np.concatenate(video_labels, axis=0)
           video_inputs = np.concatenate(video_inputs, axis=0)
           video_predictions = np.concatenate(video_predictions, axis=0)
-          write_to_record(video_ids, video_labels, video_inputs, video_predictions, filenum, num_examples_processed)
+          async_writer.submit(video_ids, video_labels, video_inputs, video_predictions, filenum, num_examples_processed)
 
           video_ids = []
           video_labels = []
@@ -186,6 +197,7 @@ def inference_loop(video_ids_batch, labels_batch, inputs_batch, predictions_batc
           now = time.time()
           logging.info("num examples processed: " + str(num_examples_processed) + " elapsed seconds: " + "{0:.2f}".format(now-start_time))
           num_examples_processed = 0
+      finished = True
 
     except tf.errors.OutOfRangeError as e:
       if ids_val is not None:
@@ -200,7 +212,7 @@ def inference_loop(video_ids_batch, labels_batch, inputs_batch, predictions_batc
         video_labels = np.concatenate(video_labels, axis=0)
         video_inputs = np.concatenate(video_inputs, axis=0)
         video_predictions = np.concatenate(video_predictions, axis=0)
-        write_to_record(video_ids, video_labels, video_inputs, video_predictions, filenum, num_examples_processed)
+        async_writer.submit(video_ids, video_labels, video_inputs, video_predictions, filenum, num_examples_processed)
         total_num_examples_processed += num_examples_processed
 
         now = time.time()
@@ -208,57 +220,35 @@ def inference_loop(video_ids_batch, labels_batch, inputs_batch, predictions_batc
         num_examples_processed = 0
 
       logging.info("Done with inference. %d samples was written to %s" % (total_num_examples_processed, FLAGS.output_dir))
+      finished = True
     except Exception as e:  # pylint: disable=broad-except
       logging.info("Unexpected exception: " + str(e))
+      finished = True
     finally:
       coord.request_stop()
+      # an error of the writer must not hide the one that stopped the loop
+      async_writer.close(raise_errors=finished)
 
     coord.join(threads, stop_grace_period_secs=10)
 
 
 def write_to_record(video_ids, video_labels, video_inputs, video_predictions, filenum, num_examples_processed):
     writer = tf.python_io.TFRecordWriter(FLAGS.output_dir + '/' + 'predictions-%04d.tfrecord' % filenum)
-    for i in range(num_examples_processed):
-        video_id = video_ids[i]
-        video_label = np.nonzero(video_labels[i,:])[0]
-        video_input = video_inputs[i,:]
-        video_prediction = video_predictions[i,:]
-        example = get_output_feature(video_id, video_label, video_input, video_prediction)
-        serialized = example.SerializeToString()
+    float_features = {}
+    for names, sizes, values in [
+            (FLAGS.input_feature_names, FLAGS.input_feature_sizes, video_inputs),
+            (FLAGS.prediction_feature_names, FLAGS.prediction_feature_sizes, video_predictions)]:
+        feature_start = 0
+        for name, size in zip(names.split(","), map(int, sizes.split(","))):
+            float_features[name] = values[:num_examples_processed, feature_start : feature_start + size]
+            feature_start += size
+    for serialized in example_serializer.serialize_examples(
+            video_ids[:num_examples_processed],
+            video_labels[:num_examples_processed],
+            float_features):
         writer.write(serialized)
     writer.close()
 
-def get_output_feature(video_id, video_label, video_input, video_prediction):
-    feature_maps = {'video_id': tf.train.Feature(bytes_list=tf.train.BytesList(value=[video_id])),
-                    'labels': tf.train.Feature(int64_list=tf.train.Int64List(value=video_label))}
-
-    input_feature_names = FLAGS.input_feature_names.split(",")
-    input_feature_sizes = map(int, FLAGS.input_feature_sizes.split(","))
-
-    input_feature_start = 0
-    for i in range(len(input_feature_names)):
-        feature_maps[input_feature_names[i]] = tf.train.Feature(
-            float_list=tf.train.FloatList(
-                value=video_input[
-                    input_feature_start : 
-                    input_feature_start + input_feature_sizes[i]]))
-        input_feature_start += input_feature_sizes[i]
-
-    prediction_feature_names = FLAGS.prediction_feature_names.split(",")
-    prediction_feature_sizes = map(int, FLAGS.prediction_feature_sizes.split(","))
-
-    prediction_feature_start = 0
-    for i in range(len(prediction_feature_names)):
-        feature_maps[prediction_feature_names[i]] = tf.train.Feature(
-            float_list=tf.train.FloatList(
-                value=video_prediction[
-                    prediction_feature_start : 
-                    prediction_feature_start + prediction_feature_sizes[i]]))
-        prediction_feature_start += prediction_feature_sizes[i]
-
-    example = tf.train.Example(features=tf.train.Features(feature=feature_maps))
-    return example
-
 def main(unused_argv):
   logging.set_verbosity(tf.logging.INFO)
 
@@ -25,9 +25,13 @@ from tensorflow import flags
 from tensorflow import gfile
 from tensorflow import logging
 
+import example_serializer
+import shard_writer
 import utils
 import eval_util
 import losses
+import prediction_store
+import dataset_input
 import readers
 import ensemble_level_models
 
@@ -49,6 +53,19 @@ if __name__ == '__main__':
   flags.DEFINE_string("feature_names", "predictions", "Name of the feature "
                       "to use for training.")
   flags.DEFINE_string("feature_sizes", "4716", "Length of the feature vectors.")
+  flags.DEFINE_bool(
+      "prediction_store", False,
+      "If set, the predictions are read from prediction_store shards and the "
+      "data patterns must match their *.index.npz files.")
+  flags.DEFINE_integer(
+      "sparse_predictions_top_k", 0,
+      "If positive, the predictions are read from sparse top-k tfrecords. "
+      "Must equal the --output_top_k they were written with, the top-k "
+      "features are parsed with a fixed length.")
+  flags.DEFINE_bool(
+      "use_dataset", False,
+      "If set, the input is read by the tf.data pipeline of dataset_input.py "
+      "instead of queue runners. Requires TensorFlow 1.4 or later.")
 
   # Model flags.
   flags.DEFINE_string(
@@ -60,6 +77,29 @@ if __name__ == '__main__':
                       "Loss computed on validation data")
   flags.DEFINE_integer("file_size", 4096,
                        "Number of frames per batch for DBoF.")
+  flags.DEFINE_integer(
+      "num_writer_threads", 2,
+      "The number of threads serializing and writing the output shards "
+      "while the next ones are computed, 0 to write them in the "
+      "inference loop.")
+  flags.DEFINE_bool(
+      "output_prediction_store", False,
+      "If set, the predictions are written as prediction_store shards instead "
+      "of tfrecords.")
+  flags.DEFINE_string(
+      "prediction_store_dtype", "float16",
+      "The dtype of the predictions in the prediction_store shards, float16 "
+      "or float32.")
+  flags.DEFINE_integer(
+      "output_top_k", 0,
+      "If positive, only the top-k (class, score) pairs of every video are "
+      "written, must be less than the number of classes. Read them with "
+      "--sparse_predictions_top_k set to the same value in the ensemble, the "
+      "top-k features are parsed with a fixed length.")
+  flags.DEFINE_bool(
+      "output_top_k_floor", False,
+      "If set, the mean score of the classes outside the top-k is written as "
+      "the floor of the sparse predictions, otherwise the floor is 0.")
 
 def find_class_by_name(name, modules):
   """Searches the provided modules for the named class and returns it."""
@@ -76,15 +116,20 @@ def get_input_data_tensors(reader,
       raise IOError("Unable to find the evaluation files.")
     logging.info("number of evaluation files: " + str(len(files)))
     files.sort()
+    if FLAGS.use_dataset:
+      # the predictions of the models are kept in lockstep, never shuffle
+      return dataset_input.get_input_tensors(
+          reader, files, batch_size, num_epochs=1)
     filename_queue = tf.train.string_input_producer(
         files, shuffle=False, num_epochs=1)
     eval_data = reader.prepare_reader(filename_queue)
-    return tf.train.batch(
+    batch = tf.train.batch(
         eval_data,
         batch_size=batch_size,
         capacity=4 * batch_size,
         allow_smaller_final_batch=True,
         enqueue_many=True)
+    return reader.prepare_batch(batch)
 
 def build_graph(all_readers,
                 all_data_patterns,
@@ -187,6 +232,10 @@ def inference_loop(video_id_batch, prediction_batch,
     else:
         raise IOError("Output path exists! path='" + directory + "'")
 
+    async_writer = shard_writer.AsyncShardWriter(
+        write_to_record, FLAGS.num_writer_threads)
+
+    finished = False
     try:
       threads = []
       for qr in tf.get_collection(tf.GraphKeys.QUEUE_RUNNERS):
@@ -213,7 +262,7 @@ def inference_loop(video_id_batch, prediction_batch,
           video_ids = np.concatenate(video_ids, axis=0)
           video_labels = np.concatenate(video_labels, axis=0)
           video_features = np.concatenate(video_features, axis=0)
-          write_to_record(video_ids, video_labels, video_features, filenum, num_examples_processed)
+          async_writer.submit(video_ids, video_labels, video_features, filenum, num_examples_processed)
 
           video_ids = []
           video_labels = []
@@ -224,6 +273,7 @@ def inference_loop(video_id_batch, prediction_batch,
           now = time.time()
           logging.info("num examples processed: " + str(num_examples_processed) + " elapsed seconds: " + "{0:.2f}".format(now-start_time))
           num_examples_processed = 0
+      finished = True
 
     except tf.errors.OutOfRangeError as e:
       if ids_val is not None:
@@ -236,7 +286,7 @@ def inference_loop(video_id_batch, prediction_batch,
         video_ids = np.concatenate(video_ids, axis=0)
         video_labels = np.concatenate(video_labels, axis=0)
         video_features = np.concatenate(video_features, axis=0)
-        write_to_record(video_ids, video_labels, video_features, filenum, num_examples_processed)
+        async_writer.submit(video_ids, video_labels, video_features, filenum, num_examples_processed)
         total_num_examples_processed += num_examples_processed
 
         now = time.time()
@@ -244,32 +294,61 @@ def inference_loop(video_id_batch, prediction_batch,
         num_examples_processed = 0
 
       logging.info("Done with inference. %d samples was written to %s" % (total_num_examples_processed, FLAGS.output_dir))
+      finished = True
     except Exception as e:  # pylint: disable=broad-except
       logging.info("Unexpected exception: " + str(e))
+      finished = True
     finally:
       coord.request_stop()
+      # an error of the writer must not hide the one that stopped the loop
+      async_writer.close(raise_errors=finished)
 
     coord.join(threads, stop_grace_period_secs=10)
 
 
 def write_to_record(video_ids, video_labels, video_features, filenum, num_examples_processed):
+    if FLAGS.output_top_k > 0:
+        write_top_k_to_record(video_ids, video_labels, video_features, filenum, num_examples_processed)
+        return
+    if FLAGS.output_prediction_store:
+        prediction_store.write_shard(
+            os.path.join(FLAGS.output_dir, 'predictions-%04d' % filenum),
+            video_ids[:num_examples_processed],
+            video_labels[:num_examples_processed],
+            video_features[:num_examples_processed],
+            dtype=FLAGS.prediction_store_dtype)
+        return
     writer = tf.python_io.TFRecordWriter(FLAGS.output_dir + '/' + 'predictions-%04d.tfrecord' % filenum)
-    for i in range(num_examples_processed):
-        video_id = video_ids[i]
-        video_label = np.nonzero(video_labels[i,:])[0]
-        example = get_output_feature(video_id, video_label, [video_features[i,:]], ['predictions'])
-        serialized = example.SerializeToString()
+    for serialized in example_serializer.serialize_examples(
+            video_ids[:num_examples_processed],
+            video_labels[:num_examples_processed],
+            {'predictions': video_features[:num_examples_processed]}):
         writer.write(serialized)
     writer.close()
 
-def get_output_feature(video_id, video_label, video_feature, feature_names):
-    feature_maps = {'video_id': tf.train.Feature(bytes_list=tf.train.BytesList(value=[video_id])),
-                    'labels': tf.train.Feature(int64_list=tf.train.Int64List(value=video_label))}
-    for feature_index in range(len(feature_names)):
-        feature_maps[feature_names[feature_index]] = tf.train.Feature(
-            float_list=tf.train.FloatList(value=video_feature[feature_index]))
-    example = tf.train.Example(features=tf.train.Features(feature=feature_maps))
-    return example
+def write_top_k_to_record(video_ids, video_labels, video_features, filenum, num_examples_processed):
+    top_k = FLAGS.output_top_k
+    video_features = video_features[:num_examples_processed]
+    rows = np.arange(num_examples_processed)[:, np.newaxis]
+    top_k_classes = np.argpartition(-video_features, top_k - 1, axis=1)[:, :top_k]
+    top_k_scores = video_features[rows, top_k_classes]
+    order = np.argsort(-top_k_scores, axis=1)
+    top_k_classes = top_k_classes[rows, order]
+    top_k_scores = top_k_scores[rows, order]
+    if FLAGS.output_top_k_floor:
+        floors = ((video_features.sum(axis=1) - top_k_scores.sum(axis=1)) /
+                  (video_features.shape[1] - top_k))
+    else:
+        floors = np.zeros([num_examples_processed])
+
+    writer = tf.python_io.TFRecordWriter(FLAGS.output_dir + '/' + 'predictions-%04d.tfrecord' % filenum)
+    for serialized in example_serializer.serialize_examples(
+            video_ids[:num_examples_processed],
+            video_labels[:num_examples_processed],
+            {'top_k_scores': top_k_scores, 'floor': floors[:, np.newaxis]},
+            {'top_k_classes': top_k_classes}):
+        writer.write(serialized)
+    writer.close()
 
 def main(unused_argv):
   logging.set_verbosity(tf.logging.INFO)
@@ -285,8 +364,14 @@ def main(unused_argv):
     all_patterns = FLAGS.input_data_patterns
     all_patterns = map(lambda x: x.strip(), all_patterns.strip().strip(",").split(","))
     for i in xrange(len(all_patterns)):
-      reader = readers.EnsembleReader(
-          feature_names=feature_names, feature_sizes=feature_sizes)
+      if FLAGS.prediction_store:
+        reader = readers.EnsemblePredictionStoreReader()
+      elif FLAGS.sparse_predictions_top_k > 0:
+        reader = readers.EnsembleSparseReader(
+            top_k=FLAGS.sparse_predictions_top_k)
+      else:
+        reader = readers.EnsembleReader(
+            feature_names=feature_names, feature_sizes=feature_sizes)
       all_readers.append(reader)
 
     input_reader = None
@@ -303,6 +388,11 @@ def main(unused_argv):
       raise IOError("'input_data_patterns' was not specified. " +
                      "Nothing to evaluate.")
 
+    num_classes = all_readers[0].num_classes
+    if FLAGS.output_top_k and not 0 < FLAGS.output_top_k < num_classes:
+      raise ValueError("'output_top_k' must be between 0 and the number of "
+                       "classes (%d), got %d." % (num_classes, FLAGS.output_top_k))
+
     build_graph(
         all_readers=all_readers,
         input_reader=input_reader,
@@ -18,6 +18,7 @@ import numpy
 import eval_util
 import losses
 import ensemble_level_models
+import dataset_input
 import readers
 import tensorflow as tf
 from tensorflow import app
@@ -43,6 +44,27 @@ if __name__ == "__main__":
   flags.DEFINE_string("feature_names", "predictions", "Name of the feature "
                       "to use for training.")
   flags.DEFINE_string("feature_sizes", "4716", "Length of the feature vectors.")
+  flags.DEFINE_bool(
+      "prediction_store", False,
+      "If set, the predictions are read from prediction_store shards and the "
+      "data patterns must match their *.index.npz files.")
+  flags.DEFINE_integer(
+      "sparse_predictions_top_k", 0,
+      "If positive, the predictions are read from sparse top-k tfrecords. "
+      "Must equal the --output_top_k they were written with, the top-k "
+      "features are parsed with a fixed length.")
+  flags.DEFINE_bool(
+      "join_inputs", False,
+      "If set, the predictions of all the data patterns and the "
+      "--input_data_pattern features are read by one EnsembleJoinReader and "
+      "joined by video_id, instead of one queue per data pattern kept in "
+      "lockstep. The epoch ends with the shortest source, so all the sources "
+      "must contain the same videos; the inference fails if some "
+      "videos were not joined. Cannot be used with --use_dataset.")
+  flags.DEFINE_bool(
+      "use_dataset", False,
+      "If set, the input is read by the tf.data pipeline of dataset_input.py "
+      "instead of queue runners. Requires TensorFlow 1.4 or later.")
 
   # Model flags.
   flags.DEFINE_string(
@@ -82,15 +104,51 @@ def get_input_data_tensors(reader,
       raise IOError("Unable to find the evaluation files.")
     logging.info("number of evaluation files: " + str(len(files)))
     files.sort()
+    if FLAGS.use_dataset:
+      # the predictions of the models are kept in lockstep, never shuffle
+      return dataset_input.get_input_tensors(
+          reader, files, batch_size, num_epochs=1)
     filename_queue = tf.train.string_input_producer(
         files, shuffle=False, num_epochs=1)
     eval_data = reader.prepare_reader(filename_queue)
-    return tf.train.batch(
+    batch = tf.train.batch(
         eval_data,
         batch_size=batch_size,
         capacity=3 * batch_size,
         allow_smaller_final_batch=True,
         enqueue_many=True)
+    return reader.prepare_batch(batch)
+
+
+def get_joined_input_data_tensors(reader,
+                                  data_patterns,
+                                  batch_size=256):
+  """Reads all the sources of a EnsembleJoinReader through one batching queue."""
+  if FLAGS.use_dataset:
+    raise ValueError("--join_inputs cannot be used with --use_dataset.")
+  logging.info("Using batch size of " + str(batch_size) + " for input.")
+  with tf.name_scope("input"):
+    filename_queues = []
+    num_files = 0
+    for data_pattern in data_patterns:
+      files = gfile.Glob(data_pattern)
+      if not files:
+        raise IOError("Unable to find input files. data_pattern='" +
+                      data_pattern + "'.")
+      num_files += len(files)
+      files.sort()
+      filename_queues.append(tf.train.string_input_producer(
+          files, num_epochs=1, shuffle=False))
+    logging.info("Number of input files: %s.", str(num_files))
+    joined_data = reader.prepare_reader(filename_queues)
+
+    batch = tf.train.batch(
+        joined_data,
+        batch_size=batch_size,
+        capacity=3 * batch_size,
+        allow_smaller_final_batch=True,
+        enqueue_many=True)
+    return reader.prepare_batch(batch)
 
 
 def build_graph(all_readers,
@@ -114,25 +172,43 @@ def build_graph(all_readers,
   model_input_raw_tensors = []
   labels_batch_tensor = None
   video_id_batch = None
-  for reader, data_pattern in zip(all_readers, all_data_patterns):
-    unused_video_id, model_input_raw, labels_batch, unused_num_frames = (
-        get_input_data_tensors(
-            reader,
-            data_pattern,
-            batch_size=batch_size))
-    if labels_batch_tensor is None:
-      labels_batch_tensor = labels_batch
-    if video_id_batch is None:
-      video_id_batch = unused_video_id
-    model_input_raw_tensors.append(tf.expand_dims(model_input_raw, axis=2))
-
   original_input = None
-  if input_data_pattern is not None:
-    unused_video_id, original_input, unused_labels_batch, unused_num_frames = (
-        get_input_data_tensors(
-            input_reader,
-            input_data_pattern,
-            batch_size=batch_size))
+  if FLAGS.join_inputs:
+    # the original input is joined by video_id with the predictions
+    if input_data_pattern is not None:
+      reader = readers.EnsembleJoinReader(all_readers, input_reader)
+      all_data_patterns = all_data_patterns + [input_data_pattern]
+    else:
+      reader = readers.EnsembleJoinReader(all_readers)
+    joined_data = get_joined_input_data_tensors(
+        reader,
+        all_data_patterns,
+        batch_size=batch_size)
+    video_id_batch, model_input_raw, labels_batch_tensor, unused_num_frames = (
+        joined_data[:4])
+    model_input_raw_tensors.append(model_input_raw)
+
+    if input_data_pattern is not None:
+      unused_video_id, original_input = joined_data[4:]
+  else:
+    if input_data_pattern is not None:
+      unused_video_id, original_input, unused_labels_batch, unused_num_frames = (
+          get_input_data_tensors(
+              input_reader,
+              input_data_pattern,
+              batch_size=batch_size))
+
+    for reader, data_pattern in zip(all_readers, all_data_patterns):
+      unused_video_id, model_input_raw, labels_batch, unused_num_frames = (
+          get_input_data_tensors(
+              reader,
+              data_pattern,
+              batch_size=batch_size))
+      if labels_batch_tensor is None:
+        labels_batch_tensor = labels_batch
+      if video_id_batch is None:
+        video_id_batch = unused_video_id
+      model_input_raw_tensors.append(tf.expand_dims(model_input_raw, axis=2))
 
   model_input = tf.concat(model_input_raw_tensors, axis=2)
   labels_batch = labels_batch_tensor
@@ -197,6 +273,7 @@ def inference_loop(video_id_batch, prediction_batch, label_batch,
         out_file.flush()
 
     except tf.errors.OutOfRangeError as e:
+      readers.check_join_complete(sess)
       logging.info('Done with inference. The output file was written to ' + out_file_location)
     except Exception as e:  # pylint: disable=broad-except
       logging.info("Unexpected exception: " + str(e))
@@ -219,8 +296,14 @@ def inference():
     all_patterns = FLAGS.input_data_patterns
     all_patterns = map(lambda x: x.strip(), all_patterns.strip().strip(",").split(","))
     for i in xrange(len(all_patterns)):
-      reader = readers.EnsembleReader(
-          feature_names=feature_names, feature_sizes=feature_sizes)
+      if FLAGS.prediction_store:
+        reader = readers.EnsemblePredictionStoreReader()
+      elif FLAGS.sparse_predictions_top_k > 0:
+        reader = readers.EnsembleSparseReader(
+            top_k=FLAGS.sparse_predictions_top_k)
+      else:
+        reader = readers.EnsembleReader(
+            feature_names=feature_names, feature_sizes=feature_sizes)
       all_readers.append(reader)
 
     input_reader = None
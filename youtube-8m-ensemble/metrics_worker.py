@@ -0,0 +1,106 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Background computation of the training metrics.
+
+The training loop submits the predictions and labels it fetched and goes on
+with the next step, while a thread computes, logs and summarizes Hit@1, PERR
+and GAP. The queue of pending batches is bounded, a batch submitted while it
+is full is dropped, so the metrics never slow down training.
+"""
+
+import Queue
+import threading
+
+from tensorflow import logging
+
+import eval_util
+import utils
+
+
+class MetricsWorker(threading.Thread):
+  """Computes the training metrics of submitted batches in a thread."""
+
+  def __init__(self, summary_writer, task_name="", max_pending=2):
+    """Creates a worker, call start() to run it.
+
+    Args:
+      summary_writer: the writer the metric summaries are added to.
+      task_name: the name of the task, prefixed to the log messages.
+      max_pending: the number of batches that may wait to be processed.
+    """
+    super(MetricsWorker, self).__init__(name="MetricsWorker")
+    self.daemon = True
+    self.num_dropped = 0
+    self._summary_writer = summary_writer
+    self._task_name = task_name
+    self._queue = Queue.Queue(maxsize=max(max_pending, 1))
+
+  def submit(self, global_step_val, predictions_val, labels_val, loss_val,
+             examples_per_second, extra_info=""):
+    """Hands a batch to the worker, returns False if it was dropped.
+
+    extra_info is appended to the log message of the batch.
+    """
+    try:
+      self._queue.put_nowait((global_step_val, predictions_val, labels_val,
+                              loss_val, examples_per_second, extra_info))
+      return True
+    except Queue.Full:
+      self.num_dropped += 1
+      return False
+
+  def stop(self):
+    """Processes the pending batches and stops the worker."""
+    self._queue.put(None)
+    self.join()
+    if self.num_dropped:
+      logging.info("%s: metrics of %d batches were dropped.", self._task_name,
+                   self.num_dropped)
+
+  def run(self):
+    while True:
+      item = self._queue.get()
+      if item is None:
+        break
+      try:
+        self._process(*item)
+      except Exception as e:  # pylint: disable=broad-except
+        logging.warning("%s: failed to compute the training metrics: %s",
+                        self._task_name, str(e))
+
+  def _process(self, global_step_val, predictions_val, labels_val, loss_val,
+               examples_per_second, extra_info):
+    hit_at_one = eval_util.calculate_hit_at_one(predictions_val, labels_val)
+    perr = eval_util.calculate_precision_at_equal_recall_rate(
+        predictions_val, labels_val)
+    gap = eval_util.calculate_gap(predictions_val, labels_val)
+
+    logging.info(
+        "%s: training step " + str(global_step_val) + "| Hit@1: " +
+        ("%.2f" % hit_at_one) + " PERR: " + ("%.2f" % perr) + " GAP: " +
+        ("%.2f" % gap) + " Loss: " + str(loss_val) + extra_info,
+        self._task_name)
+
+    self._summary_writer.add_summary(
+        utils.MakeSummary("model/Training_Hit@1", hit_at_one),
+        global_step_val)
+    self._summary_writer.add_summary(
+        utils.MakeSummary("model/Training_Perr", perr), global_step_val)
+    self._summary_writer.add_summary(
+        utils.MakeSummary("model/Training_GAP", gap), global_step_val)
+    self._summary_writer.add_summary(
+        utils.MakeSummary("global_step/Examples/Second",
+                          examples_per_second), global_step_val)
+    self._summary_writer.flush()
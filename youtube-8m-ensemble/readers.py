@@ -15,7 +15,9 @@
 """Provides readers configured for different datasets."""
 
 import sys
+import numpy
 import tensorflow as tf
+import prediction_store
 import utils
 
 from tensorflow import logging
@@ -48,6 +50,18 @@ class BaseReader(object):
     """Create a thread for generating prediction and label tensors."""
     raise NotImplementedError()
 
+  def prepare_serialized_examples(self, unused_serialized_examples):
+    """Parses a batch of serialized examples into the prepare_reader tensors.
+
+    Used by the tf.data input pipeline in dataset_input.py.
+    """
+    raise NotImplementedError("%s can not be used with a dataset input." %
+                              type(self).__name__)
+
+  def prepare_batch(self, batch):
+    """Post-processes the tensors dequeued from the batching queue."""
+    return batch
+
 
 class EnsembleReader(BaseReader):
 
@@ -68,7 +82,9 @@ class EnsembleReader(BaseReader):
 
     reader = tf.TFRecordReader()
     _, serialized_examples = reader.read_up_to(filename_queue, batch_size)
+    return self.prepare_serialized_examples(serialized_examples)
 
+  def prepare_serialized_examples(self, serialized_examples):
     # set the mapping from the fields to data types in the proto
     num_features = len(self.feature_names)
     assert num_features > 0, "self.feature_names is empty!"
@@ -90,6 +106,293 @@ class EnsembleReader(BaseReader):
 
     return features["video_id"], concatenated_features, labels, tf.ones([tf.shape(serialized_examples)[0]])
 
+class EnsemblePredictionStoreReader(BaseReader):
+  """Reads the predictions of a model from prediction_store shards.
+
+  The data pattern must match the *.index.npz files of the shards, every read
+  serves a whole shard.
+  """
+
+  def __init__(self, num_classes=4716):
+    self.num_classes = num_classes
+
+  def read_shard(self, index_filename):
+    shard = prediction_store.PredictionShard(index_filename)
+    if shard.num_classes != self.num_classes:
+      raise ValueError("'%s' has %d classes, expected %d." %
+                       (index_filename, shard.num_classes, self.num_classes))
+    return shard.read()
+
+  def prepare_reader(self, filename_queue, batch_size=1024):
+    index_filename = filename_queue.dequeue()
+    video_ids, predictions, labels = tf.py_func(
+        self.read_shard, [index_filename], [tf.string, tf.float32, tf.bool])
+    video_ids.set_shape([None])
+    predictions.set_shape([None, self.num_classes])
+    labels.set_shape([None, self.num_classes])
+    return video_ids, predictions, labels, tf.ones([tf.shape(video_ids)[0]])
+
+class EnsembleSparseReader(BaseReader):
+  """Reads predictions stored as their top-k (class, score) pairs.
+
+  The examples hold "top_k_classes", "top_k_scores" and an optional "floor"
+  score of the other classes. They stay sparse in the batching queue and are
+  densified to [batch_size, num_classes] by prepare_batch after dequeue.
+  """
+
+  def __init__(self, num_classes=4716, top_k=100):
+    self.num_classes = num_classes
+    self.top_k = top_k
+
+  def prepare_reader(self, filename_queue, batch_size=1024):
+
+    reader = tf.TFRecordReader()
+    _, serialized_examples = reader.read_up_to(filename_queue, batch_size)
+    return self.prepare_serialized_examples(serialized_examples)
+
+  def prepare_serialized_examples(self, serialized_examples):
+    feature_map = {"video_id": tf.FixedLenFeature([], tf.string),
+                   "labels": tf.VarLenFeature(tf.int64),
+                   "top_k_classes": tf.FixedLenFeature([self.top_k], tf.int64),
+                   "top_k_scores": tf.FixedLenFeature([self.top_k], tf.float32),
+                   "floor": tf.FixedLenFeature([], tf.float32, default_value=0.0)}
+
+    features = tf.parse_example(serialized_examples, features=feature_map)
+    labels = tf.sparse_to_indicator(features["labels"], self.num_classes)
+    labels.set_shape([None, self.num_classes])
+
+    # class ids are exact in float32, pack everything into one queue tensor
+    sparse_predictions = tf.concat([
+        tf.cast(features["top_k_classes"], tf.float32),
+        features["top_k_scores"],
+        tf.expand_dims(features["floor"], 1)], 1)
+
+    return features["video_id"], sparse_predictions, labels, tf.ones([tf.shape(serialized_examples)[0]])
+
+  def prepare_batch(self, batch):
+    video_ids, sparse_predictions, labels, num_frames = batch
+    return video_ids, self.densify(sparse_predictions), labels, num_frames
+
+  def densify(self, sparse_predictions):
+    """Turns [batch_size, 2 * top_k + 1] packed predictions into dense ones."""
+    classes = tf.cast(sparse_predictions[:, :self.top_k], tf.int64)
+    scores = sparse_predictions[:, self.top_k:2 * self.top_k]
+    floor = sparse_predictions[:, 2 * self.top_k:]
+
+    batch_size = tf.shape(sparse_predictions, out_type=tf.int64)[0]
+    rows = tf.tile(tf.expand_dims(tf.range(batch_size), 1), [1, self.top_k])
+    indices = tf.stack([tf.reshape(rows, [-1]), tf.reshape(classes, [-1])], 1)
+    dense_predictions = tf.sparse_to_dense(
+        indices, tf.stack([batch_size, self.num_classes]),
+        tf.reshape(scores - floor, [-1]), validate_indices=False) + floor
+    dense_predictions.set_shape([None, self.num_classes])
+    return dense_predictions
+
+class VideoIdJoin(object):
+  """Joins the rows of several sources on their video ids, chunk by chunk.
+
+  The rows of a video are kept until the video has been read from every
+  source, so the sources may list their videos in any order and in shards
+  of any size. Videos never read from every source stay pending until
+  flush is called. The rows are kept as read, e.g. sparse predictions stay
+  packed, and the joined values of every source are returned on their own.
+
+  The first num_sources sources hold predictions, the other ones (e.g. the
+  original input features) also return the video ids they were read with.
+  """
+
+  def __init__(self, num_sources, num_extra_sources=0):
+    self.num_sources = num_sources
+    self.pending = [dict() for _ in range(num_sources + num_extra_sources)]
+
+  def num_pending(self):
+    return numpy.int64(len(self.pending_video_ids()))
+
+  def pending_video_ids(self):
+    video_ids = set()
+    for pending in self.pending:
+      video_ids.update(pending)
+    return sorted(video_ids)
+
+  def flush(self):
+    """Forgets the pending rows and returns the video ids they belonged to."""
+    video_ids = numpy.array(self.pending_video_ids(), dtype=object)
+    for pending in self.pending:
+      pending.clear()
+    return video_ids
+
+  def join(self, labels, num_frames, *source_chunks):
+    """Adds a chunk of every source and returns the videos now complete.
+
+    Args:
+      labels: the labels of the chunk of the first source.
+      num_frames: the numbers of frames of the chunk of the first source.
+      *source_chunks: the video ids and the values of the chunk of every
+        source, interleaved.
+
+    Returns:
+      The video ids, the labels and the numbers of frames of the joined
+      videos, followed by the values of every source, and by the video ids
+      every extra source read them with.
+    """
+    source_ids = source_chunks[0::2]
+    source_values = source_chunks[1::2]
+    new_ids = []
+    for source, (video_ids, values) in enumerate(
+        zip(source_ids, source_values)):
+      pending = self.pending[source]
+      for i, video_id in enumerate(video_ids):
+        if video_id not in pending:
+          new_ids.append(video_id)
+        if source == 0:
+          pending[video_id] = (values[i], labels[i], num_frames[i])
+        else:
+          pending[video_id] = (values[i], video_id)
+
+    joined_ids, rows = [], []
+    for video_id in new_ids:
+      if all(video_id in pending for pending in self.pending):
+        joined_ids.append(video_id)
+        rows.append([pending.pop(video_id) for pending in self.pending])
+
+    def stack(source, field, empty):
+      if not rows:
+        return empty[:0]
+      return numpy.stack([row[source][field] for row in rows])
+
+    joined = [numpy.array(joined_ids, dtype=source_ids[0].dtype),
+              stack(0, 1, labels), stack(0, 2, num_frames)]
+    for source, values in enumerate(source_values):
+      joined.append(stack(source, 0, values))
+    for source in range(self.num_sources, len(self.pending)):
+      joined.append(numpy.array([row[source][1] for row in rows],
+                                dtype=source_ids[source].dtype))
+    return tuple(joined)
+
+class EnsembleJoinReader(BaseReader):
+  """Reads the predictions of several models joined by video_id.
+
+  Every source has its own filename queue and a chunk of each is read per
+  run. The chunks are joined by VideoIdJoin, which keeps the rows of the
+  videos not yet read from every source, so the sources need not be
+  sharded or ordered alike. Since a run reads all the sources, the epoch
+  ends with the shortest source, and the pending rows grow with how far
+  apart the sources list the same video. The rows still pending at the end
+  of the epoch are lost, check_join_complete raises if there are any.
+  """
+
+  def __init__(self, source_readers, input_reader=None):
+    """Construct a EnsembleJoinReader.
+
+    Args:
+      source_readers: a reader for every prediction source, the predictions
+        of all sources must have the same size.
+      input_reader: an optional EnsembleReader of the original input
+        features, joined by video_id like the prediction sources.
+    """
+    assert len(source_readers) > 0, "source_readers is empty!"
+    self.source_readers = source_readers
+    self.input_reader = input_reader
+    self.num_classes = source_readers[0].num_classes
+    self.video_id_join = VideoIdJoin(len(source_readers),
+                                     0 if input_reader is None else 1)
+
+  def all_readers(self):
+    """Returns the readers of the sources, the input reader last."""
+    if self.input_reader is None:
+      return list(self.source_readers)
+    return list(self.source_readers) + [self.input_reader]
+
+  def prepare_reader(self, filename_queues, batch_size=1024):
+    """Creates a single joined reader thread.
+
+    The values of the sources are joined as read, e.g. sparse predictions
+    stay packed in the batching queue, prepare_batch turns them into the
+    predictions of the models.
+
+    Args:
+      filename_queues: a filename queue for every source reader, followed by
+        one for the input reader if there is one.
+      batch_size: the maximum number of examples read from a source at once.
+
+    Returns:
+      A tuple of video indexes, labels, number of frames and the values of
+      every source. With an input reader, it is followed by the video ids the
+      input features were read with.
+    """
+    all_readers = self.all_readers()
+    assert len(filename_queues) == len(all_readers), \
+    "length of filename_queues (={}) != number of sources (={})".format( \
+    len(filename_queues), len(all_readers))
+
+    chunks = [reader.prepare_reader(queue, batch_size)
+              for reader, queue in zip(all_readers, filename_queues)]
+
+    unused_video_ids, unused_values, labels, num_frames = chunks[0]
+    source_chunks = []
+    for source_video_ids, source_values, _, _ in chunks:
+      source_chunks.extend([source_video_ids, source_values])
+    output_types = [tf.string, labels.dtype, num_frames.dtype]
+    output_types.extend([chunk[1].dtype for chunk in chunks])
+    if self.input_reader is not None:
+      output_types.append(tf.string)
+    joined_data = tf.py_func(
+        self.video_id_join.join, [labels, num_frames] + source_chunks,
+        output_types)
+    joined_data[0].set_shape([None])
+    joined_data[1].set_shape(labels.get_shape())
+    joined_data[2].set_shape(num_frames.get_shape())
+    for values, chunk in zip(joined_data[3:], chunks):
+      values.set_shape(chunk[1].get_shape())
+    if self.input_reader is not None:
+      joined_data[-1].set_shape([None])
+
+    num_pending = tf.py_func(self.video_id_join.num_pending, [], tf.int64)
+    tf.summary.scalar("input/join_pending", num_pending)
+    tf.add_to_collection(
+        "join_pending_video_ids",
+        tf.py_func(self.video_id_join.flush, [], tf.string))
+    return joined_data
+
+  def prepare_batch(self, batch):
+    """Turns the dequeued values of the sources into stacked predictions.
+
+    Returns:
+      A tuple of video indexes, [batch_size, num_classes, num_sources]
+      predictions, labels and number of frames. With an input reader, it is
+      followed by the video ids the input features were read with and the
+      input features.
+    """
+    video_ids, labels, num_frames = batch[:3]
+    source_values = batch[3:3 + len(self.source_readers)]
+    predictions = [
+        reader.prepare_batch((video_ids, values, labels, num_frames))[1]
+        for reader, values in zip(self.source_readers, source_values)]
+    joined_batch = [video_ids, tf.stack(predictions, axis=2), labels,
+                    num_frames]
+    if self.input_reader is not None:
+      joined_batch.extend([batch[-1], batch[-2]])
+    return tuple(joined_batch)
+
+def check_join_complete(sess):
+  """Raises if an EnsembleJoinReader ended the epoch with pending videos.
+
+  The epoch of a EnsembleJoinReader ends with its shortest source, the
+  videos not read from every source by then are missing from the output.
+  They are logged and forgotten, so that the next epoch starts clean.
+  """
+  for pending_video_ids in tf.get_collection("join_pending_video_ids"):
+    video_ids = sess.run(pending_video_ids)
+    if len(video_ids) > 0:
+      logging.error("Videos not read from every joined source: %s%s",
+                    ", ".join(video_id.decode("utf-8")
+                              for video_id in video_ids[:20]),
+                    ", ..." if len(video_ids) > 20 else "")
+      raise ValueError(
+          "%d videos were not read from every joined source by the end of "
+          "the epoch, the sources must contain the same videos." %
+          len(video_ids))
+
 class EnsembleFrameReader(BaseReader):
 
   def __init__(self,
@@ -0,0 +1,105 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Writes the output shards of an inference loop in background threads.
+
+The inference loop submits every finished shard with its number and goes on
+with the next batches while a pool of threads serializes and writes the
+submitted shards. Each shard is written to the file named after its number,
+so the output does not depend on the order the threads finish in. The
+number of pending shards is bounded, the loop blocks when it is reached.
+"""
+
+import Queue
+import threading
+
+from tensorflow import logging
+
+
+class AsyncShardWriter(object):
+  """Calls a shard writing function in a pool of threads."""
+
+  def __init__(self, write_fn, num_threads=2, max_pending=None):
+    """Creates a writer and starts its threads.
+
+    Args:
+      write_fn: the function writing a shard, called with the arguments of
+        submit.
+      num_threads: the number of writing threads, 0 to write the shards in
+        submit.
+      max_pending: the number of submitted shards that may wait for a
+        thread, num_threads if None.
+    """
+    self._write_fn = write_fn
+    self._error = None
+    self._threads = []
+    if max_pending is None:
+      max_pending = num_threads
+    self._queue = Queue.Queue(maxsize=max(max_pending, 1))
+    for i in range(num_threads):
+      thread = threading.Thread(target=self._run,
+                                name="AsyncShardWriter-%d" % i)
+      thread.daemon = True
+      thread.start()
+      self._threads.append(thread)
+
+  def submit(self, *args):
+    """Hands a shard to the pool, args are passed to write_fn."""
+    self._check_error()
+    if self._threads:
+      self._queue.put(args)
+    else:
+      self._write_fn(*args)
+
+  def close(self, last_shards=(), raise_errors=True):
+    """Waits for the submitted shards to be written and stops the threads.
+
+    Args:
+      last_shards: the submit arguments of the last shards to write.
+      raise_errors: if False, a write error is only logged. Pass False when
+        closing while another exception propagates, so that it is not hidden.
+    """
+    if not raise_errors:
+      try:
+        self.close(last_shards)
+      except Exception as e:  # pylint: disable=broad-except
+        logging.error("failed to write the shards: %s", str(e))
+      return
+    try:
+      for args in last_shards:
+        self.submit(*args)
+    finally:
+      for _ in self._threads:
+        self._queue.put(None)
+      for thread in self._threads:
+        thread.join()
+      self._threads = []
+    self._check_error()
+
+  def _check_error(self):
+    if self._error is not None:
+      raise self._error
+
+  def _run(self):
+    while True:
+      args = self._queue.get()
+      if args is None:
+        break
+      if self._error is not None:
+        continue
+      try:
+        self._write_fn(*args)
+      except Exception as e:  # pylint: disable=broad-except
+        logging.error("failed to write a shard: %s", str(e))
+        self._error = e
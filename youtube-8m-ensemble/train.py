@@ -20,8 +20,10 @@ import numpy
 import numpy as np
 
 import eval_util
+import metrics_worker as metrics_worker_lib
 import losses
 import ensemble_level_models
+import dataset_input
 import readers
 import tensorflow as tf
 import tensorflow.contrib.slim as slim
@@ -46,6 +48,26 @@ if __name__ == "__main__":
   flags.DEFINE_string("feature_names", "predictions", "Name of the feature "
                       "to use for training.")
   flags.DEFINE_string("feature_sizes", "4716", "Length of the feature vectors.")
+  flags.DEFINE_bool(
+      "prediction_store", False,
+      "If set, the predictions are read from prediction_store shards and the "
+      "data patterns must match their *.index.npz files.")
+  flags.DEFINE_integer(
+      "sparse_predictions_top_k", 0,
+      "If positive, the predictions are read from sparse top-k tfrecords. "
+      "Must equal the --output_top_k they were written with, the top-k "
+      "features are parsed with a fixed length.")
+  flags.DEFINE_bool(
+      "join_inputs", False,
+      "If set, the predictions of all the data patterns and the "
+      "--input_data_pattern features are read by one EnsembleJoinReader and "
+      "joined by video_id, instead of one queue per data pattern kept in "
+      "lockstep. The epoch ends with the shortest source, so all the sources "
+      "must contain the same videos. Cannot be used with --use_dataset.")
+  flags.DEFINE_bool(
+      "use_dataset", False,
+      "If set, the input is read by the tf.data pipeline of dataset_input.py "
+      "instead of queue runners. Requires TensorFlow 1.4 or later.")
 
   # Model flags.
   flags.DEFINE_string(
@@ -100,6 +122,16 @@ if __name__ == "__main__":
       "logs on startup.")
   flags.DEFINE_integer("recall_at_n", 100,
                        "N in recall@N.")
+  flags.DEFINE_integer(
+      "metrics_every_n_steps", 1,
+      "How often, in steps, the training metrics are computed and logged.")
+  flags.DEFINE_bool(
+      "async_metrics", False,
+      "If set, the fetched predictions and labels are handed to a background "
+      "thread that computes the training metrics while the next step runs.")
+  flags.DEFINE_integer(
+      "async_metrics_queue_size", 2,
+      "How many batches may wait for the metrics thread, more are dropped.")
   flags.DEFINE_bool("training", True,
                     "Whether to train")
   flags.DEFINE_bool(
@@ -122,16 +154,53 @@ def get_input_data_tensors(reader,
                     data_pattern + "'.")
     logging.info("Number of training files: %s.", str(len(files)))
     files.sort()
+    if FLAGS.use_dataset:
+      # the predictions of the models are kept in lockstep, never shuffle
+      return dataset_input.get_input_tensors(
+          reader, files, batch_size, num_epochs=num_epochs)
     filename_queue = tf.train.string_input_producer(
         files, num_epochs=num_epochs, shuffle=False)
     training_data = reader.prepare_reader(filename_queue)
 
-    return tf.train.batch(
+    batch = tf.train.batch(
         training_data,
         batch_size=batch_size,
         capacity=FLAGS.batch_size * 4,
         allow_smaller_final_batch=True,
         enqueue_many=True)
+    return reader.prepare_batch(batch)
+
+
+def get_joined_input_data_tensors(reader,
+                                  data_patterns,
+                                  batch_size=256,
+                                  num_epochs=None):
+  """Reads all the sources of a EnsembleJoinReader through one batching queue."""
+  if FLAGS.use_dataset:
+    raise ValueError("--join_inputs cannot be used with --use_dataset.")
+  logging.info("Using batch size of " + str(batch_size) + " for training.")
+  with tf.name_scope("train_input"):
+    filename_queues = []
+    num_files = 0
+    for data_pattern in data_patterns:
+      files = gfile.Glob(data_pattern)
+      if not files:
+        raise IOError("Unable to find training files. data_pattern='" +
+                      data_pattern + "'.")
+      num_files += len(files)
+      files.sort()
+      filename_queues.append(tf.train.string_input_producer(
+          files, num_epochs=num_epochs, shuffle=False))
+    logging.info("Number of training files: %s.", str(num_files))
+    joined_data = reader.prepare_reader(filename_queues)
+
+    batch = tf.train.batch(
+        joined_data,
+        batch_size=batch_size,
+        capacity=FLAGS.batch_size * 4,
+        allow_smaller_final_batch=True,
+        enqueue_many=True)
+    return reader.prepare_batch(batch)
 
 
 def find_class_by_name(name, modules):
@@ -219,33 +288,54 @@ def build_graph(all_readers,
       staircase=True)
   tf.summary.scalar('learning_rate', learning_rate)
 
-  original_input = None
-  if input_data_pattern is not None:
-    original_video_id, original_input, unused_labels_batch, unused_num_frames = (
-        get_input_data_tensors(
-            input_reader,
-            input_data_pattern,
-            batch_size=batch_size,
-            num_epochs=num_epochs))
-  
   optimizer = optimizer_class(learning_rate)
   model_input_raw_tensors = []
   labels_batch_tensor = None
-  for reader, data_pattern in zip(all_readers, all_train_data_patterns):
-    video_id, model_input_raw, labels_batch, unused_num_frames = (
-        get_input_data_tensors(
-            reader,
-            data_pattern,
-            batch_size=batch_size,
-            num_epochs=num_epochs))
-    if labels_batch_tensor is None:
-      labels_batch_tensor = labels_batch
-    model_input_raw_tensors.append(tf.expand_dims(model_input_raw, axis=2))
-    
-    if original_input is not None:
-      id_match = tf.ones_like(original_video_id, dtype=tf.float32)
-      id_match = id_match * tf.cast(tf.equal(original_video_id, video_id), dtype=tf.float32)
+  original_input = None
+  if FLAGS.join_inputs:
+    # the original input is joined by video_id with the predictions
+    if input_data_pattern is not None:
+      reader = readers.EnsembleJoinReader(all_readers, input_reader)
+      all_train_data_patterns = all_train_data_patterns + [input_data_pattern]
+    else:
+      reader = readers.EnsembleJoinReader(all_readers)
+    joined_data = get_joined_input_data_tensors(
+        reader,
+        all_train_data_patterns,
+        batch_size=batch_size,
+        num_epochs=num_epochs)
+    video_id, model_input_raw, labels_batch_tensor, unused_num_frames = (
+        joined_data[:4])
+    model_input_raw_tensors.append(model_input_raw)
+
+    if input_data_pattern is not None:
+      original_video_id, original_input = joined_data[4:]
+      id_match = tf.cast(tf.equal(original_video_id, video_id), dtype=tf.float32)
       tf.summary.scalar("model/id_match", tf.reduce_mean(id_match))
+  else:
+    if input_data_pattern is not None:
+      original_video_id, original_input, unused_labels_batch, unused_num_frames = (
+          get_input_data_tensors(
+              input_reader,
+              input_data_pattern,
+              batch_size=batch_size,
+              num_epochs=num_epochs))
+
+    for reader, data_pattern in zip(all_readers, all_train_data_patterns):
+      video_id, model_input_raw, labels_batch, unused_num_frames = (
+          get_input_data_tensors(
+              reader,
+              data_pattern,
+              batch_size=batch_size,
+              num_epochs=num_epochs))
+      if labels_batch_tensor is None:
+        labels_batch_tensor = labels_batch
+      model_input_raw_tensors.append(tf.expand_dims(model_input_raw, axis=2))
+
+      if original_input is not None:
+        id_match = tf.ones_like(original_video_id, dtype=tf.float32)
+        id_match = id_match * tf.cast(tf.equal(original_video_id, video_id), dtype=tf.float32)
+        tf.summary.scalar("model/id_match", tf.reduce_mean(id_match))
 
   model_input = tf.concat(model_input_raw_tensors, axis=2)
   labels_batch = labels_batch_tensor
@@ -429,10 +519,19 @@ class Trainer(object):
       if FLAGS.reweight:
         optional_assign_weights(sess, weights_input, weights_assignment)
 
+      metrics_worker = None
+      if self.is_master and FLAGS.async_metrics:
+        metrics_worker = metrics_worker_lib.MetricsWorker(
+            sv.summary_writer, task_as_string(self.task),
+            FLAGS.async_metrics_queue_size)
+        metrics_worker.start()
+
+      steps = 0
       try:
         logging.info("%s: Entering training loop.", task_as_string(self.task))
         while not sv.should_stop():
 
+          steps += 1
           batch_start_time = time.time()
           custom_feed = {}
           if FLAGS.dropout:
@@ -440,11 +539,21 @@ class Trainer(object):
           if FLAGS.noise_level > 0:
             custom_feed[noise_level_tensor] = FLAGS.noise_level
 
-          _, global_step_val, loss_val, predictions_val, labels_val = sess.run(
-              [train_op, global_step, loss, predictions, labels], feed_dict=custom_feed)
+          compute_metrics = self.is_master and (
+              steps % max(FLAGS.metrics_every_n_steps, 1) == 0)
+          if compute_metrics:
+            _, global_step_val, loss_val, predictions_val, labels_val = sess.run(
+                [train_op, global_step, loss, predictions, labels], feed_dict=custom_feed)
+          else:
+            _, global_step_val, loss_val = sess.run(
+                [train_op, global_step, loss], feed_dict=custom_feed)
           seconds_per_batch = time.time() - batch_start_time
 
-          if self.is_master:
+          if compute_metrics and metrics_worker is not None:
+            metrics_worker.submit(global_step_val, predictions_val, labels_val,
+                                  loss_val,
+                                  labels_val.shape[0] / seconds_per_batch)
+          elif compute_metrics:
             examples_per_second = labels_val.shape[0] / seconds_per_batch
             hit_at_one = eval_util.calculate_hit_at_one(predictions_val,
                                                         labels_val)
@@ -481,6 +590,9 @@ class Trainer(object):
       except tf.errors.OutOfRangeError:
         logging.info("%s: Done training -- epoch limit reached.",
                      task_as_string(self.task))
+      finally:
+        if metrics_worker is not None:
+          metrics_worker.stop()
 
     logging.info("%s: Exited training loop.", task_as_string(self.task))
     sv.Stop()
@@ -553,8 +665,14 @@ class Trainer(object):
     all_patterns = FLAGS.train_data_patterns
     all_patterns = map(lambda x: x.strip(), all_patterns.strip().strip(",").split(","))
     for i in xrange(len(all_patterns)):
-      all_readers.append(readers.EnsembleReader(
-          feature_names=feature_names, feature_sizes=feature_sizes))
+      if FLAGS.prediction_store:
+        all_readers.append(readers.EnsemblePredictionStoreReader())
+      elif FLAGS.sparse_predictions_top_k > 0:
+        all_readers.append(readers.EnsembleSparseReader(
+            top_k=FLAGS.sparse_predictions_top_k))
+      else:
+        all_readers.append(readers.EnsembleReader(
+            feature_names=feature_names, feature_sizes=feature_sizes))
 
     input_reader = None
     input_data_pattern = None
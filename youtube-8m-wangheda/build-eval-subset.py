@@ -0,0 +1,158 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Binary for building a label-stratified subset of an evaluation dataset.
+
+The videos are chosen from a video index (see build-video-index.py) so that
+every class has at least min_positives positives, rarest classes first, and
+the subset is then filled up to subset_fraction of the videos with a uniform
+sample, so the GAP on the subset follows the GAP on the full set. The video
+ids of the subset are saved to output_video_ids, which eval.py accepts with
+--eval_subset_video_ids, and the records of the subset can be written to
+their own shards in output_data_dir to read only them. With
+subset_video_ids, the selection is skipped and a subset chosen before is
+written from the dataset of video_index, e.g. the predictions of another
+model.
+"""
+
+import os
+import time
+
+import numpy
+
+import tensorflow as tf
+from tensorflow import app
+from tensorflow import flags
+from tensorflow import gfile
+from tensorflow import logging
+
+import video_index as video_index_lib
+
+FLAGS = flags.FLAGS
+
+if __name__ == "__main__":
+  flags.DEFINE_string("video_index", "",
+                      "The video index of the evaluation dataset.")
+  flags.DEFINE_integer("min_positives", 10,
+                       "The minimum number of positives of every class.")
+  flags.DEFINE_float("subset_fraction", 0.05,
+                     "The fraction of the videos the subset is filled to.")
+  flags.DEFINE_integer("seed", 0, "The seed of the selection.")
+  flags.DEFINE_string("subset_video_ids", "",
+                      "If set, the .npy file of a subset built before, which "
+                      "is written instead of selecting a new one.")
+  flags.DEFINE_string("output_video_ids", "",
+                      "The .npy file to save the video ids of the subset to.")
+  flags.DEFINE_string("output_data_dir", "",
+                      "If set, the records of the subset are written to "
+                      "shards in this directory.")
+  flags.DEFINE_integer("records_per_shard", 4096,
+                       "How many records are written to every shard.")
+
+
+def select_subset(index, min_positives, subset_fraction, seed=0):
+  """Chooses a label-stratified subset of the videos of a VideoIndex.
+
+  Returns:
+    The sorted positions of the chosen videos in the index.
+  """
+  num_videos = len(index)
+  if len(index.label_indices):
+    num_classes = int(index.label_indices.max()) + 1
+  else:
+    logging.warning("the indexed videos have no labels, the subset is drawn "
+                    "at random.")
+    num_classes = 0
+  rows = numpy.repeat(numpy.arange(num_videos),
+                      numpy.diff(index.label_offsets))
+  # the videos of every class, in a random order
+  priority = numpy.random.RandomState(seed).permutation(num_videos)
+  order = numpy.lexsort((priority[rows], index.label_indices))
+  class_videos = rows[order]
+  class_offsets = numpy.zeros([num_classes + 1], dtype=numpy.int64)
+  class_offsets[1:] = numpy.cumsum(
+      numpy.bincount(index.label_indices,
+                     minlength=max(num_classes, 1))[:num_classes])
+
+  selected = numpy.zeros([num_videos], dtype=numpy.bool_)
+  counts = numpy.zeros([num_classes], dtype=numpy.int64)
+  for label in numpy.argsort(numpy.diff(class_offsets), kind="mergesort"):
+    need = min_positives - counts[label]
+    if need <= 0:
+      continue
+    videos = class_videos[class_offsets[label]:class_offsets[label + 1]]
+    videos = videos[~selected[videos]][:need]
+    selected[videos] = True
+    for video in videos:
+      counts[index.get_labels(video)] += 1
+
+  num_stratified = numpy.count_nonzero(selected)
+  num_fill = int(subset_fraction * num_videos) - num_stratified
+  if num_fill > 0:
+    unselected = priority[~selected[priority]]
+    selected[unselected[:num_fill]] = True
+  logging.info("selected %d videos, %d to cover the classes, %d classes have "
+               "less than %d positives in the whole dataset.",
+               numpy.count_nonzero(selected), num_stratified,
+               numpy.count_nonzero(numpy.diff(class_offsets) < min_positives),
+               min_positives)
+  return numpy.nonzero(selected)[0]
+
+
+def write_subset(index, video_ids, output_dir, records_per_shard):
+  """Writes the records of video_ids from the dataset of index to shards."""
+  if not gfile.Exists(output_dir):
+    gfile.MakeDirs(output_dir)
+  positions = index.lookup(video_ids)
+  if (positions < 0).any():
+    logging.warning("%d videos of the subset are not in the index.",
+                    numpy.count_nonzero(positions < 0))
+  video_ids = numpy.asarray(video_ids)[positions >= 0]
+
+  start_time = time.time()
+  for shard, start in enumerate(range(0, len(video_ids), records_per_shard)):
+    filename = os.path.join(output_dir, "subset-%04d.tfrecord" % shard)
+    records = index.read_records(video_ids[start:start + records_per_shard])
+    writer = tf.python_io.TFRecordWriter(filename)
+    for record in records:
+      writer.write(record)
+    writer.close()
+    logging.info("written %s, elapsed seconds: %.2f", filename,
+                 time.time() - start_time)
+
+
+def main(unused_argv):
+  logging.set_verbosity(tf.logging.INFO)
+
+  if FLAGS.video_index is "":
+    raise ValueError("'video_index' was not specified. "
+      "Unable to continue with building the subset.")
+
+  index = video_index_lib.VideoIndex(FLAGS.video_index)
+  if FLAGS.subset_video_ids:
+    video_ids = numpy.load(FLAGS.subset_video_ids)
+  else:
+    positions = select_subset(index, FLAGS.min_positives,
+                              FLAGS.subset_fraction, FLAGS.seed)
+    video_ids = index.video_ids[positions]
+
+  if FLAGS.output_video_ids:
+    numpy.save(FLAGS.output_video_ids, video_ids)
+  if FLAGS.output_data_dir:
+    write_subset(index, video_ids, FLAGS.output_data_dir,
+                 FLAGS.records_per_shard)
+
+
+if __name__ == "__main__":
+  app.run()
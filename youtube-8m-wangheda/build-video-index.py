@@ -0,0 +1,104 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Binary for building a video_id index over a TFRecord dataset.
+
+The index is read with video_index.VideoIndex.
+"""
+
+import os
+import time
+
+import tensorflow as tf
+from tensorflow import app
+from tensorflow import flags
+from tensorflow import gfile
+from tensorflow import logging
+
+import video_index
+
+FLAGS = flags.FLAGS
+
+if __name__ == "__main__":
+  flags.DEFINE_string(
+      "input_data_pattern", "",
+      "File glob of the dataset to index, in tensorflow.Example or "
+      "tensorflow.SequenceExample format.")
+  flags.DEFINE_string("output_file", "",
+                      "The file to write the index to.")
+  flags.DEFINE_bool(
+      "frame_features", False,
+      "If set, the dataset is frame-level features in SequenceExample format "
+      "and the number of frames of every video is recorded.")
+  flags.DEFINE_string("frame_feature_name", "rgb",
+                      "The frame-level feature the frames are counted on.")
+
+
+def get_video_info(serialized_example, frame_features, frame_feature_name):
+  """Returns the video id, number of frames and labels of an example."""
+  if frame_features:
+    example = tf.train.SequenceExample.FromString(serialized_example)
+    context = example.context.feature
+    num_frames = len(
+        example.feature_lists.feature_list[frame_feature_name].feature)
+  else:
+    example = tf.train.Example.FromString(serialized_example)
+    context = example.features.feature
+    num_frames = 1
+  video_id = context["video_id"].bytes_list.value[0]
+  labels = list(context["labels"].int64_list.value)
+  return video_id, num_frames, labels
+
+
+def build_index(data_pattern, output_file, frame_features, frame_feature_name):
+  files = gfile.Glob(data_pattern)
+  if not files:
+    raise IOError("Unable to find input files. data_pattern='" +
+                  data_pattern + "'")
+  files.sort()
+  logging.info("number of input files: " + str(len(files)))
+
+  start_time = time.time()
+  writer = video_index.VideoIndexWriter()
+  for filename in files:
+    if "://" not in filename:
+      filename = os.path.abspath(filename)
+    file_index = writer.add_file(filename)
+    for offset, length, data in video_index.iter_records(filename):
+      video_id, num_frames, labels = get_video_info(
+          data, frame_features, frame_feature_name)
+      writer.add(video_id, file_index, offset, length, num_frames, labels)
+    logging.info("indexed %s, num videos: %d elapsed seconds: %.2f",
+                 filename, len(writer), time.time() - start_time)
+  writer.save(output_file)
+  logging.info("Done. %d videos were indexed into %s", len(writer), output_file)
+
+
+def main(unused_argv):
+  logging.set_verbosity(tf.logging.INFO)
+
+  if FLAGS.input_data_pattern is "":
+    raise ValueError("'input_data_pattern' was not specified. "
+      "Unable to continue with indexing.")
+
+  if FLAGS.output_file is "":
+    raise ValueError("'output_file' was not specified. "
+      "Unable to continue with indexing.")
+
+  build_index(FLAGS.input_data_pattern, FLAGS.output_file,
+              FLAGS.frame_features, FLAGS.frame_feature_name)
+
+
+if __name__ == "__main__":
+  app.run()
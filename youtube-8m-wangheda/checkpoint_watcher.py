@@ -0,0 +1,125 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Waits for the checkpoints of a training directory.
+
+CheckpointWatcher yields every checkpoint listed in the checkpoint state of
+the directory once, in the order of their global steps, so none is skipped
+when the evaluation is slower than the training. Between checkpoints, it
+polls with an exponential backoff. When pyinotify is installed and the
+directory is local, every interval of the backoff is instead a wait for an
+inotify event of the directory, ended early by the event.
+"""
+
+import os
+import time
+
+import tensorflow as tf
+from tensorflow import logging
+
+try:
+  import pyinotify
+except ImportError:
+  pyinotify = None
+
+
+def get_global_step(checkpoint):
+  """Extracts the global step from a path like /train_dir/model.ckpt-1000."""
+  try:
+    return int(checkpoint.split("/")[-1].split("-")[-1])
+  except ValueError:
+    return -1
+
+
+class CheckpointWatcher(object):
+  """Yields the new checkpoints of a training directory as they appear."""
+
+  def __init__(self, train_dir, min_interval_secs=1.0, max_interval_secs=60.0,
+               timeout_secs=None):
+    """Creates a watcher.
+
+    Args:
+      train_dir: the directory the checkpoints are written to.
+      min_interval_secs: the first polling interval, doubled after every poll
+        without a new checkpoint.
+      max_interval_secs: the longest polling interval. With inotify the
+        intervals bound the wait for a file event, a checkpoint is then
+        found as soon as it is written.
+      timeout_secs: stop after waiting this long for a new checkpoint, or
+        never if None.
+    """
+    self.train_dir = train_dir
+    self.min_interval_secs = min_interval_secs
+    self.max_interval_secs = max_interval_secs
+    self.timeout_secs = timeout_secs
+    self._seen = set()
+    self._notifier = None
+    if pyinotify is not None and os.path.isdir(train_dir):
+      watch_manager = pyinotify.WatchManager()
+      watch_manager.add_watch(
+          train_dir, pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO)
+      self._notifier = pyinotify.Notifier(
+          watch_manager, default_proc_fun=lambda event: None,
+          timeout=int(max_interval_secs * 1000))
+      logging.info("watching %s with inotify", train_dir)
+
+  def pending(self):
+    """Returns the checkpoints not yielded yet, oldest first."""
+    state = tf.train.get_checkpoint_state(self.train_dir)
+    if state is None:
+      return []
+    checkpoints = list(state.all_model_checkpoint_paths)
+    if state.model_checkpoint_path not in checkpoints:
+      checkpoints.append(state.model_checkpoint_path)
+    checkpoints = [checkpoint for checkpoint in checkpoints
+                   if checkpoint not in self._seen]
+    return sorted(checkpoints, key=get_global_step)
+
+  def _wait(self, interval_secs):
+    if self._notifier is not None:
+      # returns at the first file event, or after interval_secs like a poll
+      if self._notifier.check_events(timeout=int(interval_secs * 1000)):
+        self._notifier.read_events()
+        self._notifier.process_events()
+    else:
+      time.sleep(interval_secs)
+
+  def __iter__(self):
+    interval_secs = self.min_interval_secs
+    last_found_time = time.time()
+    while True:
+      checkpoints = self.pending()
+      if checkpoints:
+        for checkpoint in checkpoints:
+          self._seen.add(checkpoint)
+          if tf.train.checkpoint_exists(checkpoint):
+            yield checkpoint
+          else:
+            logging.info("checkpoint %s was deleted before evaluation.",
+                         checkpoint)
+        interval_secs = self.min_interval_secs
+        last_found_time = time.time()
+        continue
+
+      if (self.timeout_secs is not None and
+          time.time() - last_found_time > self.timeout_secs):
+        logging.info("no new checkpoint in %s for %d seconds.",
+                     self.train_dir, self.timeout_secs)
+        return
+      wait_secs = interval_secs
+      if self.timeout_secs is not None:
+        wait_secs = min(wait_secs, max(
+            last_found_time + self.timeout_secs - time.time(), 0.0))
+      self._wait(wait_secs)
+      interval_secs = min(interval_secs * 2, self.max_interval_secs)
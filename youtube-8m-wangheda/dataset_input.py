@@ -0,0 +1,89 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Input pipeline built on tf.data, an alternative to the queue runners.
+
+The records of the input files are read by a parallel interleave, grouped
+into batches of serialized strings, parsed a whole batch at a time by the
+prepare_serialized_examples method of the reader in a parallel map and
+prefetched. Without shuffling the order of the videos is deterministic.
+Requires TensorFlow 1.4 or later, the files are read in parallel from 1.5.
+"""
+
+import tensorflow as tf
+
+# The collection of the initializers of the initializable iterators.
+ITERATOR_INITIALIZERS = "iterator_initializers"
+
+
+def get_input_tensors(reader,
+                      files,
+                      batch_size,
+                      num_epochs=None,
+                      shuffle=False,
+                      num_parallel_reads=1,
+                      num_parallel_calls=1,
+                      prefetch_batches=2,
+                      seed=None,
+                      initializable=False):
+  """Creates the section of the graph which reads the input data.
+
+  Args:
+    reader: A reader implementing prepare_serialized_examples.
+    files: The list of the input files.
+    batch_size: How many examples to process at a time.
+    num_epochs: How many passes to make over the data. Set to 'None' to run
+      indefinitely.
+    shuffle: Whether to shuffle the files and the records.
+    num_parallel_reads: How many files to read from at the same time.
+    num_parallel_calls: How many batches to parse at the same time.
+    prefetch_batches: How many parsed batches to keep ready.
+    seed: The random seed of the shuffling.
+    initializable: If set, the iterator must be initialized by running the
+      initializer added to the ITERATOR_INITIALIZERS collection, and can be
+      run again to restart from the first batch in the same session.
+
+  Returns:
+    The tensors of reader.prepare_serialized_examples for the next batch, the
+    last batch may be smaller. The end of the data is signaled by an
+    OutOfRangeError, like a closed queue.
+  """
+  dataset = tf.data.Dataset.from_tensor_slices(tf.constant(files))
+  if shuffle:
+    dataset = dataset.shuffle(len(files), seed=seed)
+  dataset = dataset.repeat(num_epochs)
+  parallel_interleave = getattr(tf.contrib.data, "parallel_interleave", None)
+  if parallel_interleave is not None:
+    dataset = dataset.apply(parallel_interleave(
+        tf.data.TFRecordDataset,
+        cycle_length=max(num_parallel_reads, 1),
+        sloppy=shuffle))
+  else:
+    # TensorFlow 1.4 has no parallel_interleave, the files are read in turn
+    dataset = dataset.interleave(tf.data.TFRecordDataset,
+                                 cycle_length=max(num_parallel_reads, 1))
+  if shuffle:
+    dataset = dataset.shuffle(batch_size * 4, seed=seed)
+  dataset = dataset.batch(batch_size)
+  dataset = dataset.map(reader.prepare_serialized_examples,
+                        num_parallel_calls=max(num_parallel_calls, 1))
+  dataset = dataset.prefetch(prefetch_batches)
+
+  if initializable:
+    iterator = dataset.make_initializable_iterator()
+    tf.add_to_collection(ITERATOR_INITIALIZERS, iterator.initializer)
+  else:
+    iterator = dataset.make_one_shot_iterator()
+  batch = iterator.get_next()
+  return reader.prepare_batch(batch)
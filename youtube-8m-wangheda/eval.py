@@ -13,13 +13,19 @@
 # limitations under the License.
 """Binary for evaluating Tensorflow models on the YouTube-8M dataset."""
 
+import contextlib
+import os
 import time
 
+import numpy
+
+import checkpoint_watcher
 import eval_util
 import losses
 import frame_level_models
 import video_level_models
 import feature_transform
+import dataset_input
 import readers
 import tensorflow as tf
 from tensorflow import app
@@ -57,6 +63,42 @@ if __name__ == "__main__":
       "Otherwise, --eval_data_pattern must be aggregated video-level "
       "features. The model must also be set appropriately (i.e. to read 3D "
       "batches VS 4D batches.")
+  flags.DEFINE_integer(
+      "frame_read_batch_size", 0,
+      "If positive, frame-level records are read and decoded this many at a "
+      "time by YT8MBatchFrameFeatureReader instead of one by one.")
+  flags.DEFINE_bool(
+      "packed_frame_features", False,
+      "If set, frame-level features are read from packed shards written by "
+      "pack-frame-features.py, the data pattern must match their *.index.npz "
+      "files.")
+  flags.DEFINE_bool(
+      "quantized_frame_queue", False,
+      "If set, frame-level features stay uint8 in the batching queue and are "
+      "dequantized after dequeue, which cuts the queue memory by 4x.")
+  flags.DEFINE_integer(
+      "frame_stride", 1,
+      "If larger than 1, the frame-level readers decode and emit only "
+      "max_frames / frame_stride frames per video, chosen by --frame_sampling.")
+  flags.DEFINE_string(
+      "frame_sampling", "stride",
+      "How frames are chosen when --frame_stride > 1: 'stride' keeps every "
+      "frame_stride-th frame, 'average' averages consecutive frames and "
+      "'random' samples frames at random in temporal order.")
+  flags.DEFINE_bool(
+      "use_dataset", False,
+      "If set, the input is read by the tf.data pipeline of dataset_input.py "
+      "instead of queue runners, --frame_bucket_boundaries is not applied. "
+      "Only this input keeps one session across the watched checkpoints, "
+      "the queue runners need a new session for every checkpoint. "
+      "Requires TensorFlow 1.4 or later.")
+  flags.DEFINE_string(
+      "frame_bucket_boundaries", "",
+      "Comma separated num_frames boundaries, e.g. '60,120,180,240'. If set, "
+      "frame-level videos are batched by length bucket and each batch is "
+      "padded to its longest video instead of max_frames. The model must not "
+      "rely on a static number of frames. Cannot be used with "
+      "--frame_read_batch_size.")
   flags.DEFINE_string(
       "model", "LogisticModel",
       "Which architecture to use for the model. Options include 'Logistic', "
@@ -71,7 +113,59 @@ if __name__ == "__main__":
   flags.DEFINE_integer("num_readers", 8,
                        "How many threads to use for reading input files.")
   flags.DEFINE_boolean("run_once", False, "Whether to run eval only once.")
+  flags.DEFINE_string(
+      "eval_checkpoints", "",
+      "If set, a comma separated list of checkpoints, given by path or by "
+      "global step in train_dir, which are all evaluated in one pass over the "
+      "data by as many copies of the model.")
+  flags.DEFINE_float("min_poll_interval_secs", 1.0,
+                     "The first interval of polling for new checkpoints, "
+                     "doubled while none appears. With inotify it bounds the "
+                     "wait for a file event instead.")
+  flags.DEFINE_float("max_poll_interval_secs", 60.0,
+                     "The longest interval of polling for new checkpoints, "
+                     "or of waiting for a file event with inotify.")
+  flags.DEFINE_float("eval_timeout_secs", -1.0,
+                     "If positive, stop after waiting this long for a new "
+                     "checkpoint.")
   flags.DEFINE_integer("top_k", 20, "How many predictions to output per video.")
+  flags.DEFINE_string(
+      "output_metrics_file", "",
+      "If set, the metrics accumulated over the evaluation data are saved to "
+      "this .npz file, to be merged with those of other shards of the data by "
+      "merge-eval-metrics.py. With several --eval_checkpoints, every "
+      "checkpoint has its own file, named with its global step.")
+  flags.DEFINE_integer(
+      "gap_histogram_bins", 0,
+      "If positive, the GAP is estimated in fixed memory from a histogram of "
+      "this many score bins, and logged with its error bounds, instead of "
+      "keeping every top_k prediction of the evaluation data in memory.")
+  flags.DEFINE_string(
+      "eval_subset_video_ids", "",
+      "If set, a .npy file of video ids written by build-eval-subset.py, only "
+      "these videos of the evaluation data are evaluated. To also read only "
+      "them, point eval_data_pattern to the shards written by the tool.")
+  flags.DEFINE_bool(
+      "sequential_eval", False,
+      "If set, the evaluation files are read in random order, cut in shards "
+      "of sequential_eval_shard_batches batches, and the evaluation of a "
+      "checkpoint stops early once the bootstrap confidence interval of the "
+      "GAP over the shards is narrower than sequential_eval_ci_width, or its "
+      "upper bound is below the best GAP seen so far.")
+  flags.DEFINE_integer("sequential_eval_shard_batches", 10,
+                       "How many batches make a shard in sequential_eval.")
+  flags.DEFINE_integer("sequential_eval_min_shards", 5,
+                       "How many shards are evaluated before stopping early.")
+  flags.DEFINE_float("sequential_eval_ci_width", 0.002,
+                     "The width of the GAP confidence interval to stop at.")
+  flags.DEFINE_float("sequential_eval_confidence", 0.95,
+                     "The confidence level of the GAP confidence interval.")
+  flags.DEFINE_integer("sequential_eval_bootstraps", 200,
+                       "How many bootstrap replicates the interval is from.")
+  flags.DEFINE_float(
+      "sequential_eval_best_gap", -1.0,
+      "The best GAP known from previous evaluations, if positive. "
+      "Checkpoints provably worse than it are stopped early.")
   flags.DEFINE_bool(
       "multitask", False,
       "Whether to consider support_predictions")
@@ -90,9 +184,26 @@ def find_class_by_name(name, modules):
   return next(a for a in modules if a)
 
 
+def filter_by_video_ids(eval_data, subset_video_ids):
+  """Keeps the examples of eval_data whose video_id is in subset_video_ids.
+
+  Args:
+    eval_data: a list of tensors of examples, the first being the video ids.
+    subset_video_ids: a numpy vector of the video ids to keep.
+  """
+  subset_video_ids = numpy.unique(subset_video_ids)
+  def in_subset(video_ids):
+    return numpy.in1d(video_ids, subset_video_ids)
+  mask = tf.py_func(in_subset, [eval_data[0]], tf.bool, stateful=False)
+  mask.set_shape([None])
+  return [tf.boolean_mask(tensor, mask) for tensor in eval_data]
+
+
 def get_input_evaluation_tensors(reader,
                                  data_pattern,
-                                 batch_size=1024):
+                                 batch_size=1024,
+                                 bucket_boundaries=None,
+                                 shuffle=False):
 
   logging.info("Using batch size of " + str(batch_size) + " for evaluation.")
   with tf.name_scope("eval_input"):
@@ -101,9 +212,25 @@ def get_input_evaluation_tensors(reader,
       raise IOError("Unable to find the evaluation files.")
     logging.info("number of evaluation files: " + str(len(files)))
     files.sort()
+    subset_video_ids = None
+    if FLAGS.eval_subset_video_ids:
+      subset_video_ids = numpy.load(FLAGS.eval_subset_video_ids)
+      logging.info("evaluating a subset of %d videos", len(subset_video_ids))
+      if FLAGS.use_dataset or bucket_boundaries:
+        raise ValueError("--eval_subset_video_ids cannot be used with "
+                         "--use_dataset or --frame_bucket_boundaries.")
+    if FLAGS.use_dataset:
+      return dataset_input.get_input_tensors(
+          reader, files, batch_size, num_epochs=1, shuffle=shuffle, seed=0,
+          initializable=True)
     filename_queue = tf.train.string_input_producer(
-        files, shuffle=False, num_epochs=1)
+        files, shuffle=shuffle, num_epochs=1, seed=0)
+    if bucket_boundaries:
+      return readers.bucket_by_num_frames(
+          reader, filename_queue, batch_size, bucket_boundaries)
     eval_data = reader.prepare_reader(filename_queue)
+    if subset_video_ids is not None:
+      eval_data = filter_by_video_ids(eval_data, subset_video_ids)
     return tf.train.batch(
         eval_data,
         batch_size=batch_size,
@@ -119,7 +246,8 @@ def build_graph(reader,
                 batch_size=1024,
                 transformer_class=feature_transform.DefaultTransformer,
                 distill_reader=None,
-                num_readers=1):
+                num_readers=1,
+                num_towers=1):
   """Creates the Tensorflow graph for evaluation.
 
   Args:
@@ -131,13 +259,31 @@ def build_graph(reader,
                 from BaseLoss.
     batch_size: How many examples to process at a time.
     num_readers: How many threads to use for I/O operations.
+    num_towers: How many copies of the model are run on every batch, to
+                evaluate as many checkpoints in one pass. With more than one,
+                the variables of the i-th copy are in the scope "tower<i>".
   """
 
+  bucket_boundaries = None
+  if FLAGS.frame_bucket_boundaries:
+    if distill_reader is not None:
+      raise ValueError("--frame_bucket_boundaries reorders the videos and "
+                       "cannot be used with distillation inputs.")
+    bucket_boundaries = utils.GetListOfBucketBoundaries(
+        FLAGS.frame_bucket_boundaries)
+  if FLAGS.sequential_eval and distill_reader is not None:
+    raise ValueError("--sequential_eval shuffles the videos and cannot be "
+                     "used with distillation inputs.")
+
   global_step = tf.Variable(0, trainable=False, name="global_step")
   video_id_batch, model_input_raw, labels_batch, num_frames = get_input_evaluation_tensors(  # pylint: disable=g-line-too-long
       reader,
       eval_data_pattern,
-      batch_size=batch_size)
+      batch_size=batch_size,
+      bucket_boundaries=bucket_boundaries,
+      shuffle=FLAGS.sequential_eval)
+  if model_input_raw.dtype == tf.uint8:
+    model_input_raw = utils.DequantizeFrames(model_input_raw, num_frames)
   tf.summary.histogram("model_input_raw", model_input_raw)
 
   if distill_reader is not None:
@@ -148,66 +294,143 @@ def build_graph(reader,
 
   feature_dim = len(model_input_raw.get_shape()) - 1
 
-  # Normalize input features.
-  feature_transformer = transformer_class()
-  model_input, num_frames = feature_transformer.transform(model_input_raw, num_frames=num_frames)
-
   with tf.name_scope("model"):
     if FLAGS.noise_level > 0:
       noise_level_tensor = tf.placeholder_with_default(0.0, shape=[], name="noise_level")
     else:
       noise_level_tensor = None
-
-    if distill_reader is not None:
-      distillation_predictions = distill_input_raw
-    else:
-      distillation_predictions = None
-
     if FLAGS.dropout:
       keep_prob_tensor = tf.placeholder_with_default(1.0, shape=[], name="keep_prob")
-      result = model.create_model(model_input,
-                                num_frames=num_frames,
-                                vocab_size=reader.num_classes,
-                                labels=labels_batch,
-                                dropout=FLAGS.dropout,
-                                keep_prob=keep_prob_tensor,
-                                distillation_predictions=distillation_predictions,
-                                is_training=False)
-    else:
-      result = model.create_model(model_input,
-                                num_frames=num_frames,
-                                vocab_size=reader.num_classes,
-                                labels=labels_batch,
-                                distillation_predictions=distillation_predictions,
-                                is_training=False)
-    predictions = result["predictions"]
-    tf.summary.histogram("model_activations", predictions)
-    if "loss" in result.keys():
-      label_loss = result["loss"]
-    else:
-      if FLAGS.multitask:
-        support_predictions = result["support_predictions"]
-        label_loss = label_loss_fn.calculate_loss(predictions, support_predictions, labels_batch)
-      else:
-        label_loss = label_loss_fn.calculate_loss(predictions, labels_batch)
+
+  if distill_reader is not None:
+    distillation_predictions = distill_input_raw
+  else:
+    distillation_predictions = None
+
+  raw_num_frames = num_frames
+  for tower in range(num_towers):
+    with tf.variable_scope("tower%d" % tower if num_towers > 1 else
+                           tf.get_variable_scope()):
+      # Normalize input features.
+      feature_transformer = transformer_class()
+      model_input, num_frames = feature_transformer.transform(model_input_raw, num_frames=raw_num_frames)
+
+      with tf.name_scope("model"):
+        if FLAGS.dropout:
+          result = model.create_model(model_input,
+                                    num_frames=num_frames,
+                                    vocab_size=reader.num_classes,
+                                    labels=labels_batch,
+                                    dropout=FLAGS.dropout,
+                                    keep_prob=keep_prob_tensor,
+                                    distillation_predictions=distillation_predictions,
+                                    is_training=False)
+        else:
+          result = model.create_model(model_input,
+                                    num_frames=num_frames,
+                                    vocab_size=reader.num_classes,
+                                    labels=labels_batch,
+                                    distillation_predictions=distillation_predictions,
+                                    is_training=False)
+        predictions = result["predictions"]
+        tf.summary.histogram("model_activations", predictions)
+        if "loss" in result.keys():
+          label_loss = result["loss"]
+        else:
+          if FLAGS.multitask:
+            support_predictions = result["support_predictions"]
+            label_loss = label_loss_fn.calculate_loss(predictions, support_predictions, labels_batch)
+          else:
+            label_loss = label_loss_fn.calculate_loss(predictions, labels_batch)
+
+    tf.add_to_collection("loss", label_loss)
+    tf.add_to_collection("predictions", predictions)
+    tf.add_to_collection("input_batch", model_input)
+    tf.add_to_collection("num_frames", num_frames)
 
   tf.add_to_collection("global_step", global_step)
-  tf.add_to_collection("loss", label_loss)
-  tf.add_to_collection("predictions", predictions)
-  tf.add_to_collection("input_batch", model_input)
   tf.add_to_collection("video_id_batch", video_id_batch)
-  tf.add_to_collection("num_frames", num_frames)
   tf.add_to_collection("labels", tf.cast(labels_batch, tf.float32))
   tf.add_to_collection("summary_op", tf.summary.merge_all())
+  if num_towers > 1:
+    # the summaries of every tower along with the ones of the shared input
+    tower_prefixes = tuple("tower%d/" % tower for tower in range(num_towers))
+    summaries = tf.get_collection(tf.GraphKeys.SUMMARIES)
+    shared_summaries = [summary for summary in summaries
+                        if not summary.op.name.startswith(tower_prefixes)]
+    for prefix in tower_prefixes:
+      tf.add_to_collection("tower_summary_ops", tf.summary.merge(
+          shared_summaries + [summary for summary in summaries
+                              if summary.op.name.startswith(prefix)]))
   if FLAGS.dropout:
     tf.add_to_collection("keep_prob", keep_prob_tensor)
   if FLAGS.noise_level > 0:
     tf.add_to_collection("noise_level", noise_level_tensor)
 
 
+def write_epoch_summary(summary_writer, summary_val, global_step_val,
+                        evl_metrics, output_metrics_file=None):
+  """Calculates the metrics of the evaluated data and writes their summary.
+
+  The metrics are saved to output_metrics_file, FLAGS.output_metrics_file if
+  None.
+
+  Returns:
+    The dictionary of the metrics.
+  """
+  if output_metrics_file is None:
+    output_metrics_file = FLAGS.output_metrics_file
+  epoch_info_dict = evl_metrics.get()
+  epoch_info_dict["epoch_id"] = global_step_val
+  if output_metrics_file:
+    evl_metrics.save(output_metrics_file)
+
+  summary_writer.add_summary(summary_val, global_step_val)
+  epochinfo = utils.AddEpochSummary(
+      summary_writer,
+      global_step_val,
+      epoch_info_dict,
+      summary_scope="Eval")
+  logging.info(epochinfo)
+  if "gap_bounds" in epoch_info_dict:
+    logging.info("GAP is within [%.6f, %.6f]",
+                 *epoch_info_dict["gap_bounds"])
+  return epoch_info_dict
+
+
+def sequential_eval_should_stop(gap_estimator):
+  """Closes a shard of gap_estimator and tells if the evaluation can stop."""
+  gap_estimator.end_shard()
+  if gap_estimator.num_shards < FLAGS.sequential_eval_min_shards:
+    return False
+  lower, upper = gap_estimator.confidence_interval()
+  logging.info("shards: %d | GAP %d%% confidence interval: [%.6f, %.6f]",
+               gap_estimator.num_shards, 100 * gap_estimator.confidence,
+               lower, upper)
+  if upper - lower < FLAGS.sequential_eval_ci_width:
+    logging.info("Stopping early, the GAP interval is narrow enough.")
+    return True
+  if gap_estimator.best_gap is not None and upper < gap_estimator.best_gap:
+    logging.info("Stopping early, the GAP is below the best GAP %.6f.",
+                 gap_estimator.best_gap)
+    return True
+  return False
+
+
+@contextlib.contextmanager
+def session_scope(sess=None):
+  """Yields sess, or a new session closed at the end if sess is None."""
+  if sess is not None:
+    yield sess
+  else:
+    with tf.Session() as new_sess:
+      yield new_sess
+
+
 def evaluation_loop(video_id_batch, prediction_batch, label_batch, loss,
                     summary_op, saver, summary_writer, evl_metrics,
-                    last_global_step_val):
+                    last_global_step_val, gap_estimator=None, checkpoint=None,
+                    sess=None):
   """Run the evaluation loop once.
 
   Args:
@@ -220,16 +443,23 @@ def evaluation_loop(video_id_batch, prediction_batch, label_batch, loss,
     summary_writer: a tensorflow summary_writer
     evl_metrics: an EvaluationMetrics object.
     last_global_step_val: the global step used in the previous evaluation.
+    gap_estimator: a SequentialGapEstimator to stop the evaluation early
+      with, or None to evaluate all the data.
+    checkpoint: the checkpoint to evaluate, by default model_checkpoint_path
+      or the latest checkpoint of train_dir.
+    sess: a session to restore the checkpoint into, which is kept open, or
+      None to evaluate in a new session. The input must be restartable in the
+      session, i.e. read with an initializable iterator.
 
   Returns:
     The global_step used in the latest model.
   """
 
   global_step_val = -1
-  with tf.Session() as sess:
-    if FLAGS.model_checkpoint_path:
+  with session_scope(sess) as sess:
+    if checkpoint is None and FLAGS.model_checkpoint_path:
       checkpoint = FLAGS.model_checkpoint_path
-    else:
+    elif checkpoint is None:
       checkpoint = tf.train.latest_checkpoint(FLAGS.train_dir)
     if checkpoint:
       logging.info("Loading checkpoint for eval: " + checkpoint)
@@ -248,6 +478,7 @@ def evaluation_loop(video_id_batch, prediction_batch, label_batch, loss,
       return global_step_val
 
     sess.run([tf.local_variables_initializer()])
+    sess.run(tf.get_collection(dataset_input.ITERATOR_INITIALIZERS))
 
     # Start the queue runners.
     if FLAGS.dropout:
@@ -266,8 +497,12 @@ def evaluation_loop(video_id_batch, prediction_batch, label_batch, loss,
                    global_step_val)
 
       evl_metrics.clear()
+      if gap_estimator is not None:
+        gap_estimator.clear()
 
       examples_processed = 0
+      num_batches = 0
+      stopped_early = False
       while not coord.should_stop():
         batch_start_time = time.time()
 
@@ -296,21 +531,32 @@ def evaluation_loop(video_id_batch, prediction_batch, label_batch, loss,
         logging.info("examples_processed: %d | %s", examples_processed,
                      iterinfo)
 
+        if gap_estimator is not None:
+          gap_estimator.accumulate(predictions_val, labels_val)
+          num_batches += 1
+          if (num_batches % FLAGS.sequential_eval_shard_batches == 0 and
+              sequential_eval_should_stop(gap_estimator)):
+            stopped_early = True
+            break
+
+      if stopped_early:
+        logging.info(
+            "Stopped after %d examples. Now calculating the performance "
+            "metrics of the evaluated examples.", examples_processed)
+        epoch_info_dict = write_epoch_summary(
+            summary_writer, summary_val, global_step_val, evl_metrics)
+        gap_estimator.update_best(epoch_info_dict["gap"])
+        evl_metrics.clear()
+
     except tf.errors.OutOfRangeError as e:
       logging.info(
           "Done with batched inference. Now calculating global performance "
           "metrics.")
       # calculate the metrics for the entire epoch
-      epoch_info_dict = evl_metrics.get()
-      epoch_info_dict["epoch_id"] = global_step_val
-
-      summary_writer.add_summary(summary_val, global_step_val)
-      epochinfo = utils.AddEpochSummary(
-          summary_writer,
-          global_step_val,
-          epoch_info_dict,
-          summary_scope="Eval")
-      logging.info(epochinfo)
+      epoch_info_dict = write_epoch_summary(
+          summary_writer, summary_val, global_step_val, evl_metrics)
+      if gap_estimator is not None:
+        gap_estimator.update_best(epoch_info_dict["gap"])
       evl_metrics.clear()
     except Exception as e:  # pylint: disable=broad-except
       logging.info("Unexpected exception: " + str(e))
@@ -322,6 +568,103 @@ def evaluation_loop(video_id_batch, prediction_batch, label_batch, loss,
     return global_step_val
 
 
+def get_eval_checkpoints(eval_checkpoints, train_dir):
+  """Parses the --eval_checkpoints list into checkpoint paths."""
+  checkpoints = []
+  for checkpoint in eval_checkpoints.split(","):
+    checkpoint = checkpoint.strip()
+    if checkpoint.isdigit():
+      checkpoint = os.path.join(train_dir, "model.ckpt-" + checkpoint)
+    if checkpoint:
+      checkpoints.append(checkpoint)
+  return checkpoints
+
+
+def get_tower_saver(tower):
+  """Returns a saver restoring the variables of a tower from a checkpoint of
+  the model built without towers."""
+  prefix = "tower%d/" % tower
+  var_list = dict((variable.op.name[len(prefix):], variable)
+                  for variable in tf.global_variables()
+                  if variable.op.name.startswith(prefix))
+  return tf.train.Saver(var_list)
+
+
+def multi_checkpoint_evaluation_loop(video_id_batch, prediction_batches,
+                                     label_batch, losses, summary_ops, savers,
+                                     checkpoints, summary_writer, all_metrics):
+  """Evaluates several checkpoints in one pass over the data.
+
+  Args:
+    video_id_batch: a tensor of video ids mini-batch.
+    prediction_batches: the predictions tensors of the towers.
+    label_batch: a tensor of label_batch mini-batch.
+    losses: the loss tensors of the towers.
+    summary_ops: the summary ops of the towers.
+    savers: the savers restoring the towers.
+    checkpoints: the checkpoints restored in the towers.
+    summary_writer: a tensorflow summary_writer
+    all_metrics: the EvaluationMetrics objects of the towers.
+  """
+  with tf.Session() as sess:
+    for saver, checkpoint in zip(savers, checkpoints):
+      logging.info("Loading checkpoint for eval: " + checkpoint)
+      saver.restore(sess, checkpoint)
+    sess.run([tf.local_variables_initializer()])
+    sess.run(tf.get_collection(dataset_input.ITERATOR_INITIALIZERS))
+
+    custom_feed = {}
+    if FLAGS.dropout:
+      custom_feed[tf.get_collection("keep_prob")[0]] = FLAGS.keep_prob
+    if FLAGS.noise_level > 0:
+      custom_feed[tf.get_collection("noise_level")[0]] = FLAGS.noise_level
+    coord = tf.train.Coordinator()
+    try:
+      threads = []
+      for qr in tf.get_collection(tf.GraphKeys.QUEUE_RUNNERS):
+        threads.extend(qr.create_threads(
+            sess, coord=coord, daemon=True,
+            start=True))
+      for metrics in all_metrics:
+        metrics.clear()
+
+      examples_processed = 0
+      while not coord.should_stop():
+        batch_start_time = time.time()
+        labels_val, predictions_vals, loss_vals, summary_vals = sess.run(
+            [label_batch, prediction_batches, losses, summary_ops],
+            feed_dict=custom_feed)
+        seconds_per_batch = time.time() - batch_start_time
+        examples_processed += labels_val.shape[0]
+        for metrics, predictions_val, loss_val in zip(
+            all_metrics, predictions_vals, loss_vals):
+          metrics.accumulate(predictions_val, labels_val, loss_val)
+        logging.info("examples_processed: %d | examples_per_second: %.2f",
+                     examples_processed, labels_val.shape[0] / seconds_per_batch)
+
+    except tf.errors.OutOfRangeError as e:
+      logging.info(
+          "Done with batched inference. Now calculating global performance "
+          "metrics.")
+      for checkpoint, metrics, summary_val in zip(checkpoints, all_metrics,
+                                                  summary_vals):
+        global_step_val = checkpoint_watcher.get_global_step(checkpoint)
+        logging.info("metrics of %s", checkpoint)
+        output_metrics_file = ""
+        if FLAGS.output_metrics_file:
+          root, ext = os.path.splitext(FLAGS.output_metrics_file)
+          output_metrics_file = "%s-%d%s" % (root, global_step_val, ext)
+        write_epoch_summary(summary_writer, summary_val, global_step_val,
+                            metrics, output_metrics_file)
+        metrics.clear()
+    except Exception as e:  # pylint: disable=broad-except
+      logging.info("Unexpected exception: " + str(e))
+      coord.request_stop(e)
+
+    coord.request_stop()
+    coord.join(threads, stop_grace_period_secs=10)
+
+
 def evaluate():
   tf.set_random_seed(0)  # for reproducibility
   with tf.Graph().as_default():
@@ -329,9 +672,24 @@ def evaluate():
     feature_names, feature_sizes = utils.GetListOfFeatureNamesAndSizes(
         FLAGS.feature_names, FLAGS.feature_sizes)
 
-    if FLAGS.frame_features:
+    if FLAGS.frame_features and FLAGS.packed_frame_features:
+      reader = readers.YT8MPackedFrameFeatureReader(
+          feature_names=feature_names, feature_sizes=feature_sizes,
+          dequantize=not FLAGS.quantized_frame_queue,
+          frame_stride=FLAGS.frame_stride)
+    elif FLAGS.frame_features and FLAGS.frame_read_batch_size > 0:
+      reader = readers.YT8MBatchFrameFeatureReader(
+          feature_names=feature_names, feature_sizes=feature_sizes,
+          read_batch_size=FLAGS.frame_read_batch_size,
+          dequantize=not FLAGS.quantized_frame_queue,
+          frame_stride=FLAGS.frame_stride,
+          frame_sampling=FLAGS.frame_sampling)
+    elif FLAGS.frame_features:
       reader = readers.YT8MFrameFeatureReader(feature_names=feature_names,
-                                              feature_sizes=feature_sizes)
+                                              feature_sizes=feature_sizes,
+                                              dequantize=not FLAGS.quantized_frame_queue,
+                                              frame_stride=FLAGS.frame_stride,
+                                              frame_sampling=FLAGS.frame_sampling)
     else:
       reader = readers.YT8MAggregatedFeatureReader(feature_names=feature_names,
                                                    feature_sizes=feature_sizes)
@@ -351,6 +709,14 @@ def evaluate():
       raise IOError("'eval_data_pattern' was not specified. " +
                      "Nothing to evaluate.")
 
+    checkpoints = []
+    if FLAGS.eval_checkpoints:
+      checkpoints = get_eval_checkpoints(FLAGS.eval_checkpoints,
+                                         FLAGS.train_dir)
+      if FLAGS.sequential_eval:
+        raise ValueError("--eval_checkpoints cannot be used with "
+                         "--sequential_eval.")
+
     build_graph(
         reader=reader,
         model=model,
@@ -359,7 +725,8 @@ def evaluate():
         num_readers=FLAGS.num_readers,
         transformer_class=transformer_class,
         distill_reader=distill_reader,
-        batch_size=FLAGS.batch_size)
+        batch_size=FLAGS.batch_size,
+        num_towers=max(len(checkpoints), 1))
 
     logging.info("built evaluation graph")
     video_id_batch = tf.get_collection("video_id_batch")[0]
@@ -368,20 +735,60 @@ def evaluate():
     loss = tf.get_collection("loss")[0]
     summary_op = tf.get_collection("summary_op")[0]
 
-    saver = tf.train.Saver(tf.global_variables())
     summary_writer = tf.summary.FileWriter(
         FLAGS.train_dir, graph=tf.get_default_graph())
+    if len(checkpoints) > 1:
+      savers = [get_tower_saver(tower) for tower in range(len(checkpoints))]
+      all_metrics = [eval_util.EvaluationMetrics(reader.num_classes,
+                                                 FLAGS.top_k,
+                                                 FLAGS.gap_histogram_bins)
+                     for _ in checkpoints]
+      multi_checkpoint_evaluation_loop(
+          video_id_batch, tf.get_collection("predictions"), label_batch,
+          tf.get_collection("loss"), tf.get_collection("tower_summary_ops"),
+          savers, checkpoints, summary_writer, all_metrics)
+      return
 
-    evl_metrics = eval_util.EvaluationMetrics(reader.num_classes, FLAGS.top_k)
+    saver = tf.train.Saver(tf.global_variables())
 
-    last_global_step_val = -1
-    while True:
-      last_global_step_val = evaluation_loop(video_id_batch, prediction_batch,
-                                             label_batch, loss, summary_op,
-                                             saver, summary_writer, evl_metrics,
-                                             last_global_step_val)
-      if FLAGS.run_once:
-        break
+    evl_metrics = eval_util.EvaluationMetrics(reader.num_classes, FLAGS.top_k,
+                                              FLAGS.gap_histogram_bins)
+
+    gap_estimator = None
+    if FLAGS.sequential_eval:
+      gap_estimator = eval_util.SequentialGapEstimator(
+          top_k=FLAGS.top_k,
+          num_bootstraps=FLAGS.sequential_eval_bootstraps,
+          confidence=FLAGS.sequential_eval_confidence)
+      if FLAGS.sequential_eval_best_gap > 0:
+        gap_estimator.update_best(FLAGS.sequential_eval_best_gap)
+
+    if FLAGS.run_once or FLAGS.model_checkpoint_path or checkpoints:
+      evaluation_loop(video_id_batch, prediction_batch, label_batch, loss,
+                      summary_op, saver, summary_writer, evl_metrics, -1,
+                      gap_estimator,
+                      checkpoint=checkpoints[0] if checkpoints else None)
+      return
+
+    watcher = checkpoint_watcher.CheckpointWatcher(
+        FLAGS.train_dir,
+        min_interval_secs=FLAGS.min_poll_interval_secs,
+        max_interval_secs=FLAGS.max_poll_interval_secs,
+        timeout_secs=(FLAGS.eval_timeout_secs
+                      if FLAGS.eval_timeout_secs > 0 else None))
+    # The queue runners of an input read once are closed at its end, only the
+    # tf.data input can be restarted in a session kept across checkpoints.
+    sess = tf.Session() if FLAGS.use_dataset else None
+    try:
+      last_global_step_val = -1
+      for checkpoint in watcher:
+        last_global_step_val = evaluation_loop(
+            video_id_batch, prediction_batch, label_batch, loss, summary_op,
+            saver, summary_writer, evl_metrics, last_global_step_val,
+            gap_estimator, checkpoint=checkpoint, sess=sess)
+    finally:
+      if sess is not None:
+        sess.close()
 
 
 def main(unused_argv):
@@ -0,0 +1,175 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Packed on-disk storage of quantized frame-level features.
+
+A packed shard is made of two files sharing a prefix:
+
+  <prefix>.frames     raw uint8 frames of all videos, one row per frame, the
+                      features (e.g. rgb and audio) concatenated along a row.
+  <prefix>.index.npz  the video_id table, the first frame and the number of
+                      frames of every video, the labels in CSR format and the
+                      names and sizes of the packed features.
+
+The frames file is read through numpy.memmap, so serving a batch is a slice of
+the page cache with no protobuf parsing, and concurrent jobs reading the same
+shard share its pages. The files must live on a local (or mounted) filesystem.
+"""
+
+import os
+
+import numpy
+
+FRAMES_SUFFIX = ".frames"
+INDEX_SUFFIX = ".index.npz"
+
+
+class PackedFrameShardWriter(object):
+  """Writes videos into one packed shard."""
+
+  def __init__(self, prefix, feature_names, feature_sizes):
+    """Construct a PackedFrameShardWriter.
+
+    Args:
+      prefix: path prefix of the shard files.
+      feature_names: the names of the packed features as a list.
+      feature_sizes: the dimensions of the packed features as a list.
+    """
+    self.prefix = prefix
+    self.feature_names = feature_names
+    self.feature_sizes = feature_sizes
+    self.row_size = sum(feature_sizes)
+
+    self._frames_file = open(prefix + FRAMES_SUFFIX, "wb")
+    self._video_ids = []
+    self._num_frames = []
+    self._labels = []
+
+  def __len__(self):
+    return len(self._video_ids)
+
+  def add(self, video_id, frames, labels):
+    """Appends a video to the shard.
+
+    Args:
+      video_id: the video id as a string.
+      frames: a uint8 numpy matrix of shape [num_frames, sum(feature_sizes)].
+      labels: a list of the label indexes of the video.
+    """
+    if frames.dtype != numpy.uint8 or frames.shape[1] != self.row_size:
+      raise ValueError("frames must be a uint8 matrix with %d columns." %
+                       self.row_size)
+    self._frames_file.write(numpy.ascontiguousarray(frames).tobytes())
+    self._video_ids.append(video_id)
+    self._num_frames.append(frames.shape[0])
+    self._labels.append(labels)
+
+  def close(self):
+    """Writes the index of the shard and closes it."""
+    self._frames_file.close()
+    num_frames = numpy.array(self._num_frames, dtype=numpy.int32)
+    offsets = numpy.zeros_like(num_frames, dtype=numpy.int64)
+    if len(num_frames) > 0:
+      offsets[1:] = numpy.cumsum(num_frames)[:-1]
+    label_lengths = numpy.array([len(l) for l in self._labels], dtype=numpy.int64)
+    label_offsets = numpy.zeros([len(label_lengths) + 1], dtype=numpy.int64)
+    label_offsets[1:] = numpy.cumsum(label_lengths)
+    label_indices = numpy.array(
+        [label for labels in self._labels for label in labels], dtype=numpy.int32)
+    with open(self.prefix + INDEX_SUFFIX, "wb") as index_file:
+      numpy.savez(index_file,
+                  video_ids=numpy.array(self._video_ids, dtype=numpy.bytes_),
+                  offsets=offsets,
+                  num_frames=num_frames,
+                  label_indices=label_indices,
+                  label_offsets=label_offsets,
+                  feature_names=numpy.array(self.feature_names, dtype=numpy.bytes_),
+                  feature_sizes=numpy.array(self.feature_sizes, dtype=numpy.int32))
+
+
+class PackedFrameShard(object):
+  """Serves videos of a packed shard from a memory-mapped frames file."""
+
+  def __init__(self, index_filename):
+    """Opens the packed shard described by index_filename."""
+    if not index_filename.endswith(INDEX_SUFFIX):
+      raise ValueError("'%s' is not a packed shard index." % index_filename)
+    prefix = index_filename[:-len(INDEX_SUFFIX)]
+    index = numpy.load(index_filename)
+    self.video_ids = index["video_ids"]
+    self.offsets = index["offsets"]
+    self.num_frames = index["num_frames"]
+    self.label_indices = index["label_indices"]
+    self.label_offsets = index["label_offsets"]
+    self.feature_names = [name.decode("utf-8") if isinstance(name, bytes) else name
+                          for name in index["feature_names"].tolist()]
+    self.feature_sizes = index["feature_sizes"].tolist()
+
+    row_size = sum(self.feature_sizes)
+    if os.path.getsize(prefix + FRAMES_SUFFIX) > 0:
+      self.frames = numpy.memmap(prefix + FRAMES_SUFFIX, dtype=numpy.uint8,
+                                 mode="r").reshape([-1, row_size])
+    else:
+      self.frames = numpy.zeros([0, row_size], dtype=numpy.uint8)
+
+  def __len__(self):
+    return len(self.video_ids)
+
+  def get_columns(self, feature_names):
+    """Returns the column indexes of the given features in a frame row."""
+    starts = numpy.cumsum([0] + self.feature_sizes)
+    columns = []
+    for feature_name in feature_names:
+      if feature_name not in self.feature_names:
+        raise ValueError("feature '%s' is not packed in this shard." %
+                         feature_name)
+      i = self.feature_names.index(feature_name)
+      columns.append(numpy.arange(starts[i], starts[i + 1]))
+    return numpy.concatenate(columns)
+
+  def read(self, start, end, feature_names, max_frames, num_classes):
+    """Reads the videos [start, end) of the shard.
+
+    Args:
+      start: index of the first video to read.
+      end: index after the last video to read.
+      feature_names: the features to read, concatenated in this order.
+      max_frames: the number of frames (rows) in the output matrices.
+      num_classes: the number of classes.
+
+    Returns:
+      A tuple of video ids, uint8 frame matrices padded to max_frames, dense
+      boolean labels and the number of frames of every video.
+    """
+    end = min(end, len(self))
+    columns = self.get_columns(feature_names)
+    full_row = len(columns) == self.frames.shape[1]
+
+    num_videos = max(end - start, 0)
+    num_frames = numpy.minimum(self.num_frames[start:end], max_frames)
+    matrices = numpy.zeros([num_videos, max_frames, len(columns)],
+                           dtype=numpy.uint8)
+    for i in range(num_videos):
+      offset = self.offsets[start + i]
+      frames = self.frames[offset:offset + num_frames[i]]
+      matrices[i, :num_frames[i]] = frames if full_row else frames[:, columns]
+
+    labels = numpy.zeros([num_videos, num_classes], dtype=numpy.bool_)
+    label_start, label_end = self.label_offsets[start], self.label_offsets[end]
+    rows = numpy.repeat(numpy.arange(num_videos),
+                        numpy.diff(self.label_offsets[start:end + 1]))
+    labels[rows, self.label_indices[label_start:label_end]] = True
+
+    return (self.video_ids[start:end], matrices, labels,
+            num_frames.astype(numpy.int32))
@@ -0,0 +1,16 @@
+for part in test ensemble_train ensemble_validate; do 
+    CUDA_VISIBLE_DEVICES=0 python inference-pre-ensemble-multi.py \
+	      --output_dirs="/Youtube-8M/model_predictions/${part}/cnn_model,/Youtube-8M/model_predictions/${part}/deeplstm1024_layer6_moe4" \
+        --model_checkpoint_paths="../model/cnn_model/model.ckpt-374098,../model/deeplstm1024_layer6_moe4/model.ckpt-175048" \
+        --models="CnnModel,DeepLstmModel" \
+        --cnn_num_filters=512 \
+        --lstm_cells=1024 \
+        --lstm_layers=6 \
+        --moe_num_mixtures=4 \
+	      --input_data_pattern="/Youtube-8M/data/frame/${part}/*.tfrecord" \
+	      --frame_features=True \
+	      --feature_names="rgb,audio" \
+	      --feature_sizes="1024,128" \
+	      --batch_size=128 \
+	      --file_size=4096
+done
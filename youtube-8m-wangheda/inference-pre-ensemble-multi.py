@@ -0,0 +1,420 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Binary for generating the predictions of several models at once.
+
+Every input batch is read and decoded once and run through all the models.
+Each model is rebuilt from its class in --models with is_training=False,
+like in inference-pre-ensemble.py, under its own variable scope on the
+shared input, and only its own variables are restored from its checkpoint.
+The model flags (e.g. --moe_num_mixtures) apply to all the models, so the
+models must have been trained with the same values of the flags they share.
+The predictions of each model are written to its own output directory, in
+the same shards as inference-pre-ensemble.py.
+"""
+
+import os
+import time
+
+import dataset_input
+import example_serializer
+import feature_transform
+import frame_level_models
+import prediction_store
+import readers
+import shard_writer
+import utils
+import video_level_models
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import app
+from tensorflow import flags
+from tensorflow import gfile
+from tensorflow import logging
+
+
+FLAGS = flags.FLAGS
+
+if __name__ == '__main__':
+  flags.DEFINE_string(
+      "model_checkpoint_paths", "",
+      "Comma-separated list of the checkpoints of the models, a training "
+      "directory stands for its latest checkpoint.")
+  flags.DEFINE_string(
+      "output_dirs", "",
+      "Comma-separated list of the directories to save the predictions of "
+      "the models to, in the order of --model_checkpoint_paths.")
+  flags.DEFINE_string(
+      "models", "",
+      "Comma-separated list of the architectures of the models, in the order "
+      "of --model_checkpoint_paths. Models are defined in "
+      "frame_level_models.py and video_level_models.py.")
+  flags.DEFINE_string(
+      "feature_transformers", "",
+      "Comma-separated list of the feature transformers of the models, in "
+      "the order of --model_checkpoint_paths. If empty, all the models use "
+      "--feature_transformer.")
+  flags.DEFINE_string(
+      "input_data_pattern", "",
+      "File glob defining the evaluation dataset in tensorflow.SequenceExample "
+      "format. The SequenceExamples are expected to have an 'rgb' byte array "
+      "sequence feature as well as a 'labels' int64 context feature.")
+  flags.DEFINE_bool(
+      "frame_features", False,
+      "If set, then --input_data_pattern must be frame-level features. "
+      "Otherwise, --input_data_pattern must be aggregated video-level "
+      "features. The models must also be set appropriately (i.e. to read 3D "
+      "batches VS 4D batches.")
+  flags.DEFINE_integer(
+      "frame_read_batch_size", 0,
+      "If positive, frame-level records are read and decoded this many at a "
+      "time by YT8MBatchFrameFeatureReader instead of one by one.")
+  flags.DEFINE_bool(
+      "packed_frame_features", False,
+      "If set, frame-level features are read from packed shards written by "
+      "pack-frame-features.py, the data pattern must match their *.index.npz "
+      "files.")
+  flags.DEFINE_bool(
+      "quantized_frame_queue", False,
+      "If set, frame-level features stay uint8 in the batching queue and are "
+      "dequantized after dequeue, which cuts the queue memory by 4x.")
+  flags.DEFINE_integer(
+      "frame_stride", 1,
+      "If larger than 1, the frame-level readers decode and emit only "
+      "max_frames / frame_stride frames per video, chosen by --frame_sampling.")
+  flags.DEFINE_string(
+      "frame_sampling", "stride",
+      "How frames are chosen when --frame_stride > 1: 'stride' keeps every "
+      "frame_stride-th frame, 'average' averages consecutive frames and "
+      "'random' samples frames at random in temporal order.")
+  flags.DEFINE_bool(
+      "use_dataset", False,
+      "If set, the input is read by the tf.data pipeline of dataset_input.py "
+      "instead of queue runners. Requires TensorFlow 1.4 or later.")
+  flags.DEFINE_integer(
+      "batch_size", 8192,
+      "How many examples to process per batch.")
+  flags.DEFINE_string("feature_names", "mean_rgb", "Name of the feature "
+                      "to use for training.")
+  flags.DEFINE_string("feature_sizes", "1024", "Length of the feature vectors.")
+  flags.DEFINE_integer("file_size", 4096,
+                       "Number of frames per batch for DBoF.")
+  flags.DEFINE_integer(
+      "num_writer_threads", 2,
+      "The number of threads serializing and writing the output shards "
+      "while the next ones are computed, 0 to write them in the "
+      "inference loop.")
+  flags.DEFINE_bool(
+      "output_prediction_store", False,
+      "If set, the predictions are written as prediction_store shards instead "
+      "of tfrecords.")
+  flags.DEFINE_string(
+      "prediction_store_dtype", "float16",
+      "The dtype of the predictions in the prediction_store shards, float16 "
+      "or float32.")
+
+  # Other flags.
+  flags.DEFINE_integer("num_readers", 1,
+                       "How many threads to use for reading input files.")
+
+
+def get_input_data_tensors(reader, data_pattern, batch_size, num_readers=1):
+  """Creates the section of the graph which reads the input data.
+
+  Args:
+    reader: A class which parses the input data.
+    data_pattern: A 'glob' style path to the data files.
+    batch_size: How many examples to process at a time.
+    num_readers: How many I/O threads to use.
+
+  Returns:
+    A tuple containing the video ids, the dequantized features, the labels
+    and the numbers of frames of the next batch.
+
+  Raises:
+    IOError: If no files matching the given pattern were found.
+  """
+  with tf.name_scope("input"):
+    files = gfile.Glob(data_pattern)
+    files.sort()
+    if not files:
+      raise IOError("Unable to find input files. data_pattern='" +
+                    data_pattern + "'")
+    logging.info("number of input files: " + str(len(files)))
+    if FLAGS.use_dataset:
+      video_id_batch, video_batch, labels_batch, num_frames_batch = (
+          dataset_input.get_input_tensors(
+              reader, files, batch_size, num_epochs=1))
+    else:
+      filename_queue = tf.train.string_input_producer(
+          files, num_epochs=1, shuffle=False)
+      examples_and_labels = reader.prepare_reader(filename_queue)
+      video_id_batch, video_batch, labels_batch, num_frames_batch = (
+          tf.train.batch(examples_and_labels,
+                         batch_size=batch_size,
+                         capacity=batch_size * 8,
+                         allow_smaller_final_batch=True,
+                         enqueue_many=True))
+    if video_batch.dtype == tf.uint8:
+      video_batch = utils.DequantizeFrames(video_batch, num_frames_batch)
+    return video_id_batch, video_batch, labels_batch, num_frames_batch
+
+
+def get_checkpoint(path):
+  """Returns the latest checkpoint of path if it is a training directory."""
+  if gfile.IsDirectory(path):
+    checkpoint = tf.train.latest_checkpoint(path)
+    if checkpoint is None:
+      raise IOError("unable to find a checkpoint at location: %s" % path)
+    return checkpoint
+  return path
+
+
+def find_class_by_name(name, modules):
+  """Searches the provided modules for the named class and returns it."""
+  modules = [getattr(module, name, None) for module in modules]
+  return next(a for a in modules if a)
+
+
+def build_models(models, transformer_classes, video_batch, labels_batch,
+                 num_frames_batch, num_classes):
+  """Builds the models for inference on the shared input tensors.
+
+  The model models[i] is built under the variable scope model<i>, and its
+  saver maps the names its variables have in training to them.
+
+  Args:
+    models: the models, they should inherit from BaseModel.
+    transformer_classes: the feature transformer class of every model.
+    video_batch: the tensor of the decoded features.
+    labels_batch: the tensor of the labels.
+    num_frames_batch: the tensor of the numbers of frames.
+    num_classes: the number of classes.
+
+  Returns:
+    The savers and the predictions tensors of the models.
+  """
+  savers = []
+  predictions = []
+  for index, (model, transformer_class) in enumerate(
+      zip(models, transformer_classes)):
+    scope = "model%d" % index
+    with tf.variable_scope(scope):
+      feature_transformer = transformer_class()
+      model_input, num_frames = feature_transformer.transform(
+          video_batch, num_frames=num_frames_batch)
+      with tf.name_scope("model"):
+        result = model.create_model(
+            model_input,
+            num_frames=num_frames,
+            vocab_size=num_classes,
+            labels=labels_batch,
+            noise_level=None,
+            distillation_predictions=None,
+            is_training=False)
+    predictions.append(result["predictions"])
+
+    variables = tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES,
+                                  scope=scope + "/")
+    savers.append(tf.train.Saver(
+        dict((variable.op.name[len(scope) + 1:], variable)
+             for variable in variables)))
+  return savers, predictions
+
+
+def write_to_record(output_dir, id_batch, label_batch, predictions, filenum, num_examples_processed):
+  if FLAGS.output_prediction_store:
+    prediction_store.write_shard(
+        os.path.join(output_dir, 'predictions-%04d' % filenum),
+        id_batch[:num_examples_processed],
+        label_batch[:num_examples_processed],
+        predictions[:num_examples_processed],
+        dtype=FLAGS.prediction_store_dtype)
+    return
+  writer = tf.python_io.TFRecordWriter(output_dir + '/' + 'predictions-%04d.tfrecord' % filenum)
+  for serialized in example_serializer.serialize_examples(
+      id_batch[:num_examples_processed],
+      label_batch[:num_examples_processed],
+      {'predictions': predictions[:num_examples_processed]}):
+    writer.write(serialized)
+  writer.close()
+
+
+def inference(reader, models, transformer_classes, checkpoints, output_dirs,
+              data_pattern, batch_size):
+  with tf.Session() as sess:
+    video_id_batch, video_batch, labels_batch, num_frames_batch = (
+        get_input_data_tensors(reader, data_pattern, batch_size,
+                               num_readers=FLAGS.num_readers))
+    savers, predictions_tensors = build_models(
+        models, transformer_classes, video_batch, labels_batch,
+        num_frames_batch, reader.num_classes)
+    for saver, checkpoint in zip(savers, checkpoints):
+      logging.info("restoring variables from " + checkpoint)
+      saver.restore(sess, checkpoint)
+
+    # Workaround for num_epochs issue.
+    def set_up_init_ops(variables):
+      init_op_list = []
+      for variable in list(variables):
+        if "train_input" in variable.name:
+          init_op_list.append(tf.assign(variable, 1))
+          variables.remove(variable)
+      init_op_list.append(tf.variables_initializer(variables))
+      return init_op_list
+
+    sess.run(set_up_init_ops(tf.get_collection_ref(
+        tf.GraphKeys.LOCAL_VARIABLES)))
+
+    for directory in output_dirs:
+      if not os.path.exists(directory):
+        os.makedirs(directory)
+      else:
+        raise IOError("Output path exists! path='" + directory + "'")
+
+    coord = tf.train.Coordinator()
+    threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+    start_time = time.time()
+
+    fetches = [video_id_batch, labels_batch] + predictions_tensors
+    filenum = 0
+    video_id = []
+    video_label = []
+    video_features = [[] for _ in checkpoints]
+    num_examples_processed = 0
+
+    async_writer = shard_writer.AsyncShardWriter(
+        write_to_record, FLAGS.num_writer_threads,
+        max_pending=max(FLAGS.num_writer_threads, 1) * len(checkpoints))
+
+    def get_shards():
+      ids = np.concatenate(video_id, axis=0)
+      labels = np.concatenate(video_label, axis=0)
+      return [(output_dir, ids, labels, np.concatenate(features, axis=0),
+               filenum, num_examples_processed)
+              for output_dir, features in zip(output_dirs, video_features)]
+
+    finished = False
+    try:
+      while not coord.should_stop():
+        fetches_val = sess.run(fetches)
+        video_id.append(fetches_val[0])
+        video_label.append(fetches_val[1])
+        for features, predictions_val in zip(video_features, fetches_val[2:]):
+          features.append(predictions_val)
+
+        num_examples_processed += len(fetches_val[0])
+        now = time.time()
+        logging.info("num examples processed: " + str(num_examples_processed) + " elapsed seconds: " + "{0:.2f}".format(now-start_time))
+
+        if num_examples_processed >= FLAGS.file_size:
+          assert num_examples_processed==FLAGS.file_size, "num_examples_processed should be equal to file_size"
+          for shard in get_shards():
+            async_writer.submit(*shard)
+          filenum += 1
+          video_id = []
+          video_label = []
+          video_features = [[] for _ in checkpoints]
+          num_examples_processed = 0
+      finished = True
+
+    except tf.errors.OutOfRangeError:
+      logging.info('Done with inference. The outputs were written to ' + ",".join(output_dirs))
+      finished = True
+    finally:
+      coord.request_stop()
+      last_shards = []
+      if 0 < num_examples_processed <= FLAGS.file_size:
+        last_shards = get_shards()
+      # an error of the writer must not hide the one that stopped the loop
+      async_writer.close(last_shards, raise_errors=finished)
+
+    coord.join(threads)
+    sess.close()
+
+
+def main(unused_argv):
+  logging.set_verbosity(tf.logging.INFO)
+
+  # convert feature_names and feature_sizes to lists of values
+  feature_names, feature_sizes = utils.GetListOfFeatureNamesAndSizes(
+      FLAGS.feature_names, FLAGS.feature_sizes)
+
+  if FLAGS.frame_features and FLAGS.packed_frame_features:
+    reader = readers.YT8MPackedFrameFeatureReader(
+        feature_names=feature_names, feature_sizes=feature_sizes,
+        dequantize=not FLAGS.quantized_frame_queue,
+        frame_stride=FLAGS.frame_stride)
+  elif FLAGS.frame_features and FLAGS.frame_read_batch_size > 0:
+    reader = readers.YT8MBatchFrameFeatureReader(
+        feature_names=feature_names, feature_sizes=feature_sizes,
+        read_batch_size=FLAGS.frame_read_batch_size,
+        dequantize=not FLAGS.quantized_frame_queue,
+        frame_stride=FLAGS.frame_stride,
+        frame_sampling=FLAGS.frame_sampling)
+  elif FLAGS.frame_features:
+    reader = readers.YT8MFrameFeatureReader(feature_names=feature_names,
+                                            feature_sizes=feature_sizes,
+                                            dequantize=not FLAGS.quantized_frame_queue,
+                                            frame_stride=FLAGS.frame_stride,
+                                            frame_sampling=FLAGS.frame_sampling)
+  else:
+    reader = readers.YT8MAggregatedFeatureReader(feature_names=feature_names,
+                                                 feature_sizes=feature_sizes)
+
+  checkpoints = [path.strip() for path in
+                 FLAGS.model_checkpoint_paths.strip().strip(",").split(",")
+                 if path.strip()]
+  output_dirs = [path.strip() for path in
+                 FLAGS.output_dirs.strip().strip(",").split(",")
+                 if path.strip()]
+  if not checkpoints:
+    raise ValueError("'model_checkpoint_paths' was not specified. "
+      "Unable to continue with inference.")
+  if len(output_dirs) != len(checkpoints):
+    raise ValueError("'output_dirs' must have one directory per checkpoint "
+      "of 'model_checkpoint_paths'.")
+
+  model_names = [name.strip() for name in
+                 FLAGS.models.strip().strip(",").split(",") if name.strip()]
+  if len(model_names) != len(checkpoints):
+    raise ValueError("'models' must have one model per checkpoint "
+      "of 'model_checkpoint_paths'.")
+  transformer_names = [name.strip() for name in
+                       FLAGS.feature_transformers.strip().strip(",").split(",")
+                       if name.strip()]
+  if not transformer_names:
+    transformer_names = [FLAGS.feature_transformer] * len(checkpoints)
+  if len(transformer_names) != len(checkpoints):
+    raise ValueError("'feature_transformers' must have one transformer per "
+      "checkpoint of 'model_checkpoint_paths'.")
+
+  models = [find_class_by_name(name,
+                               [frame_level_models, video_level_models])()
+            for name in model_names]
+  transformer_classes = [find_class_by_name(name, [feature_transform])
+                         for name in transformer_names]
+
+  if FLAGS.input_data_pattern is "":
+    raise ValueError("'input_data_pattern' was not specified. "
+      "Unable to continue with inference.")
+
+  inference(reader, models, transformer_classes,
+            [get_checkpoint(path) for path in checkpoints],
+            output_dirs, FLAGS.input_data_pattern, FLAGS.batch_size)
+
+
+if __name__ == "__main__":
+  app.run()
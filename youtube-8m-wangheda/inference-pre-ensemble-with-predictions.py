@@ -25,6 +25,8 @@ import video_level_models
 import data_augmentation
 import feature_transform
 import readers
+import example_serializer
+import shard_writer
 import utils
 
 import numpy
@@ -69,6 +71,11 @@ if __name__ == '__main__':
   flags.DEFINE_string("feature_sizes", "1024", "Length of the feature vectors.")
   flags.DEFINE_integer("file_size", 4096,
                        "Number of frames per batch for DBoF.")
+  flags.DEFINE_integer(
+      "num_writer_threads", 2,
+      "The number of threads serializing and writing the output shards "
+      "while the next ones are computed, 0 to write them in the "
+      "inference loop.")
   flags.DEFINE_string(
       "model", "YouShouldSpecifyAModel",
       "Which architecture to use for the model. Models are defined "
@@ -259,6 +266,10 @@ def inference(saver, model_checkpoint_path, out_file_location, batch_size, top_k
     else:
         raise IOError("Output path exists! path='" + directory + "'")
 
+    async_writer = shard_writer.AsyncShardWriter(
+        write_to_record, FLAGS.num_writer_threads)
+
+    finished = False
     try:
       while not coord.should_stop():
           predictions_batch_val, video_id_batch_val, labels_batch_val = sess.run([predictions_tensor, video_id_tensor, labels_tensor])
@@ -276,46 +287,41 @@ def inference(saver, model_checkpoint_path, out_file_location, batch_size, top_k
             video_id = np.concatenate(video_id, axis=0)
             video_label = np.concatenate(video_label, axis=0)
             video_features = np.concatenate(video_features, axis=0)
-            write_to_record(video_id, video_label, video_features, filenum, num_examples_processed)
+            async_writer.submit(video_id, video_label, video_features, filenum, num_examples_processed)
 
             filenum += 1
             video_id = []
             video_label = []
             video_features = []
             num_examples_processed = 0
+      finished = True
 
     except tf.errors.OutOfRangeError:
         logging.info('Done with inference. The output file was written to ' + out_file_location)
+        finished = True
     finally:
         coord.request_stop()
+        last_shards = []
         if 0 < num_examples_processed <= FLAGS.file_size:
             video_id = np.concatenate(video_id,axis=0)
             video_label = np.concatenate(video_label,axis=0)
             video_features = np.concatenate(video_features,axis=0)
-            write_to_record(video_id, video_label, video_features, filenum,num_examples_processed)
+            last_shards.append((video_id, video_label, video_features, filenum,num_examples_processed))
+        # an error of the writer must not hide the one that stopped the loop
+        async_writer.close(last_shards, raise_errors=finished)
 
     coord.join(threads)
     sess.close()
 
 def write_to_record(id_batch, label_batch, predictions, filenum, num_examples_processed):
     writer = tf.python_io.TFRecordWriter(FLAGS.output_dir + '/' + 'predictions-%04d.tfrecord' % filenum)
-    for i in range(num_examples_processed):
-        video_id = id_batch[i]
-        label = np.nonzero(label_batch[i,:])[0]
-        example = get_output_feature(video_id, label, [predictions[i,:]], ['predictions'])
-        serialized = example.SerializeToString()
+    for serialized in example_serializer.serialize_examples(
+            id_batch[:num_examples_processed],
+            label_batch[:num_examples_processed],
+            {'predictions': predictions[:num_examples_processed]}):
         writer.write(serialized)
     writer.close()
 
-def get_output_feature(video_id, labels, features, feature_names):
-    feature_maps = {'video_id': tf.train.Feature(bytes_list=tf.train.BytesList(value=[video_id])),
-                    'labels': tf.train.Feature(int64_list=tf.train.Int64List(value=labels))}
-    for feature_index in range(len(feature_names)):
-        feature_maps[feature_names[feature_index]] = tf.train.Feature(
-            float_list=tf.train.FloatList(value=features[feature_index]))
-    example = tf.train.Example(features=tf.train.Features(feature=feature_maps))
-    return example
-
 def main(unused_argv):
   logging.set_verbosity(tf.logging.INFO)
 
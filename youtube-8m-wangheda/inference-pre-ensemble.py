@@ -24,7 +24,11 @@ import frame_level_models
 import video_level_models
 import data_augmentation
 import feature_transform
+import prediction_store
+import dataset_input
 import readers
+import example_serializer
+import shard_writer
 import utils
 
 import numpy
@@ -61,6 +65,33 @@ if __name__ == '__main__':
       "Otherwise, --eval_data_pattern must be aggregated video-level "
       "features. The model must also be set appropriately (i.e. to read 3D "
       "batches VS 4D batches.")
+  flags.DEFINE_integer(
+      "frame_read_batch_size", 0,
+      "If positive, frame-level records are read and decoded this many at a "
+      "time by YT8MBatchFrameFeatureReader instead of one by one.")
+  flags.DEFINE_bool(
+      "packed_frame_features", False,
+      "If set, frame-level features are read from packed shards written by "
+      "pack-frame-features.py, the data pattern must match their *.index.npz "
+      "files.")
+  flags.DEFINE_bool(
+      "quantized_frame_queue", False,
+      "If set, frame-level features stay uint8 in the batching queue and are "
+      "dequantized after dequeue, which cuts the queue memory by 4x.")
+  flags.DEFINE_integer(
+      "frame_stride", 1,
+      "If larger than 1, the frame-level readers decode and emit only "
+      "max_frames / frame_stride frames per video, chosen by --frame_sampling.")
+  flags.DEFINE_string(
+      "frame_sampling", "stride",
+      "How frames are chosen when --frame_stride > 1: 'stride' keeps every "
+      "frame_stride-th frame, 'average' averages consecutive frames and "
+      "'random' samples frames at random in temporal order.")
+  flags.DEFINE_bool(
+      "use_dataset", False,
+      "If set, the input is read by the tf.data pipeline of dataset_input.py "
+      "instead of queue runners, --frame_bucket_boundaries is not applied. "
+      "Requires TensorFlow 1.4 or later.")
   flags.DEFINE_integer(
       "batch_size", 8192,
       "How many examples to process per batch.")
@@ -69,6 +100,29 @@ if __name__ == '__main__':
   flags.DEFINE_string("feature_sizes", "1024", "Length of the feature vectors.")
   flags.DEFINE_integer("file_size", 4096,
                        "Number of frames per batch for DBoF.")
+  flags.DEFINE_integer(
+      "num_writer_threads", 2,
+      "The number of threads serializing and writing the output shards "
+      "while the next ones are computed, 0 to write them in the "
+      "inference loop.")
+  flags.DEFINE_bool(
+      "output_prediction_store", False,
+      "If set, the predictions are written as prediction_store shards instead "
+      "of tfrecords.")
+  flags.DEFINE_string(
+      "prediction_store_dtype", "float16",
+      "The dtype of the predictions in the prediction_store shards, float16 "
+      "or float32.")
+  flags.DEFINE_integer(
+      "output_top_k", 0,
+      "If positive, only the top-k (class, score) pairs of every video are "
+      "written, must be less than the number of classes. Read them with "
+      "--sparse_predictions_top_k set to the same value in the ensemble, the "
+      "top-k features are parsed with a fixed length.")
+  flags.DEFINE_bool(
+      "output_top_k_floor", False,
+      "If set, the mean score of the classes outside the top-k is written as "
+      "the floor of the sparse predictions, otherwise the floor is 0.")
   flags.DEFINE_string(
       "model", "YouShouldSpecifyAModel",
       "Which architecture to use for the model. Models are defined "
@@ -117,6 +171,9 @@ def get_input_data_tensors(reader, data_pattern, batch_size, num_readers=1):
       raise IOError("Unable to find input files. data_pattern='" +
                     data_pattern + "'")
     logging.info("number of input files: " + str(len(files)))
+    if FLAGS.use_dataset:
+      return dataset_input.get_input_tensors(
+          reader, files, batch_size, num_epochs=1)
     filename_queue = tf.train.string_input_producer(
         files, num_epochs=1, shuffle=False)
     examples_and_labels = reader.prepare_reader(filename_queue)
@@ -142,6 +199,8 @@ def build_graph(reader,
           reader,
           input_data_pattern,
           batch_size=batch_size))
+  if model_input_raw.dtype == tf.uint8:
+    model_input_raw = utils.DequantizeFrames(model_input_raw, num_frames)
 
   if distill_reader is not None:
     unused_video_id_batch, distill_input_raw, unused_labels_batch, unused_num_frames = get_input_data_tensors(  # pylint: disable=g-line-too-long
@@ -250,6 +309,10 @@ def inference(saver, model_checkpoint_path, out_file_location, batch_size, top_k
     else:
         raise IOError("Output path exists! path='" + directory + "'")
 
+    async_writer = shard_writer.AsyncShardWriter(
+        write_to_record, FLAGS.num_writer_threads)
+
+    finished = False
     try:
       while not coord.should_stop():
           predictions_batch_val, video_id_batch_val, labels_batch_val = sess.run([predictions_tensor, video_id_tensor, labels_tensor])
@@ -267,45 +330,75 @@ def inference(saver, model_checkpoint_path, out_file_location, batch_size, top_k
             video_id = np.concatenate(video_id, axis=0)
             video_label = np.concatenate(video_label, axis=0)
             video_features = np.concatenate(video_features, axis=0)
-            write_to_record(video_id, video_label, video_features, filenum, num_examples_processed)
+            async_writer.submit(video_id, video_label, video_features, filenum, num_examples_processed)
 
             filenum += 1
             video_id = []
             video_label = []
             video_features = []
             num_examples_processed = 0
+      finished = True
 
     except tf.errors.OutOfRangeError:
         logging.info('Done with inference. The output file was written to ' + out_file_location)
+        finished = True
     finally:
         coord.request_stop()
+        last_shards = []
         if 0 < num_examples_processed <= FLAGS.file_size:
             video_id = np.concatenate(video_id,axis=0)
             video_label = np.concatenate(video_label,axis=0)
             video_features = np.concatenate(video_features,axis=0)
-            write_to_record(video_id, video_label, video_features, filenum,num_examples_processed)
+            last_shards.append((video_id, video_label, video_features, filenum,num_examples_processed))
+        # an error of the writer must not hide the one that stopped the loop
+        async_writer.close(last_shards, raise_errors=finished)
 
     coord.join(threads)
     sess.close()
 
 def write_to_record(id_batch, label_batch, predictions, filenum, num_examples_processed):
+    if FLAGS.output_top_k > 0:
+        write_top_k_to_record(id_batch, label_batch, predictions, filenum, num_examples_processed)
+        return
+    if FLAGS.output_prediction_store:
+        prediction_store.write_shard(
+            os.path.join(FLAGS.output_dir, 'predictions-%04d' % filenum),
+            id_batch[:num_examples_processed],
+            label_batch[:num_examples_processed],
+            predictions[:num_examples_processed],
+            dtype=FLAGS.prediction_store_dtype)
+        return
     writer = tf.python_io.TFRecordWriter(FLAGS.output_dir + '/' + 'predictions-%04d.tfrecord' % filenum)
-    for i in range(num_examples_processed):
-        video_id = id_batch[i]
-        label = np.nonzero(label_batch[i,:])[0]
-        example = get_output_feature(video_id, label, [predictions[i,:]], ['predictions'])
-        serialized = example.SerializeToString()
+    for serialized in example_serializer.serialize_examples(
+            id_batch[:num_examples_processed],
+            label_batch[:num_examples_processed],
+            {'predictions': predictions[:num_examples_processed]}):
         writer.write(serialized)
     writer.close()
 
-def get_output_feature(video_id, labels, features, feature_names):
-    feature_maps = {'video_id': tf.train.Feature(bytes_list=tf.train.BytesList(value=[video_id])),
-                    'labels': tf.train.Feature(int64_list=tf.train.Int64List(value=labels))}
-    for feature_index in range(len(feature_names)):
-        feature_maps[feature_names[feature_index]] = tf.train.Feature(
-            float_list=tf.train.FloatList(value=features[feature_index]))
-    example = tf.train.Example(features=tf.train.Features(feature=feature_maps))
-    return example
+def write_top_k_to_record(id_batch, label_batch, predictions, filenum, num_examples_processed):
+    top_k = FLAGS.output_top_k
+    predictions = predictions[:num_examples_processed]
+    rows = np.arange(num_examples_processed)[:, np.newaxis]
+    top_k_classes = np.argpartition(-predictions, top_k - 1, axis=1)[:, :top_k]
+    top_k_scores = predictions[rows, top_k_classes]
+    order = np.argsort(-top_k_scores, axis=1)
+    top_k_classes = top_k_classes[rows, order]
+    top_k_scores = top_k_scores[rows, order]
+    if FLAGS.output_top_k_floor:
+        floors = ((predictions.sum(axis=1) - top_k_scores.sum(axis=1)) /
+                  (predictions.shape[1] - top_k))
+    else:
+        floors = np.zeros([num_examples_processed])
+
+    writer = tf.python_io.TFRecordWriter(FLAGS.output_dir + '/' + 'predictions-%04d.tfrecord' % filenum)
+    for serialized in example_serializer.serialize_examples(
+            id_batch[:num_examples_processed],
+            label_batch[:num_examples_processed],
+            {'top_k_scores': top_k_scores, 'floor': floors[:, np.newaxis]},
+            {'top_k_classes': top_k_classes}):
+        writer.write(serialized)
+    writer.close()
 
 def main(unused_argv):
   logging.set_verbosity(tf.logging.INFO)
@@ -314,9 +407,24 @@ def main(unused_argv):
   feature_names, feature_sizes = utils.GetListOfFeatureNamesAndSizes(
       FLAGS.feature_names, FLAGS.feature_sizes)
 
-  if FLAGS.frame_features:
+  if FLAGS.frame_features and FLAGS.packed_frame_features:
+    reader = readers.YT8MPackedFrameFeatureReader(
+        feature_names=feature_names, feature_sizes=feature_sizes,
+        dequantize=not FLAGS.quantized_frame_queue,
+        frame_stride=FLAGS.frame_stride)
+  elif FLAGS.frame_features and FLAGS.frame_read_batch_size > 0:
+    reader = readers.YT8MBatchFrameFeatureReader(
+        feature_names=feature_names, feature_sizes=feature_sizes,
+        read_batch_size=FLAGS.frame_read_batch_size,
+        dequantize=not FLAGS.quantized_frame_queue,
+        frame_stride=FLAGS.frame_stride,
+        frame_sampling=FLAGS.frame_sampling)
+  elif FLAGS.frame_features:
     reader = readers.YT8MFrameFeatureReader(feature_names=feature_names,
-                                            feature_sizes=feature_sizes)
+                                            feature_sizes=feature_sizes,
+                                            dequantize=not FLAGS.quantized_frame_queue,
+                                            frame_stride=FLAGS.frame_stride,
+                                            frame_sampling=FLAGS.frame_sampling)
   else:
     reader = readers.YT8MAggregatedFeatureReader(feature_names=feature_names,
                                                  feature_sizes=feature_sizes)
@@ -329,6 +437,10 @@ def main(unused_argv):
     raise ValueError("'input_data_pattern' was not specified. "
       "Unable to continue with inference.")
 
+  if FLAGS.output_top_k and not 0 < FLAGS.output_top_k < reader.num_classes:
+    raise ValueError("'output_top_k' must be between 0 and the number of "
+      "classes (%d), got %d." % (reader.num_classes, FLAGS.output_top_k))
+
   if FLAGS.distill_data_pattern is not None:
     distill_reader = readers.YT8MAggregatedFeatureReader(feature_names=["predictions"],
                                                          feature_sizes=[4716])
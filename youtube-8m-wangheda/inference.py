@@ -24,10 +24,13 @@ from tensorflow import app
 from tensorflow import flags
 from tensorflow import gfile
 from tensorflow import logging
+from tensorflow.python.framework import meta_graph
 
 import eval_util
 import losses
+import dataset_input
 import readers
+import submission_writer
 import utils
 
 FLAGS = flags.FLAGS
@@ -52,6 +55,40 @@ if __name__ == '__main__':
       "Otherwise, --eval_data_pattern must be aggregated video-level "
       "features. The model must also be set appropriately (i.e. to read 3D "
       "batches VS 4D batches.")
+  flags.DEFINE_integer(
+      "frame_read_batch_size", 0,
+      "If positive, frame-level records are read and decoded this many at a "
+      "time by YT8MBatchFrameFeatureReader instead of one by one.")
+  flags.DEFINE_bool(
+      "packed_frame_features", False,
+      "If set, frame-level features are read from packed shards written by "
+      "pack-frame-features.py, the data pattern must match their *.index.npz "
+      "files.")
+  flags.DEFINE_bool(
+      "quantized_frame_queue", False,
+      "If set, frame-level features stay uint8 in the batching queue and are "
+      "dequantized after dequeue, which cuts the queue memory by 4x.")
+  flags.DEFINE_integer(
+      "frame_stride", 1,
+      "If larger than 1, the frame-level readers decode and emit only "
+      "max_frames / frame_stride frames per video, chosen by --frame_sampling.")
+  flags.DEFINE_string(
+      "frame_sampling", "stride",
+      "How frames are chosen when --frame_stride > 1: 'stride' keeps every "
+      "frame_stride-th frame, 'average' averages consecutive frames and "
+      "'random' samples frames at random in temporal order.")
+  flags.DEFINE_bool(
+      "use_dataset", False,
+      "If set, the input is read by the tf.data pipeline of dataset_input.py "
+      "instead of queue runners, --frame_bucket_boundaries is not applied. "
+      "Requires TensorFlow 1.4 or later.")
+  flags.DEFINE_string(
+      "frame_bucket_boundaries", "",
+      "Comma separated num_frames boundaries, e.g. '60,120,180,240'. If set, "
+      "frame-level videos are batched by length bucket and each batch is "
+      "padded to its longest video instead of max_frames. The model must not "
+      "rely on a static number of frames. Cannot be used with "
+      "--frame_read_batch_size.")
   flags.DEFINE_integer(
       "batch_size", 8192,
       "How many examples to process per batch.")
@@ -73,18 +110,35 @@ if __name__ == '__main__':
       "probability to keep output (used in dropout, keep it unchanged in validationg and test)")
 
 
-def format_lines(video_ids, predictions, top_k):
-  batch_size = len(video_ids)
-  for video_index in range(batch_size):
-    top_indices = numpy.argpartition(predictions[video_index], -top_k)[-top_k:]
-    line = [(class_index, predictions[video_index][class_index])
-            for class_index in top_indices]
-  #  print("Type - Test :")
-  #  print(type(video_ids[video_index]))
-  #  print(video_ids[video_index].decode('utf-8'))
-    line = sorted(line, key=lambda p: -p[1])
-    yield video_ids[video_index].decode('utf-8') + "," + " ".join("%i %f" % pair
-                                                  for pair in line) + "\n"
+def get_collection_tensor_name(meta_graph_def, key):
+  """Returns the name of the first tensor in a collection of a MetaGraphDef."""
+  return meta_graph_def.collection_def[key].node_list.value[0]
+
+
+def import_model(meta_graph_location, video_batch, num_frames_batch):
+  """Imports a trained graph with its inputs bound to the reader tensors.
+
+  The input_batch_raw and num_frames tensors of the training graph are
+  replaced by video_batch and num_frames_batch, so that the predictions are
+  computed from the decoded batch in the same session call, without copying
+  the batch to the host and feeding it back.
+
+  Args:
+    meta_graph_location: the path of the .meta file of the checkpoint.
+    video_batch: the tensor of the decoded features.
+    num_frames_batch: the tensor of the numbers of frames.
+
+  Returns:
+    The saver of the imported graph.
+  """
+  meta_graph_def = meta_graph.read_meta_graph_file(meta_graph_location)
+  input_map = {
+      get_collection_tensor_name(meta_graph_def, "input_batch_raw"):
+          video_batch,
+      get_collection_tensor_name(meta_graph_def, "num_frames"):
+          num_frames_batch}
+  return tf.train.import_meta_graph(meta_graph_def, clear_devices=True,
+                                    input_map=input_map)
 
 
 def get_input_data_tensors(reader, data_pattern, batch_size, num_readers=1):
@@ -110,8 +164,31 @@ def get_input_data_tensors(reader, data_pattern, batch_size, num_readers=1):
       raise IOError("Unable to find input files. data_pattern='" +
                     data_pattern + "'")
     logging.info("number of input files: " + str(len(files)))
+    if FLAGS.use_dataset:
+      video_id_batch, video_batch, unused_labels, num_frames_batch = (
+          dataset_input.get_input_tensors(
+              reader,
+              sorted(files),
+              batch_size,
+              num_epochs=1,
+              num_parallel_reads=num_readers,
+              num_parallel_calls=num_readers))
+      if video_batch.dtype == tf.uint8:
+        video_batch = utils.DequantizeFrames(video_batch, num_frames_batch)
+      return video_id_batch, video_batch, num_frames_batch
     filename_queue = tf.train.string_input_producer(
         files, num_epochs=1, shuffle=False)
+    if FLAGS.frame_bucket_boundaries:
+      video_id_batch, video_batch, unused_labels, num_frames_batch = (
+          readers.bucket_by_num_frames(
+              reader,
+              filename_queue,
+              batch_size,
+              utils.GetListOfBucketBoundaries(FLAGS.frame_bucket_boundaries),
+              num_threads=num_readers))
+      if video_batch.dtype == tf.uint8:
+        video_batch = utils.DequantizeFrames(video_batch, num_frames_batch)
+      return video_id_batch, video_batch, num_frames_batch
     examples_and_labels = [reader.prepare_reader(filename_queue)
                            for _ in range(num_readers)]
 
@@ -120,6 +197,8 @@ def get_input_data_tensors(reader, data_pattern, batch_size, num_readers=1):
                             batch_size=batch_size,
                             allow_smaller_final_batch = True,
                             enqueue_many=True))
+    if video_batch.dtype == tf.uint8:
+      video_batch = utils.DequantizeFrames(video_batch, num_frames_batch)
     return video_id_batch, video_batch, num_frames_batch
 
 def inference(reader, train_dir, data_pattern, out_file_location, batch_size, top_k):
@@ -134,12 +213,13 @@ def inference(reader, train_dir, data_pattern, out_file_location, batch_size, to
     else:
       meta_graph_location = latest_checkpoint + ".meta"
       logging.info("loading meta-graph: " + meta_graph_location)
-    saver = tf.train.import_meta_graph(meta_graph_location, clear_devices=True)
+    saver = import_model(meta_graph_location, video_batch, num_frames_batch)
     logging.info("restoring variables from " + latest_checkpoint)
     saver.restore(sess, latest_checkpoint)
-    input_tensor = tf.get_collection("input_batch_raw")[0]
-    num_frames_tensor = tf.get_collection("num_frames")[0]
     predictions_tensor = tf.get_collection("predictions")[0]
+    num_classes = predictions_tensor.get_shape().as_list()[1]
+    top_predictions_tensor, top_classes_tensor = tf.nn.top_k(
+        predictions_tensor, k=min(top_k, num_classes or top_k))
     if FLAGS.dropout:
       keep_prob_tensor = tf.get_collection("keep_prob")[0]
 
@@ -161,21 +241,19 @@ def inference(reader, train_dir, data_pattern, out_file_location, batch_size, to
     num_examples_processed = 0
     start_time = time.time()
     out_file.write("VideoId,LabelConfidencePairs\n")
+    writer = submission_writer.SubmissionWriter(out_file)
+    writer.start()
 
     try:
       while not coord.should_stop():
-          video_id_batch_val, video_batch_val,num_frames_batch_val = sess.run([video_id_batch, video_batch, num_frames_batch])
           if FLAGS.dropout:
-            predictions_val, = sess.run([predictions_tensor], feed_dict={input_tensor: video_batch_val, num_frames_tensor: num_frames_batch_val, keep_prob_tensor: FLAGS.keep_prob})
+            video_id_batch_val, top_classes_val, top_predictions_val = sess.run([video_id_batch, top_classes_tensor, top_predictions_tensor], feed_dict={keep_prob_tensor: FLAGS.keep_prob})
           else:
-            predictions_val, = sess.run([predictions_tensor], feed_dict={input_tensor: video_batch_val, num_frames_tensor: num_frames_batch_val})
+            video_id_batch_val, top_classes_val, top_predictions_val = sess.run([video_id_batch, top_classes_tensor, top_predictions_tensor])
           now = time.time()
-          num_examples_processed += len(video_batch_val)
-          num_classes = predictions_val.shape[1]
+          num_examples_processed += len(video_id_batch_val)
           logging.info("num examples processed: " + str(num_examples_processed) + " elapsed seconds: " + "{0:.2f}".format(now-start_time))
-          for line in format_lines(video_id_batch_val, predictions_val, top_k):
-            out_file.write(line)
-          out_file.flush()
+          writer.submit(video_id_batch_val, top_classes_val, top_predictions_val)
 
 
     except tf.errors.OutOfRangeError:
@@ -184,6 +262,7 @@ def inference(reader, train_dir, data_pattern, out_file_location, batch_size, to
         coord.request_stop()
 
     coord.join(threads)
+    writer.close()
     sess.close()
 
 
@@ -194,9 +273,24 @@ def main(unused_argv):
   feature_names, feature_sizes = utils.GetListOfFeatureNamesAndSizes(
       FLAGS.feature_names, FLAGS.feature_sizes)
 
-  if FLAGS.frame_features:
+  if FLAGS.frame_features and FLAGS.packed_frame_features:
+    reader = readers.YT8MPackedFrameFeatureReader(
+        feature_names=feature_names, feature_sizes=feature_sizes,
+        dequantize=not FLAGS.quantized_frame_queue,
+        frame_stride=FLAGS.frame_stride)
+  elif FLAGS.frame_features and FLAGS.frame_read_batch_size > 0:
+    reader = readers.YT8MBatchFrameFeatureReader(
+        feature_names=feature_names, feature_sizes=feature_sizes,
+        read_batch_size=FLAGS.frame_read_batch_size,
+        dequantize=not FLAGS.quantized_frame_queue,
+        frame_stride=FLAGS.frame_stride,
+        frame_sampling=FLAGS.frame_sampling)
+  elif FLAGS.frame_features:
     reader = readers.YT8MFrameFeatureReader(feature_names=feature_names,
-                                            feature_sizes=feature_sizes)
+                                            feature_sizes=feature_sizes,
+                                            dequantize=not FLAGS.quantized_frame_queue,
+                                            frame_stride=FLAGS.frame_stride,
+                                            frame_sampling=FLAGS.frame_sampling)
   else:
     reader = readers.YT8MAggregatedFeatureReader(feature_names=feature_names,
                                                  feature_sizes=feature_sizes)
@@ -0,0 +1,82 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Binary for merging the metrics saved by eval.py on shards of the data.
+
+Every shard of the evaluation data is evaluated separately with
+--output_metrics_file, the files are merged here into the metrics of the
+whole data.
+"""
+
+import numpy
+
+import tensorflow as tf
+from tensorflow import app
+from tensorflow import flags
+from tensorflow import gfile
+from tensorflow import logging
+
+import eval_util
+
+FLAGS = flags.FLAGS
+
+if __name__ == "__main__":
+  flags.DEFINE_string("metrics_pattern", "",
+                      "File glob of the metrics files saved by eval.py.")
+  flags.DEFINE_string("output_metrics_file", "",
+                      "If set, the merged metrics are saved to this file.")
+
+
+def merge_metrics(files):
+  """Merges the metrics saved in files into one EvaluationMetrics object."""
+  metrics = None
+  for filename in files:
+    shard_metrics = eval_util.EvaluationMetrics.load(filename)
+    logging.info("loaded %s, num examples: %d", filename,
+                 shard_metrics.num_examples)
+    if metrics is None:
+      metrics = shard_metrics
+    else:
+      metrics.merge(shard_metrics)
+  return metrics
+
+
+def main(unused_argv):
+  logging.set_verbosity(tf.logging.INFO)
+
+  if FLAGS.metrics_pattern is "":
+    raise ValueError("'metrics_pattern' was not specified. "
+      "Unable to continue with merging.")
+
+  files = gfile.Glob(FLAGS.metrics_pattern)
+  if not files:
+    raise IOError("Unable to find metrics files. metrics_pattern='" +
+                  FLAGS.metrics_pattern + "'")
+  files.sort()
+
+  metrics = merge_metrics(files)
+  if FLAGS.output_metrics_file:
+    metrics.save(FLAGS.output_metrics_file)
+
+  epoch_info_dict = metrics.get()
+  logging.info("num_examples: %d | Avg_Hit@1: %.3f | Avg_PERR: %.3f | "
+               "MAP: %.3f | GAP: %.3f | Avg_Loss: %f", metrics.num_examples,
+               epoch_info_dict["avg_hit_at_one"], epoch_info_dict["avg_perr"],
+               numpy.mean(epoch_info_dict["aps"]), epoch_info_dict["gap"],
+               epoch_info_dict["avg_loss"])
+  print "GAP =", epoch_info_dict["gap"]
+
+
+if __name__ == "__main__":
+  app.run()
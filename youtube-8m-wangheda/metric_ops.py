@@ -0,0 +1,92 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Batch metrics computed inside the graph.
+
+These are the tensorflow counterparts of calculate_hit_at_one,
+calculate_precision_at_equal_recall_rate and calculate_gap of eval_util, so
+the training loop only fetches scalars instead of the predictions and labels
+of the batch.
+"""
+
+import tensorflow as tf
+
+
+def _gather_by_row(values, indices):
+  """Gathers values[i, indices[i, j]] into a matrix shaped like indices."""
+  num_rows = tf.shape(values)[0]
+  num_columns = tf.shape(values)[1]
+  offsets = tf.expand_dims(tf.range(num_rows) * num_columns, 1)
+  return tf.gather(tf.reshape(values, [-1]), indices + offsets)
+
+
+def hit_at_one(predictions, labels):
+  """Returns the average hit at one of a batch.
+
+  Args:
+    predictions: Matrix containing the outputs of the model.
+      Dimensions are 'batch' x 'num_classes'.
+    labels: Matrix containing the ground truth labels.
+      Dimensions are 'batch' x 'num_classes'.
+  """
+  top_prediction = tf.expand_dims(tf.to_int32(tf.argmax(predictions, 1)), 1)
+  return tf.reduce_mean(_gather_by_row(tf.to_float(labels), top_prediction))
+
+
+def precision_at_equal_recall_rate(predictions, labels):
+  """Returns the average precision at equal recall rate of a batch.
+
+  Videos without labels count as 0, like in eval_util.
+  """
+  labels = tf.to_float(labels > 0)
+  num_labels = tf.to_int32(tf.reduce_sum(labels, 1))
+  max_labels = tf.maximum(tf.reduce_max(num_labels), 1)
+  top_predictions, top_indices = tf.nn.top_k(predictions, k=max_labels)
+  in_top = tf.less(tf.expand_dims(tf.range(max_labels), 0),
+                   tf.expand_dims(num_labels, 1))
+  hits = (_gather_by_row(labels, top_indices) *
+          tf.to_float(top_predictions > 0) * tf.to_float(in_top))
+  return tf.reduce_mean(tf.reduce_sum(hits, 1) /
+                        tf.to_float(tf.maximum(num_labels, 1)))
+
+
+def global_average_precision(predictions, labels, top_k=20):
+  """Returns the global average precision of the top_k predictions of a batch.
+
+  The top_k predictions of all the videos are ranked together and all the
+  labels of the batch count as positives, like in eval_util.calculate_gap.
+  """
+  labels = tf.to_float(labels > 0)
+  top_k = min(top_k, predictions.get_shape().as_list()[1])
+  top_predictions, top_indices = tf.nn.top_k(predictions, k=top_k)
+  top_predictions = tf.reshape(top_predictions, [-1])
+  hits = tf.reshape(_gather_by_row(labels, top_indices), [-1])
+
+  _, order = tf.nn.top_k(top_predictions, k=tf.size(top_predictions))
+  hits = tf.gather(hits, order)
+  ranks = tf.to_float(tf.range(1, tf.size(hits) + 1))
+  num_positives = tf.reduce_sum(labels)
+  return tf.reduce_sum(tf.cumsum(hits) * hits / ranks) / tf.maximum(
+      num_positives, 1.0)
+
+
+def batch_metrics(predictions, labels, top_k=20):
+  """Returns a dictionary of the scalar batch metrics.
+
+  The keys are hit_at_one, perr and gap.
+  """
+  with tf.name_scope("batch_metrics"):
+    return {"hit_at_one": hit_at_one(predictions, labels),
+            "perr": precision_at_equal_recall_rate(predictions, labels),
+            "gap": global_average_precision(predictions, labels, top_k)}
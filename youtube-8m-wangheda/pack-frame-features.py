@@ -0,0 +1,130 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Binary for converting frame-level TFRecords into packed shards.
+
+The packed shards are read by readers.YT8MPackedFrameFeatureReader, set
+--packed_frame_features and point the data pattern to the *.index.npz files.
+"""
+
+import os
+import time
+
+import numpy
+import tensorflow as tf
+from tensorflow import app
+from tensorflow import flags
+from tensorflow import gfile
+from tensorflow import logging
+
+import frame_store
+import utils
+
+FLAGS = flags.FLAGS
+
+if __name__ == "__main__":
+  flags.DEFINE_string(
+      "input_data_pattern", "",
+      "File glob of the frame-level dataset in tensorflow.SequenceExample "
+      "format.")
+  flags.DEFINE_string("output_dir", "",
+                      "The directory to write the packed shards to.")
+  flags.DEFINE_string("output_prefix", "frames",
+                      "The file name prefix of the packed shards.")
+  flags.DEFINE_string("feature_names", "rgb,audio", "Name of the features "
+                      "to pack.")
+  flags.DEFINE_string("feature_sizes", "1024,128", "Length of the feature "
+                      "vectors.")
+  flags.DEFINE_integer("videos_per_shard", 256,
+                       "Number of videos written into one packed shard, a "
+                       "reader serves one shard per read.")
+
+
+def get_packed_video(serialized_example, feature_names, feature_sizes):
+  """Extracts the video id, labels and uint8 frames of a SequenceExample."""
+  example = tf.train.SequenceExample.FromString(serialized_example)
+  context = example.context.feature
+  video_id = context["video_id"].bytes_list.value[0]
+  labels = list(context["labels"].int64_list.value)
+
+  feature_matrices = []
+  for feature_name, feature_size in zip(feature_names, feature_sizes):
+    frames = example.feature_lists.feature_list[feature_name].feature
+    raw = b"".join(frame.bytes_list.value[0] for frame in frames)
+    feature_matrices.append(
+        numpy.frombuffer(raw, dtype=numpy.uint8).reshape([-1, feature_size]))
+  num_frames = min(matrix.shape[0] for matrix in feature_matrices)
+  frames = numpy.concatenate(
+      [matrix[:num_frames] for matrix in feature_matrices], axis=1)
+  return video_id, frames, labels
+
+
+def pack(data_pattern, output_dir, output_prefix, feature_names, feature_sizes,
+         videos_per_shard):
+  files = gfile.Glob(data_pattern)
+  if not files:
+    raise IOError("Unable to find input files. data_pattern='" +
+                  data_pattern + "'")
+  files.sort()
+  logging.info("number of input files: " + str(len(files)))
+
+  if not os.path.exists(output_dir):
+    os.makedirs(output_dir)
+
+  start_time = time.time()
+  shard_num = 0
+  num_videos = 0
+  writer = None
+  for filename in files:
+    for serialized_example in tf.python_io.tf_record_iterator(filename):
+      if writer is None:
+        prefix = os.path.join(output_dir, "%s-%04d" % (output_prefix, shard_num))
+        writer = frame_store.PackedFrameShardWriter(
+            prefix, feature_names, feature_sizes)
+      writer.add(*get_packed_video(serialized_example, feature_names,
+                                   feature_sizes))
+      num_videos += 1
+      if len(writer) >= videos_per_shard:
+        writer.close()
+        writer = None
+        shard_num += 1
+    logging.info("packed %s, num videos: %d elapsed seconds: %.2f",
+                 filename, num_videos, time.time() - start_time)
+  if writer is not None:
+    writer.close()
+    shard_num += 1
+  logging.info("Done. %d videos were packed into %d shards in %s",
+               num_videos, shard_num, output_dir)
+
+
+def main(unused_argv):
+  logging.set_verbosity(tf.logging.INFO)
+
+  feature_names, feature_sizes = utils.GetListOfFeatureNamesAndSizes(
+      FLAGS.feature_names, FLAGS.feature_sizes)
+
+  if FLAGS.input_data_pattern is "":
+    raise ValueError("'input_data_pattern' was not specified. "
+      "Unable to continue with packing.")
+
+  if FLAGS.output_dir is "":
+    raise ValueError("'output_dir' was not specified. "
+      "Unable to continue with packing.")
+
+  pack(FLAGS.input_data_pattern, FLAGS.output_dir, FLAGS.output_prefix,
+       feature_names, feature_sizes, FLAGS.videos_per_shard)
+
+
+if __name__ == "__main__":
+  app.run()
@@ -0,0 +1,122 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Columnar on-disk storage of model predictions.
+
+The predictions of a model are written in the same shards as the tfrecord
+output (predictions-%04d), every shard is made of two files sharing a prefix:
+
+  <prefix>.predictions.npy  a float16 (or float32) [num_videos, num_classes]
+                            matrix in numpy format.
+  <prefix>.index.npz        the video_id table and the labels in CSR format.
+
+The prediction matrix is opened with numpy.load(mmap_mode="r"), so a shard is
+served without any protobuf parsing and at half the size of a FloatList in
+float16. Point the data pattern of the readers to the *.index.npz files.
+The files are opened with gfile, so the shards may be on GCS, where the
+prediction matrix is read whole instead of memory-mapped.
+"""
+
+import io
+
+import numpy
+from tensorflow import gfile
+
+PREDICTIONS_SUFFIX = ".predictions.npy"
+INDEX_SUFFIX = ".index.npz"
+
+
+def write_shard(prefix, video_ids, labels, predictions, dtype=numpy.float16):
+  """Writes a shard of predictions.
+
+  Args:
+    prefix: path prefix of the shard files.
+    video_ids: a vector of video ids.
+    labels: a dense [num_videos, num_classes] matrix, non-zero entries are the
+      labels of the video.
+    predictions: a [num_videos, num_classes] matrix of predictions.
+    dtype: the dtype the predictions are stored in, float16 or float32.
+  """
+  if len(video_ids) != predictions.shape[0] or len(video_ids) != labels.shape[0]:
+    raise ValueError("video_ids, labels and predictions must have the same "
+                     "number of rows.")
+  rows, label_indices = numpy.nonzero(labels)
+  label_offsets = numpy.zeros([len(video_ids) + 1], dtype=numpy.int64)
+  label_offsets[1:] = numpy.cumsum(
+      numpy.bincount(rows, minlength=len(video_ids)))
+
+  predictions_buffer = io.BytesIO()
+  numpy.save(predictions_buffer, numpy.asarray(predictions, dtype=dtype))
+  with gfile.Open(prefix + PREDICTIONS_SUFFIX, "wb") as predictions_file:
+    predictions_file.write(predictions_buffer.getvalue())
+  index_buffer = io.BytesIO()
+  numpy.savez(index_buffer,
+              video_ids=numpy.array(video_ids, dtype=numpy.bytes_),
+              label_indices=label_indices.astype(numpy.int32),
+              label_offsets=label_offsets)
+  with gfile.Open(prefix + INDEX_SUFFIX, "wb") as index_file:
+    index_file.write(index_buffer.getvalue())
+
+
+def load_file(filename):
+  """Loads a numpy file through gfile, from memory."""
+  with gfile.Open(filename, "rb") as numpy_file:
+    return numpy.load(io.BytesIO(numpy_file.read()))
+
+
+class PredictionShard(object):
+  """Serves the predictions of a shard from a memory-mapped matrix."""
+
+  def __init__(self, index_filename):
+    """Opens the prediction shard described by index_filename."""
+    if not index_filename.endswith(INDEX_SUFFIX):
+      raise ValueError("'%s' is not a prediction shard index." % index_filename)
+    prefix = index_filename[:-len(INDEX_SUFFIX)]
+    # GFile can not seek from the end as zipfile does, load from memory
+    index = load_file(index_filename)
+    self.video_ids = index["video_ids"]
+    self.label_indices = index["label_indices"]
+    self.label_offsets = index["label_offsets"]
+    if "://" in prefix:
+      self.predictions = load_file(prefix + PREDICTIONS_SUFFIX)
+    else:
+      self.predictions = numpy.load(prefix + PREDICTIONS_SUFFIX,
+                                    mmap_mode="r")
+    if self.predictions.shape[0] != len(self.video_ids):
+      raise ValueError("'%s' does not match the predictions of the shard." %
+                       index_filename)
+
+  def __len__(self):
+    return len(self.video_ids)
+
+  @property
+  def num_classes(self):
+    return self.predictions.shape[1]
+
+  def read(self, start=0, end=None):
+    """Reads the videos [start, end) of the shard.
+
+    Returns:
+      A tuple of video ids, float32 predictions and dense boolean labels.
+    """
+    end = len(self) if end is None else min(end, len(self))
+    start = min(start, end)
+    predictions = numpy.array(self.predictions[start:end], dtype=numpy.float32)
+
+    labels = numpy.zeros([end - start, self.num_classes], dtype=numpy.bool_)
+    label_start, label_end = self.label_offsets[start], self.label_offsets[end]
+    rows = numpy.repeat(numpy.arange(end - start),
+                        numpy.diff(self.label_offsets[start:end + 1]))
+    labels[rows, self.label_indices[label_start:label_end]] = True
+    return self.video_ids[start:end], predictions, labels
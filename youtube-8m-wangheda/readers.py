@@ -15,6 +15,7 @@
 """Provides readers configured for different datasets."""
 
 import tensorflow as tf
+import frame_store
 import utils
 
 from tensorflow import logging
@@ -55,6 +56,187 @@ def resize_axis(tensor, axis, new_size, fill_value=0):
   resized.set_shape(new_shape)
   return resized
 
+FRAME_SAMPLINGS = ("stride", "average", "random")
+
+def get_frame_index(num_frames, max_frames, frame_stride, frame_sampling):
+  """Returns the indexes of the frames of a video that are decoded.
+
+  Args:
+    num_frames: a scalar tensor, the number of frames of the video.
+    max_frames: the maximum number of frames to process.
+    frame_stride: the video keeps max_frames / frame_stride frames.
+    frame_sampling: "stride" keeps every frame_stride-th frame, "average"
+      keeps all the frames, to be averaged by average_quantized_frames, and
+      "random" draws max_frames / frame_stride frames uniformly at random and
+      keeps them in temporal order, like model_utils.SampleRandomFrames.
+
+  Returns:
+    A vector of frame indexes.
+  """
+  num_output_frames = max_frames // frame_stride
+  if frame_sampling == "stride":
+    return tf.range(0, tf.minimum(num_frames, max_frames), frame_stride)
+  elif frame_sampling == "average":
+    return tf.range(tf.minimum(num_frames, num_output_frames * frame_stride))
+  elif frame_sampling == "random":
+    frame_index = tf.cast(
+        tf.random_uniform([num_output_frames]) *
+        tf.cast(tf.minimum(num_frames, max_frames), tf.float32), tf.int32)
+    return -tf.nn.top_k(-frame_index, k=num_output_frames).values
+  raise ValueError("Unknown frame_sampling '%s'." % frame_sampling)
+
+def average_quantized_frames(decoded_features, frame_stride):
+  """Averages every frame_stride consecutive frames of a uint8 matrix.
+
+  The average is computed on the quantized values and rounded back to uint8,
+  dequantization being affine this is within half a quantization step of
+  averaging the dequantized frames.
+  """
+  num_frames = tf.shape(decoded_features)[0]
+  num_groups = (num_frames + frame_stride - 1) // frame_stride
+  feature_size = decoded_features.get_shape().as_list()[1]
+  padded_features = tf.pad(tf.cast(decoded_features, tf.float32),
+                           [[0, num_groups * frame_stride - num_frames], [0, 0]])
+  sums = tf.reduce_sum(
+      tf.reshape(padded_features, [num_groups, frame_stride, feature_size]),
+      axis=1)
+  counts = tf.minimum(frame_stride, num_frames - tf.range(num_groups) * frame_stride)
+  averages = sums / tf.expand_dims(tf.cast(counts, tf.float32), 1)
+  return tf.cast(tf.round(averages), tf.uint8)
+
+def decode_frames(frame_strings,
+                  feature_size,
+                  frame_index=None,
+                  frame_stride=1,
+                  frame_sampling="stride"):
+  """Decodes the uint8 frames of a feature, only the frames in frame_index."""
+  if frame_index is not None:
+    frame_strings = tf.gather(frame_strings, frame_index)
+  decoded_features = tf.reshape(
+      tf.decode_raw(frame_strings, tf.uint8), [-1, feature_size])
+  if frame_stride > 1 and frame_sampling == "average":
+    decoded_features = average_quantized_frames(decoded_features, frame_stride)
+  return decoded_features
+
+def decode_quantized_frames(serialized_example,
+                            feature_names,
+                            feature_sizes,
+                            max_frames,
+                            frame_stride=1,
+                            frame_sampling="stride"):
+  """Decodes the frame features of one SequenceExample without dequantizing.
+
+  Args:
+    serialized_example: a scalar string tensor holding a SequenceExample.
+    feature_names: the feature name(s) in the tensorflow record as a list.
+    feature_sizes: the feature dimensions as a list.
+    max_frames: the maximum number of frames to process.
+    frame_stride: if larger than 1, only max_frames / frame_stride frames are
+      kept, chosen by frame_sampling (see get_frame_index).
+    frame_sampling: "stride", "average" or "random".
+
+  Returns:
+    feature_matrix: uint8 matrix of all frame-features, padded with zero
+      bytes to max_frames / frame_stride. The padding must be masked, e.g.
+      by dequantizing with utils.DequantizeFrames.
+    num_frames: number of frames kept from the sequence, at most
+      max_frames / frame_stride
+  """
+  _, features = tf.parse_single_sequence_example(
+      serialized_example,
+      sequence_features={
+          feature_name : tf.FixedLenSequenceFeature([], dtype=tf.string)
+          for feature_name in feature_names
+      })
+
+  num_output_frames = max_frames // frame_stride
+  frame_index = None
+  if frame_stride > 1:
+    frame_index = get_frame_index(tf.shape(features[feature_names[0]])[0],
+                                  max_frames, frame_stride, frame_sampling)
+
+  num_frames = -1
+  feature_matrices = []
+  for feature_name, feature_size in zip(feature_names, feature_sizes):
+    decoded_features = decode_frames(features[feature_name], feature_size,
+                                     frame_index, frame_stride, frame_sampling)
+    if num_frames == -1:
+      num_frames = tf.minimum(tf.shape(decoded_features)[0], num_output_frames)
+    feature_matrices.append(resize_axis(decoded_features, 0, num_output_frames))
+
+  return tf.concat(feature_matrices, 1), num_frames
+
+def bucket_by_num_frames(reader,
+                         filename_queue,
+                         batch_size,
+                         bucket_boundaries,
+                         num_threads=1,
+                         capacity=None,
+                         allow_smaller_final_batch=True,
+                         min_after_dequeue=None):
+  """Batches frame-level videos grouped by their number of frames.
+
+  Videos are put into buckets delimited by bucket_boundaries and every batch
+  is drawn from a single bucket, padded only to the longest video in it
+  instead of to max_frames. The frame axis of the batch therefore has no
+  static size, models must not depend on it (e.g. dynamic_rnn based models).
+  If the reader does not dequantize, the padding frames are uint8 zeros and
+  the batch must be dequantized with utils.DequantizeFrames, which sets them
+  to 0 like the padding of the float batches. The videos are bucketed in
+  file order unless min_after_dequeue is set, in which case they first go
+  through a shuffling queue, like in tf.train.shuffle_batch.
+
+  Args:
+    reader: a frame-level reader implementing prepare_single_example.
+    filename_queue: A tensorflow queue of filename locations.
+    batch_size: How many examples to process at a time.
+    bucket_boundaries: increasing list of num_frames bucket boundaries.
+    num_threads: How many I/O threads to use.
+    capacity: the maximum number of examples in each bucket.
+    allow_smaller_final_batch: whether the last batches may be smaller.
+    min_after_dequeue: if set, the videos are shuffled before bucketing in
+      a queue holding at least this many of them.
+
+  Returns:
+    A tuple of video indexes, video features, labels, and number of frames.
+  """
+  if not hasattr(reader, "prepare_single_example"):
+    raise ValueError("%s does not support bucketing by number of frames." %
+                     type(reader).__name__)
+  if isinstance(reader, YT8MBatchFrameFeatureReader):
+    raise ValueError("YT8MBatchFrameFeatureReader can not be bucketed by "
+                     "number of frames, the videos are bucketed one by one.")
+  if capacity is None:
+    capacity = 2 * batch_size
+
+  if min_after_dequeue is None:
+    video_id, video_matrix, labels, num_frames = reader.prepare_single_example(
+        filename_queue, pad=False)
+  else:
+    examples = [reader.prepare_single_example(filename_queue, pad=False)
+                for _ in range(num_threads)]
+    # the videos have different lengths, the queue is dequeued one by one
+    shuffle_queue = tf.RandomShuffleQueue(
+        capacity=min_after_dequeue + 3 * batch_size,
+        min_after_dequeue=min_after_dequeue,
+        dtypes=[tensor.dtype for tensor in examples[0]])
+    tf.train.add_queue_runner(tf.train.QueueRunner(
+        shuffle_queue, [shuffle_queue.enqueue(example) for example in examples]))
+    video_id, video_matrix, labels, num_frames = shuffle_queue.dequeue()
+    for tensor, example_tensor in zip(
+        [video_id, video_matrix, labels, num_frames], examples[0]):
+      tensor.set_shape(example_tensor.get_shape())
+  _, batch = tf.contrib.training.bucket_by_sequence_length(
+      num_frames,
+      [video_id, video_matrix, labels, num_frames],
+      batch_size=batch_size,
+      bucket_boundaries=bucket_boundaries,
+      num_threads=num_threads,
+      capacity=capacity,
+      dynamic_pad=True,
+      allow_smaller_final_batch=allow_smaller_final_batch)
+  return tuple(batch)
+
 class BaseReader(object):
   """Inherit from this class when implementing new readers."""
 
@@ -62,6 +244,18 @@ class BaseReader(object):
     """Create a thread for generating prediction and label tensors."""
     raise NotImplementedError()
 
+  def prepare_serialized_examples(self, unused_serialized_examples):
+    """Parses a batch of serialized examples into the prepare_reader tensors.
+
+    Used by the tf.data input pipeline in dataset_input.py.
+    """
+    raise NotImplementedError("%s can not be used with a dataset input." %
+                              type(self).__name__)
+
+  def prepare_batch(self, batch):
+    """Post-processes the tensors of a batch after batching."""
+    return batch
+
 
 class YT8MAggregatedFeatureReader(BaseReader):
   """Reads TFRecords of pre-aggregated Examples.
@@ -102,7 +296,17 @@ class YT8MAggregatedFeatureReader(BaseReader):
     """
     reader = tf.TFRecordReader()
     _, serialized_examples = reader.read_up_to(filename_queue, batch_size)
+    return self.prepare_serialized_examples(serialized_examples)
+
+  def prepare_serialized_examples(self, serialized_examples):
+    """Parses a batch of pre-aggregated YouTube 8M Examples.
 
+    Args:
+      serialized_examples: a vector of serialized Examples.
+
+    Returns:
+      A tuple of video indexes, features, labels, and padding data.
+    """
     # set the mapping from the fields to data types in the proto
     num_features = len(self.feature_names)
     assert num_features > 0, "self.feature_names is empty!"
@@ -137,7 +341,10 @@ class YT8MFrameFeatureReader(BaseReader):
                num_classes=4716,
                feature_sizes=[1024],
                feature_names=["inc3"],
-               max_frames=300):
+               max_frames=300,
+               dequantize=True,
+               frame_stride=1,
+               frame_sampling="stride"):
     """Construct a YT8MFrameFeatureReader.
 
     Args:
@@ -145,23 +352,38 @@ class YT8MFrameFeatureReader(BaseReader):
       feature_sizes: positive integer(s) for the feature dimensions as a list.
       feature_names: the feature name(s) in the tensorflow record as a list.
       max_frames: the maximum number of frames to process.
+      dequantize: if False, the video matrices are left as uint8 and must be
+        dequantized after batching with utils.DequantizeFrames, which keeps
+        the batching queue 4x smaller.
+      frame_stride: if larger than 1, only max_frames / frame_stride frames
+        are decoded and emitted per video.
+      frame_sampling: how the frames are chosen when frame_stride > 1,
+        "stride", "average" or "random" (see get_frame_index).
     """
 
     assert len(feature_names) == len(feature_sizes), \
     "length of feature_names (={}) != length of feature_sizes (={})".format( \
     len(feature_names), len(feature_sizes))
+    if frame_sampling not in FRAME_SAMPLINGS:
+      raise ValueError("Unknown frame_sampling '%s'." % frame_sampling)
 
     self.num_classes = num_classes
     self.feature_sizes = feature_sizes
     self.feature_names = feature_names
     self.max_frames = max_frames
+    self.dequantize = dequantize
+    self.frame_stride = frame_stride
+    self.frame_sampling = frame_sampling
+    self.num_output_frames = max_frames // frame_stride
 
   def get_video_matrix(self,
                        features,
                        feature_size,
                        max_frames,
                        max_quantized_value,
-                       min_quantized_value):
+                       min_quantized_value,
+                       pad=True,
+                       frame_index=None):
     """Decodes features from an input string and quantizes it.
 
     Args:
@@ -170,35 +392,47 @@ class YT8MFrameFeatureReader(BaseReader):
       max_frames: number of frames (rows) in the output feature_matrix
       max_quantized_value: the maximum of the quantized value.
       min_quantized_value: the minimum of the quantized value.
+      pad: if False, the matrix is only truncated to max_frames.
+      frame_index: if not None, only these frames are decoded.
 
     Returns:
-      feature_matrix: matrix of all frame-features
-      num_frames: number of frames in the sequence
+      feature_matrix: matrix of all frame-features, if not dequantized its
+        padding is zero bytes to be masked with utils.DequantizeFrames
+      num_frames: number of frames kept from the sequence
     """
-    decoded_features = tf.reshape(
-        tf.cast(tf.decode_raw(features, tf.uint8), tf.float32),
-        [-1, feature_size])
+    decoded_features = decode_frames(features, feature_size, frame_index,
+                                     self.frame_stride, self.frame_sampling)
 
     num_frames = tf.minimum(tf.shape(decoded_features)[0], max_frames)
-    feature_matrix = utils.Dequantize(decoded_features,
-                                      max_quantized_value,
-                                      min_quantized_value)
-    feature_matrix = resize_axis(feature_matrix, 0, max_frames)
+    if self.dequantize:
+      feature_matrix = utils.Dequantize(tf.cast(decoded_features, tf.float32),
+                                        max_quantized_value,
+                                        min_quantized_value)
+    else:
+      feature_matrix = decoded_features
+    if pad:
+      feature_matrix = resize_axis(feature_matrix, 0, max_frames)
+    else:
+      feature_matrix = feature_matrix[:max_frames]
     return feature_matrix, num_frames
 
-  def prepare_reader(self,
-                     filename_queue,
-                     max_quantized_value=2,
-                     min_quantized_value=-2):
-    """Creates a single reader thread for YouTube8M SequenceExamples.
+  def prepare_single_example(self,
+                             filename_queue,
+                             max_quantized_value=2,
+                             min_quantized_value=-2,
+                             pad=True):
+    """Reads and decodes a single YouTube8M SequenceExample.
 
     Args:
       filename_queue: A tensorflow queue of filename locations.
       max_quantized_value: the maximum of the quantized value.
       min_quantized_value: the minimum of the quantized value.
+      pad: if False, the video matrix is not padded to max_frames and keeps
+        the number of frames of the video.
 
     Returns:
-      A tuple of video indexes, video features, labels, and padding data.
+      A tuple of the video index, video features, labels and number of frames
+      of a single video.
     """
     reader = tf.TFRecordReader()
     _, serialized_example = reader.read(filename_queue)
@@ -227,15 +461,24 @@ class YT8MFrameFeatureReader(BaseReader):
     "length of feature_names (={}) != length of feature_sizes (={})".format( \
     len(self.feature_names), len(self.feature_sizes))
 
+    # the same frames are sampled from every feature
+    frame_index = None
+    if self.frame_stride > 1:
+      frame_index = get_frame_index(
+          tf.shape(features[self.feature_names[0]])[0],
+          self.max_frames, self.frame_stride, self.frame_sampling)
+
     num_frames = -1  # the number of frames in the video
     feature_matrices = [None] * num_features  # an array of different features
     for feature_index in range(num_features):
       feature_matrix, num_frames_in_this_feature = self.get_video_matrix(
           features[self.feature_names[feature_index]],
           self.feature_sizes[feature_index],
-          self.max_frames,
+          self.num_output_frames,
           max_quantized_value,
-          min_quantized_value)
+          min_quantized_value,
+          pad=pad,
+          frame_index=frame_index)
       if num_frames == -1:
         num_frames = num_frames_in_this_feature
       else:
@@ -243,21 +486,239 @@ class YT8MFrameFeatureReader(BaseReader):
 
       feature_matrices[feature_index] = feature_matrix
 
-    # cap the number of frames at self.max_frames
-    num_frames = tf.minimum(num_frames, self.max_frames)
+    # cap the number of frames at self.num_output_frames
+    num_frames = tf.minimum(num_frames, self.num_output_frames)
 
     # concatenate different features
     video_matrix = tf.concat(feature_matrices, 1)
 
+    return contexts["video_id"], video_matrix, labels, num_frames
+
+  def prepare_reader(self,
+                     filename_queue,
+                     max_quantized_value=2,
+                     min_quantized_value=-2):
+    """Creates a single reader thread for YouTube8M SequenceExamples.
+
+    Args:
+      filename_queue: A tensorflow queue of filename locations.
+      max_quantized_value: the maximum of the quantized value.
+      min_quantized_value: the minimum of the quantized value.
+
+    Returns:
+      A tuple of video indexes, video features, labels, and padding data.
+    """
+    video_id, video_matrix, labels, num_frames = self.prepare_single_example(
+        filename_queue, max_quantized_value, min_quantized_value)
+
     # convert to batch format.
-    # TODO: Do proper batch reads to remove the IO bottleneck.
-    batch_video_ids = tf.expand_dims(contexts["video_id"], 0)
+    batch_video_ids = tf.expand_dims(video_id, 0)
     batch_video_matrix = tf.expand_dims(video_matrix, 0)
     batch_labels = tf.expand_dims(labels, 0)
     batch_frames = tf.expand_dims(num_frames, 0)
 
     return batch_video_ids, batch_video_matrix, batch_labels, batch_frames
 
+  def prepare_serialized_examples(self,
+                                  serialized_examples,
+                                  max_quantized_value=2,
+                                  min_quantized_value=-2):
+    """Parses a batch of YouTube8M SequenceExamples.
+
+    Args:
+      serialized_examples: a vector of serialized SequenceExamples.
+      max_quantized_value: the maximum of the quantized value.
+      min_quantized_value: the minimum of the quantized value.
+
+    Returns:
+      A tuple of video indexes, video features, labels, and padding data.
+    """
+    num_features = len(self.feature_names)
+    assert num_features > 0, "No feature selected: feature_names is empty!"
+
+    assert len(self.feature_names) == len(self.feature_sizes), \
+    "length of feature_names (={}) != length of feature_sizes (={})".format( \
+    len(self.feature_names), len(self.feature_sizes))
+
+    # The context of a SequenceExample has the same wire format as an Example,
+    # so video ids and labels of the whole batch are parsed in one op.
+    contexts = tf.parse_example(
+        serialized_examples,
+        features={"video_id": tf.FixedLenFeature([], tf.string),
+                  "labels": tf.VarLenFeature(tf.int64)})
+    labels = tf.sparse_to_indicator(contexts["labels"], self.num_classes)
+    labels.set_shape([None, self.num_classes])
+
+    quantized_matrices, num_frames = tf.map_fn(
+        lambda serialized_example: decode_quantized_frames(
+            serialized_example, self.feature_names, self.feature_sizes,
+            self.max_frames, self.frame_stride, self.frame_sampling),
+        serialized_examples,
+        dtype=(tf.uint8, tf.int32),
+        back_prop=False)
+
+    if not self.dequantize:
+      return contexts["video_id"], quantized_matrices, labels, num_frames
+
+    video_matrices = utils.DequantizeFrames(quantized_matrices, num_frames,
+                                            max_quantized_value,
+                                            min_quantized_value)
+
+    return contexts["video_id"], video_matrices, labels, num_frames
+
+class YT8MBatchFrameFeatureReader(YT8MFrameFeatureReader):
+  """Reads TFRecords of SequenceExamples in batches.
+
+  Produces the same tensors as YT8MFrameFeatureReader, but reads up to
+  read_batch_size records at a time, parses their video ids and labels with
+  a single op and dequantizes the whole batch with a single op, instead of
+  building a batch of one video per read. The frames are still parsed one
+  record at a time, tensorflow has no batched SequenceExample parser.
+  """
+
+  def __init__(self,
+               num_classes=4716,
+               feature_sizes=[1024],
+               feature_names=["inc3"],
+               max_frames=300,
+               dequantize=True,
+               read_batch_size=64,
+               frame_stride=1,
+               frame_sampling="stride"):
+    """Construct a YT8MBatchFrameFeatureReader.
+
+    Args:
+      num_classes: a positive integer for the number of classes.
+      feature_sizes: positive integer(s) for the feature dimensions as a list.
+      feature_names: the feature name(s) in the tensorflow record as a list.
+      max_frames: the maximum number of frames to process.
+      dequantize: if False, the video matrices are left as uint8.
+      read_batch_size: how many records to read and decode at a time.
+      frame_stride: if larger than 1, only max_frames / frame_stride frames
+        are decoded and emitted per video.
+      frame_sampling: "stride", "average" or "random".
+    """
+    super(YT8MBatchFrameFeatureReader, self).__init__(
+        num_classes=num_classes,
+        feature_sizes=feature_sizes,
+        feature_names=feature_names,
+        max_frames=max_frames,
+        dequantize=dequantize,
+        frame_stride=frame_stride,
+        frame_sampling=frame_sampling)
+    self.read_batch_size = read_batch_size
+
+  def prepare_reader(self,
+                     filename_queue,
+                     max_quantized_value=2,
+                     min_quantized_value=-2):
+    """Creates a single batched reader thread for YouTube8M SequenceExamples.
+
+    Args:
+      filename_queue: A tensorflow queue of filename locations.
+      max_quantized_value: the maximum of the quantized value.
+      min_quantized_value: the minimum of the quantized value.
+
+    Returns:
+      A tuple of video indexes, video features, labels, and padding data.
+    """
+    reader = tf.TFRecordReader()
+    _, serialized_examples = reader.read_up_to(filename_queue,
+                                               self.read_batch_size)
+    return self.prepare_serialized_examples(
+        serialized_examples, max_quantized_value, min_quantized_value)
+
+class YT8MPackedFrameFeatureReader(BaseReader):
+  """Reads packed frame-level shards written by pack-frame-features.py.
+
+  The filename queue must contain the index files (*.index.npz) of the
+  shards. Every read serves one whole shard by slicing its memory-mapped
+  frames file, so no protobuf is parsed. The opened shards are kept by the
+  reader, so later epochs neither reload the index nor remap the frames.
+  """
+
+  def __init__(self,
+               num_classes=4716,
+               feature_sizes=[1024],
+               feature_names=["inc3"],
+               max_frames=300,
+               dequantize=True,
+               frame_stride=1):
+    """Construct a YT8MPackedFrameFeatureReader.
+
+    Args:
+      num_classes: a positive integer for the number of classes.
+      feature_sizes: positive integer(s) for the feature dimensions as a list.
+      feature_names: the feature name(s) in the packed shards as a list.
+      max_frames: the maximum number of frames to process.
+      dequantize: if False, the video matrices are left as uint8.
+      frame_stride: must be 1, the packed shards serve all the frames.
+
+    Raises:
+      ValueError: if frame_stride is larger than 1.
+    """
+
+    assert len(feature_names) == len(feature_sizes), \
+    "length of feature_names (={}) != length of feature_sizes (={})".format( \
+    len(feature_names), len(feature_sizes))
+    if frame_stride > 1:
+      raise ValueError("YT8MPackedFrameFeatureReader does not support "
+                       "frame_stride > 1, read the original records instead.")
+
+    self.num_classes = num_classes
+    self.feature_sizes = feature_sizes
+    self.feature_names = feature_names
+    self.max_frames = max_frames
+    self.dequantize = dequantize
+    self.shards = {}
+
+  def get_shard(self, index_filename):
+    """Returns the packed shard of index_filename, opened once."""
+    shard = self.shards.get(index_filename)
+    if shard is None:
+      shard = frame_store.PackedFrameShard(index_filename)
+      self.shards[index_filename] = shard
+    return shard
+
+  def read_shard(self, index_filename):
+    """Reads all the videos of a packed shard as numpy arrays."""
+    shard = self.get_shard(index_filename)
+    return shard.read(0, len(shard), self.feature_names, self.max_frames,
+                      self.num_classes)
+
+  def prepare_reader(self,
+                     filename_queue,
+                     max_quantized_value=2,
+                     min_quantized_value=-2):
+    """Creates a single reader thread for packed YouTube8M frame shards.
+
+    Args:
+      filename_queue: A tensorflow queue of shard index locations.
+      max_quantized_value: the maximum of the quantized value.
+      min_quantized_value: the minimum of the quantized value.
+
+    Returns:
+      A tuple of video indexes, video features, labels, and padding data.
+    """
+    index_filename = filename_queue.dequeue()
+    video_ids, quantized_matrices, labels, num_frames = tf.py_func(
+        self.read_shard, [index_filename],
+        [tf.string, tf.uint8, tf.bool, tf.int32])
+
+    feature_size = sum(self.feature_sizes)
+    video_ids.set_shape([None])
+    quantized_matrices.set_shape([None, self.max_frames, feature_size])
+    labels.set_shape([None, self.num_classes])
+    num_frames.set_shape([None])
+
+    if not self.dequantize:
+      return video_ids, quantized_matrices, labels, num_frames
+
+    video_matrices = utils.DequantizeFrames(quantized_matrices, num_frames,
+                                            max_quantized_value,
+                                            min_quantized_value)
+    return video_ids, video_matrices, labels, num_frames
+
 class YT8MAggregatedDistillationFeatureReader(BaseReader):
   """Reads TFRecords of pre-aggregated Examples.
 
@@ -297,7 +758,18 @@ class YT8MAggregatedDistillationFeatureReader(BaseReader):
     """
     reader = tf.TFRecordReader()
     _, serialized_examples = reader.read_up_to(filename_queue, batch_size)
+    return self.prepare_serialized_examples(serialized_examples)
+
+  def prepare_serialized_examples(self, serialized_examples):
+    """Parses a batch of pre-aggregated YouTube 8M Examples.
 
+    Args:
+      serialized_examples: a vector of serialized Examples.
+
+    Returns:
+      A tuple of video indexes, features, labels, padding data and
+      distillation predictions.
+    """
     # set the mapping from the fields to data types in the proto
     num_features = len(self.feature_names)
     assert num_features > 0, "self.feature_names is empty!"
@@ -333,7 +805,9 @@ class YT8MFrameDistillationFeatureReader(BaseReader):
                num_classes=4716,
                feature_sizes=[1024],
                feature_names=["inc3"],
-               max_frames=300):
+               max_frames=300,
+               frame_stride=1,
+               frame_sampling="stride"):
     """Construct a YT8MFrameFeatureReader.
 
     Args:
@@ -341,23 +815,33 @@ class YT8MFrameDistillationFeatureReader(BaseReader):
       feature_sizes: positive integer(s) for the feature dimensions as a list.
       feature_names: the feature name(s) in the tensorflow record as a list.
       max_frames: the maximum number of frames to process.
+      frame_stride: if larger than 1, only max_frames / frame_stride frames
+        are decoded and emitted per video.
+      frame_sampling: how the frames are chosen when frame_stride > 1,
+        "stride", "average" or "random" (see get_frame_index).
     """
 
     assert len(feature_names) == len(feature_sizes), \
     "length of feature_names (={}) != length of feature_sizes (={})".format( \
     len(feature_names), len(feature_sizes))
+    if frame_sampling not in FRAME_SAMPLINGS:
+      raise ValueError("Unknown frame_sampling '%s'." % frame_sampling)
 
     self.num_classes = num_classes
     self.feature_sizes = feature_sizes
     self.feature_names = feature_names
     self.max_frames = max_frames
+    self.frame_stride = frame_stride
+    self.frame_sampling = frame_sampling
+    self.num_output_frames = max_frames // frame_stride
 
   def get_video_matrix(self,
                        features,
                        feature_size,
                        max_frames,
                        max_quantized_value,
-                       min_quantized_value):
+                       min_quantized_value,
+                       frame_index=None):
     """Decodes features from an input string and quantizes it.
 
     Args:
@@ -366,14 +850,15 @@ class YT8MFrameDistillationFeatureReader(BaseReader):
       max_frames: number of frames (rows) in the output feature_matrix
       max_quantized_value: the maximum of the quantized value.
       min_quantized_value: the minimum of the quantized value.
+      frame_index: if not None, only these frames are decoded.
 
     Returns:
       feature_matrix: matrix of all frame-features
       num_frames: number of frames in the sequence
     """
-    decoded_features = tf.reshape(
-        tf.cast(tf.decode_raw(features, tf.uint8), tf.float32),
-        [-1, feature_size])
+    decoded_features = tf.cast(
+        decode_frames(features, feature_size, frame_index,
+                      self.frame_stride, self.frame_sampling), tf.float32)
 
     num_frames = tf.minimum(tf.shape(decoded_features)[0], max_frames)
     feature_matrix = utils.Dequantize(decoded_features,
@@ -424,15 +909,23 @@ class YT8MFrameDistillationFeatureReader(BaseReader):
     "length of feature_names (={}) != length of feature_sizes (={})".format( \
     len(self.feature_names), len(self.feature_sizes))
 
+    # the same frames are sampled from every feature
+    frame_index = None
+    if self.frame_stride > 1:
+      frame_index = get_frame_index(
+          tf.shape(features[self.feature_names[0]])[0],
+          self.max_frames, self.frame_stride, self.frame_sampling)
+
     num_frames = -1  # the number of frames in the video
     feature_matrices = [None] * num_features  # an array of different features
     for feature_index in range(num_features):
       feature_matrix, num_frames_in_this_feature = self.get_video_matrix(
           features[self.feature_names[feature_index]],
           self.feature_sizes[feature_index],
-          self.max_frames,
+          self.num_output_frames,
           max_quantized_value,
-          min_quantized_value)
+          min_quantized_value,
+          frame_index=frame_index)
       if num_frames == -1:
         num_frames = num_frames_in_this_feature
       else:
@@ -440,8 +933,8 @@ class YT8MFrameDistillationFeatureReader(BaseReader):
 
       feature_matrices[feature_index] = feature_matrix
 
-    # cap the number of frames at self.max_frames
-    num_frames = tf.minimum(num_frames, self.max_frames)
+    # cap the number of frames at self.num_output_frames
+    num_frames = tf.minimum(num_frames, self.num_output_frames)
 
     # concatenate different features
     video_matrix = tf.concat(feature_matrices, 1)
@@ -456,4 +949,41 @@ class YT8MFrameDistillationFeatureReader(BaseReader):
 
     return batch_video_ids, batch_video_matrix, batch_labels, batch_frames, batch_predictions
 
+  def prepare_serialized_examples(self,
+                                  serialized_examples,
+                                  max_quantized_value=2,
+                                  min_quantized_value=-2):
+    """Parses a batch of YouTube8M SequenceExamples with distillation context.
+
+    Args:
+      serialized_examples: a vector of serialized SequenceExamples.
+      max_quantized_value: the maximum of the quantized value.
+      min_quantized_value: the minimum of the quantized value.
+
+    Returns:
+      A tuple of video indexes, video features, labels, padding data and
+      distillation predictions.
+    """
+    contexts = tf.parse_example(
+        serialized_examples,
+        features={"video_id": tf.FixedLenFeature([], tf.string),
+                  "predictions": tf.FixedLenFeature([self.num_classes], tf.float32),
+                  "labels": tf.VarLenFeature(tf.int64)})
+    labels = tf.sparse_to_indicator(contexts["labels"], self.num_classes)
+    labels.set_shape([None, self.num_classes])
+
+    quantized_matrices, num_frames = tf.map_fn(
+        lambda serialized_example: decode_quantized_frames(
+            serialized_example, self.feature_names, self.feature_sizes,
+            self.max_frames, self.frame_stride, self.frame_sampling),
+        serialized_examples,
+        dtype=(tf.uint8, tf.int32),
+        back_prop=False)
+    video_matrices = utils.DequantizeFrames(quantized_matrices, num_frames,
+                                            max_quantized_value,
+                                            min_quantized_value)
+
+    return (contexts["video_id"], video_matrices, labels, num_frames,
+            contexts["predictions"])
+
 
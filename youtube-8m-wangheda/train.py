@@ -19,12 +19,15 @@ import time
 import numpy
 
 import eval_util
+import metric_ops
+import metrics_worker as metrics_worker_lib
 import losses
 import frame_level_models
 import video_level_models
 import data_augmentation
 import feature_transform
 import readers
+import dataset_input
 import tensorflow as tf
 import tensorflow.contrib.slim as slim
 from tensorflow import app
@@ -70,6 +73,40 @@ if __name__ == "__main__":
       "Otherwise, --train_data_pattern must be aggregated video-level "
       "features. The model must also be set appropriately (i.e. to read 3D "
       "batches VS 4D batches.")
+  flags.DEFINE_integer(
+      "frame_read_batch_size", 0,
+      "If positive, frame-level records are read and decoded this many at a "
+      "time by YT8MBatchFrameFeatureReader instead of one by one.")
+  flags.DEFINE_bool(
+      "packed_frame_features", False,
+      "If set, frame-level features are read from packed shards written by "
+      "pack-frame-features.py, the data pattern must match their *.index.npz "
+      "files.")
+  flags.DEFINE_bool(
+      "quantized_frame_queue", False,
+      "If set, frame-level features stay uint8 in the batching queue and are "
+      "dequantized after dequeue, which cuts the queue memory by 4x.")
+  flags.DEFINE_integer(
+      "frame_stride", 1,
+      "If larger than 1, the frame-level readers decode and emit only "
+      "max_frames / frame_stride frames per video, chosen by --frame_sampling.")
+  flags.DEFINE_string(
+      "frame_sampling", "stride",
+      "How frames are chosen when --frame_stride > 1: 'stride' keeps every "
+      "frame_stride-th frame, 'average' averages consecutive frames and "
+      "'random' samples frames at random in temporal order.")
+  flags.DEFINE_bool(
+      "use_dataset", False,
+      "If set, the input is read by the tf.data pipeline of dataset_input.py "
+      "instead of queue runners, --frame_bucket_boundaries is not applied. "
+      "Requires TensorFlow 1.4 or later.")
+  flags.DEFINE_string(
+      "frame_bucket_boundaries", "",
+      "Comma separated num_frames boundaries, e.g. '60,120,180,240'. If set, "
+      "frame-level videos are batched by length bucket and each batch is "
+      "padded to its longest video instead of max_frames. The videos are "
+      "shuffled before bucketing. The model must not rely on a static number "
+      "of frames. Cannot be used with --frame_read_batch_size.")
   flags.DEFINE_string(
       "model", "LogisticModel",
       "Which architecture to use for the model. Models are defined "
@@ -128,6 +165,22 @@ if __name__ == "__main__":
       "logs on startup.")
   flags.DEFINE_integer("recall_at_n", 100,
                        "N in recall@N.")
+  flags.DEFINE_bool(
+      "in_graph_metrics", False,
+      "If set, the training Hit@1, PERR and GAP are computed inside the graph "
+      "and fetched as scalars, instead of fetching the predictions and labels "
+      "of the batch to compute them in numpy.")
+  flags.DEFINE_integer(
+      "metrics_every_n_steps", 1,
+      "How often, in steps, the training metrics are computed and logged.")
+  flags.DEFINE_bool(
+      "async_metrics", False,
+      "If set, the fetched predictions and labels are handed to a background "
+      "thread that computes the training metrics while the next step runs. "
+      "Ignored with --in_graph_metrics.")
+  flags.DEFINE_integer(
+      "async_metrics_queue_size", 2,
+      "How many batches may wait for the metrics thread, more are dropped.")
   flags.DEFINE_bool(
       "dropout", False,
       "Whether to consider dropout")
@@ -194,8 +247,27 @@ def get_input_data_tensors(reader,
       raise IOError("Unable to find training files. data_pattern='" +
                     data_pattern + "'.")
     logging.info("Number of training files: %s.", str(len(files)))
+    if FLAGS.use_dataset:
+      return dataset_input.get_input_tensors(
+          reader,
+          files,
+          batch_size,
+          num_epochs=num_epochs,
+          shuffle=True,
+          num_parallel_reads=num_readers,
+          num_parallel_calls=num_readers)
     filename_queue = tf.train.string_input_producer(
         files, num_epochs=num_epochs, shuffle=True)
+    if FLAGS.frame_bucket_boundaries:
+      return readers.bucket_by_num_frames(
+          reader,
+          filename_queue,
+          batch_size,
+          utils.GetListOfBucketBoundaries(FLAGS.frame_bucket_boundaries),
+          num_threads=num_readers,
+          capacity=FLAGS.batch_size * 2,
+          min_after_dequeue=FLAGS.batch_size)
+
     training_data = [
         reader.prepare_reader(filename_queue) for _ in range(num_readers)
     ]
@@ -334,6 +406,10 @@ def build_graph(reader,
             num_readers=num_readers,
             num_epochs=num_epochs))
 
+  # features kept quantized in the batching queue are dequantized here
+  if model_input_raw.dtype == tf.uint8:
+    model_input_raw = utils.DequantizeFrames(model_input_raw, num_frames)
+
   # data augmentation, will not persist in inference
   data_augmenter = augmenter_class()
   model_input_raw, labels_batch, num_frames = data_augmenter.augment(model_input_raw, num_frames=num_frames, labels_batch=labels_batch)
@@ -529,6 +605,9 @@ class Trainer(object):
         predictions = tf.get_collection("predictions")[0]
         labels = tf.get_collection("labels")[0]
         train_op = tf.get_collection("train_op")[0]
+        if FLAGS.in_graph_metrics:
+          batch_metrics = metric_ops.batch_metrics(predictions, labels)
+          batch_metrics["batch_size"] = tf.shape(labels)[0]
         init_op = tf.global_variables_initializer()
 
         if FLAGS.dropout:
@@ -558,6 +637,13 @@ class Trainer(object):
       if FLAGS.reweight:
         optional_assign_weights(sess, weights_input, weights_assignment)
 
+      metrics_worker = None
+      if self.is_master and FLAGS.async_metrics and not FLAGS.in_graph_metrics:
+        metrics_worker = metrics_worker_lib.MetricsWorker(
+            sv.summary_writer, task_as_string(self.task),
+            FLAGS.async_metrics_queue_size)
+        metrics_worker.start()
+
       steps = 0
       try:
         logging.info("%s: Entering training loop.", task_as_string(self.task))
@@ -571,24 +657,44 @@ class Trainer(object):
           if FLAGS.noise_level > 0:
             custom_feed[noise_level_tensor] = FLAGS.noise_level
 
-          _, global_step_val, loss_val, predictions_val, labels_val = sess.run(
-              [train_op, global_step, loss, predictions, labels], feed_dict=custom_feed)
+          compute_metrics = self.is_master and (
+              steps % max(FLAGS.metrics_every_n_steps, 1) == 0)
+          if not compute_metrics:
+            _, global_step_val, loss_val = sess.run(
+                [train_op, global_step, loss], feed_dict=custom_feed)
+          elif FLAGS.in_graph_metrics:
+            _, global_step_val, loss_val, metrics_val = sess.run(
+                [train_op, global_step, loss, batch_metrics],
+                feed_dict=custom_feed)
+          else:
+            _, global_step_val, loss_val, predictions_val, labels_val = sess.run(
+                [train_op, global_step, loss, predictions, labels], feed_dict=custom_feed)
           seconds_per_batch = time.time() - batch_start_time
 
-          if self.is_master:
-            examples_per_second = labels_val.shape[0] / seconds_per_batch
-            hit_at_one = eval_util.calculate_hit_at_one(predictions_val,
-                                                        labels_val)
-            perr = eval_util.calculate_precision_at_equal_recall_rate(
-                predictions_val, labels_val)
+          if compute_metrics and metrics_worker is not None:
+            metrics_worker.submit(global_step_val, predictions_val, labels_val,
+                                  loss_val,
+                                  labels_val.shape[0] / seconds_per_batch)
+          elif compute_metrics:
             recall = "N/A"
-            if False:
-              recall = eval_util.calculate_recall_at_n(
-                  predictions_val, labels_val, FLAGS.recall_at_n)
-              sv.summary_writer.add_summary(
-                  utils.MakeSummary("model/Training_Recall@%d" % FLAGS.recall_at_n, recall), global_step_val)
-              recall = "%.2f" % recall
-            gap = eval_util.calculate_gap(predictions_val, labels_val)
+            if FLAGS.in_graph_metrics:
+              examples_per_second = metrics_val["batch_size"] / seconds_per_batch
+              hit_at_one = metrics_val["hit_at_one"]
+              perr = metrics_val["perr"]
+              gap = metrics_val["gap"]
+            else:
+              examples_per_second = labels_val.shape[0] / seconds_per_batch
+              hit_at_one = eval_util.calculate_hit_at_one(predictions_val,
+                                                          labels_val)
+              perr = eval_util.calculate_precision_at_equal_recall_rate(
+                  predictions_val, labels_val)
+              if False:
+                recall = eval_util.calculate_recall_at_n(
+                    predictions_val, labels_val, FLAGS.recall_at_n)
+                sv.summary_writer.add_summary(
+                    utils.MakeSummary("model/Training_Recall@%d" % FLAGS.recall_at_n, recall), global_step_val)
+                recall = "%.2f" % recall
+              gap = eval_util.calculate_gap(predictions_val, labels_val)
 
             logging.info(
                 "%s: training step " + str(global_step_val) + "| Hit@1: " +
@@ -617,6 +723,9 @@ class Trainer(object):
       except tf.errors.OutOfRangeError:
         logging.info("%s: Done training -- epoch limit reached.",
                      task_as_string(self.task))
+      finally:
+        if metrics_worker is not None:
+          metrics_worker.stop()
 
     logging.info("%s: Exited training loop.", task_as_string(self.task))
     sv.Stop()
@@ -687,14 +796,31 @@ class Trainer(object):
       print "distillation readers"
       if FLAGS.frame_features:
         reader = readers.YT8MFrameDistillationFeatureReader(
-            feature_names=feature_names, feature_sizes=feature_sizes)
+            feature_names=feature_names, feature_sizes=feature_sizes,
+            frame_stride=FLAGS.frame_stride,
+            frame_sampling=FLAGS.frame_sampling)
       else:
         reader = readers.YT8MAggregatedDistillationFeatureReader(
             feature_names=feature_names, feature_sizes=feature_sizes)
     else:
-      if FLAGS.frame_features:
+      if FLAGS.frame_features and FLAGS.packed_frame_features:
+        reader = readers.YT8MPackedFrameFeatureReader(
+            feature_names=feature_names, feature_sizes=feature_sizes,
+            dequantize=not FLAGS.quantized_frame_queue,
+            frame_stride=FLAGS.frame_stride)
+      elif FLAGS.frame_features and FLAGS.frame_read_batch_size > 0:
+        reader = readers.YT8MBatchFrameFeatureReader(
+            feature_names=feature_names, feature_sizes=feature_sizes,
+            read_batch_size=FLAGS.frame_read_batch_size,
+            dequantize=not FLAGS.quantized_frame_queue,
+            frame_stride=FLAGS.frame_stride,
+            frame_sampling=FLAGS.frame_sampling)
+      elif FLAGS.frame_features:
         reader = readers.YT8MFrameFeatureReader(
-            feature_names=feature_names, feature_sizes=feature_sizes)
+            feature_names=feature_names, feature_sizes=feature_sizes,
+            dequantize=not FLAGS.quantized_frame_queue,
+            frame_stride=FLAGS.frame_stride,
+            frame_sampling=FLAGS.frame_sampling)
       else:
         reader = readers.YT8MAggregatedFeatureReader(
             feature_names=feature_names, feature_sizes=feature_sizes)
@@ -38,6 +38,30 @@ def Dequantize(feat_vector, max_quantized_value=2, min_quantized_value=-2):
   return feat_vector * scalar + bias
 
 
+def DequantizeFrames(frame_matrices, num_frames, max_quantized_value=2,
+                     min_quantized_value=-2):
+  """Dequantizes a batch of uint8 frame matrices padded with zero bytes.
+
+  The padding frames, at or beyond num_frames, are set to 0 like the ones
+  of a reader that pads after dequantizing, instead of the dequantized value
+  of a zero byte.
+
+  Args:
+    frame_matrices: the [batch, frames, feature_size] quantized features.
+    num_frames: the [batch] numbers of frames of the videos.
+    max_quantized_value: the maximum of the quantized value.
+    min_quantized_value: the minimum of the quantized value.
+
+  Returns:
+    A float tensor which has the same shape as frame_matrices.
+  """
+  feature_matrices = Dequantize(tf.cast(frame_matrices, tf.float32),
+                                max_quantized_value, min_quantized_value)
+  mask = tf.sequence_mask(tf.cast(num_frames, tf.int32),
+                          tf.shape(feature_matrices)[1], dtype=tf.float32)
+  return feature_matrices * tf.expand_dims(mask, 2)
+
+
 def MakeSummary(name, value):
   """Creates a tf.Summary proto with the given name and value."""
   summary = tf.Summary()
@@ -160,6 +184,27 @@ def GetListOfFeatureNamesAndSizes(feature_names, feature_sizes):
 
   return list_of_feature_names, list_of_feature_sizes
 
+def GetListOfBucketBoundaries(bucket_boundaries):
+  """Extract the list of num_frames bucket boundaries from string of comma
+     separated values.
+
+  Args:
+    bucket_boundaries: string containing comma separated list of integers
+
+  Returns:
+    Sorted list of the bucket boundaries.
+
+  Raises:
+    ValueError: if the boundaries are not strictly increasing.
+  """
+  list_of_boundaries = [
+      int(boundary) for boundary in bucket_boundaries.split(',')]
+  for previous, boundary in zip(list_of_boundaries, list_of_boundaries[1:]):
+    if boundary <= previous:
+      raise ValueError("bucket boundaries must be strictly increasing: %s" %
+                       bucket_boundaries)
+  return list_of_boundaries
+
 
 def clip_gradient_norms(gradients_to_variables, max_norm):
   clipped_grads_and_vars = []
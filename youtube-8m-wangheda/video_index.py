@@ -0,0 +1,190 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Persistent video_id index over TFRecord datasets.
+
+The index records, for every video, the file it is stored in, the byte offset
+and length of its record, its number of frames and its labels. It is stored
+as a single .npz file with the video ids sorted as fixed-width strings, so a
+lookup is a binary search (numpy.searchsorted) and a record is read back with
+one seek, without scanning the dataset again. build-video-index.py builds it.
+The files are opened with gfile, so the dataset and the index may be on GCS.
+"""
+
+import io
+import struct
+
+import numpy
+from tensorflow import gfile
+
+# A TFRecord is a little-endian uint64 length, a uint32 masked crc of the
+# length, the data and a uint32 masked crc of the data.
+_HEADER_SIZE = 12
+_FOOTER_SIZE = 4
+
+
+def iter_records(filename):
+  """Yields (offset, length, data) of every record of a TFRecord file.
+
+  offset is the position of the record header in the file and length the
+  size of its data. The crcs are not verified.
+  """
+  with gfile.Open(filename, "rb") as record_file:
+    offset = 0
+    while True:
+      header = record_file.read(_HEADER_SIZE)
+      if not header:
+        break
+      if len(header) < _HEADER_SIZE:
+        raise IOError("truncated record header at %d in %s" % (offset, filename))
+      length, = struct.unpack("<Q", header[:8])
+      data = record_file.read(length)
+      if len(data) < length or len(record_file.read(_FOOTER_SIZE)) < _FOOTER_SIZE:
+        raise IOError("truncated record at %d in %s" % (offset, filename))
+      yield offset, length, data
+      offset += _HEADER_SIZE + length + _FOOTER_SIZE
+
+
+class VideoIndexWriter(object):
+  """Collects the entries of a video index and writes it sorted."""
+
+  def __init__(self):
+    self.filenames = []
+    self._video_ids = []
+    self._file_indices = []
+    self._offsets = []
+    self._lengths = []
+    self._num_frames = []
+    self._labels = []
+
+  def __len__(self):
+    return len(self._video_ids)
+
+  def add_file(self, filename):
+    """Registers a data file and returns its index."""
+    self.filenames.append(filename)
+    return len(self.filenames) - 1
+
+  def add(self, video_id, file_index, offset, length, num_frames, labels):
+    """Adds the record of a video."""
+    self._video_ids.append(video_id)
+    self._file_indices.append(file_index)
+    self._offsets.append(offset)
+    self._lengths.append(length)
+    self._num_frames.append(num_frames)
+    self._labels.append(labels)
+
+  def save(self, index_filename):
+    """Sorts the entries by video_id and writes them to index_filename."""
+    video_ids = numpy.array(self._video_ids, dtype=numpy.bytes_)
+    order = numpy.argsort(video_ids, kind="mergesort")
+    video_ids = video_ids[order]
+    if len(video_ids) > 1 and (video_ids[1:] == video_ids[:-1]).any():
+      duplicate = video_ids[1:][video_ids[1:] == video_ids[:-1]][0]
+      raise ValueError("video_id %s is indexed twice." % duplicate)
+
+    labels = [self._labels[i] for i in order]
+    label_offsets = numpy.zeros([len(labels) + 1], dtype=numpy.int64)
+    label_offsets[1:] = numpy.cumsum([len(l) for l in labels])
+    label_indices = numpy.array([label for l in labels for label in l],
+                                dtype=numpy.int32)
+    index_buffer = io.BytesIO()
+    numpy.savez(index_buffer,
+                video_ids=video_ids,
+                file_indices=numpy.array(self._file_indices, dtype=numpy.int32)[order],
+                offsets=numpy.array(self._offsets, dtype=numpy.int64)[order],
+                lengths=numpy.array(self._lengths, dtype=numpy.int64)[order],
+                num_frames=numpy.array(self._num_frames, dtype=numpy.int32)[order],
+                label_indices=label_indices,
+                label_offsets=label_offsets,
+                filenames=numpy.array(self.filenames, dtype=numpy.bytes_))
+    with gfile.Open(index_filename, "wb") as index_file:
+      index_file.write(index_buffer.getvalue())
+
+
+class VideoIndex(object):
+  """Looks up videos in an index written by VideoIndexWriter."""
+
+  def __init__(self, index_filename):
+    # GFile can not seek from the end as zipfile does, load from memory
+    with gfile.Open(index_filename, "rb") as index_file:
+      index = numpy.load(io.BytesIO(index_file.read()))
+    self.video_ids = index["video_ids"]
+    self.file_indices = index["file_indices"]
+    self.offsets = index["offsets"]
+    self.lengths = index["lengths"]
+    self.num_frames = index["num_frames"]
+    self.label_indices = index["label_indices"]
+    self.label_offsets = index["label_offsets"]
+    self.filenames = [name.decode("utf-8") if isinstance(name, bytes) else name
+                      for name in index["filenames"].tolist()]
+
+  def __len__(self):
+    return len(self.video_ids)
+
+  def __contains__(self, video_id):
+    return self.lookup([video_id])[0] >= 0
+
+  def lookup(self, video_ids):
+    """Returns the positions of video_ids in the index, -1 if not indexed."""
+    video_ids = numpy.asarray(video_ids, dtype=numpy.bytes_)
+    positions = numpy.searchsorted(self.video_ids, video_ids)
+    positions = numpy.minimum(positions, max(len(self) - 1, 0))
+    found = (self.video_ids[positions] == video_ids) if len(self) else \
+        numpy.zeros(video_ids.shape, dtype=numpy.bool_)
+    return numpy.where(found, positions, -1)
+
+  def get_labels(self, position):
+    """Returns the label indexes of the video at position."""
+    return self.label_indices[
+        self.label_offsets[position]:self.label_offsets[position + 1]]
+
+  def get_location(self, position):
+    """Returns the filename, offset and length of the video at position."""
+    return (self.filenames[self.file_indices[position]],
+            int(self.offsets[position]), int(self.lengths[position]))
+
+  def read_record(self, position):
+    """Reads the serialized example of the video at position."""
+    filename, offset, length = self.get_location(position)
+    with gfile.Open(filename, "rb") as record_file:
+      record_file.seek(offset + _HEADER_SIZE)
+      return record_file.read(length)
+
+  def read_records(self, video_ids):
+    """Reads the serialized examples of video_ids, None if not indexed.
+
+    The records are read file by file in offset order to keep the reads
+    sequential, and returned in the order of video_ids.
+    """
+    positions = self.lookup(video_ids)
+    records = [None] * len(positions)
+    indexed = numpy.nonzero(positions >= 0)[0]
+    order = numpy.lexsort((self.offsets[positions[indexed]],
+                           self.file_indices[positions[indexed]]))
+    record_file, file_index = None, -1
+    try:
+      for i in indexed[order]:
+        position = positions[i]
+        if self.file_indices[position] != file_index:
+          if record_file is not None:
+            record_file.close()
+          file_index = self.file_indices[position]
+          record_file = gfile.Open(self.filenames[file_index], "rb")
+        record_file.seek(int(self.offsets[position]) + _HEADER_SIZE)
+        records[i] = record_file.read(int(self.lengths[position]))
+    finally:
+      if record_file is not None:
+        record_file.close()
+    return records
@@ -49,14 +49,25 @@ calculator.accumulate(p1, a1)
 calculator.accumulate(p2, a2)
 ap3 = calculator.peek_ap_at_n()
 ```
+
+3) Use HistogramAveragePrecisionCalculator the same way to keep track of the
+average precision of an unbounded stream of predictions in [0, 1] in a fixed
+amount of memory, with a bound on its error.
 """
 
-import heapq
-import random
 import numbers
 
 import numpy
 
+# The smallest capacity the buffers of the calculator grow from.
+_MIN_CAPACITY = 1024
+
+# Below this, harmonic numbers are looked up instead of approximated.
+_HARMONIC_TABLE_SIZE = 64
+_HARMONIC_TABLE = numpy.concatenate(
+    [[0.0], numpy.cumsum(1.0 / numpy.arange(1, _HARMONIC_TABLE_SIZE))])
+_EULER_GAMMA = 0.5772156649015329
+
 
 class AveragePrecisionCalculator(object):
   """Calculate the average precision and average precision at n."""
@@ -78,12 +89,19 @@ class AveragePrecisionCalculator(object):
 
     self._top_n = top_n  # average precision at n
     self._total_positives = 0  # total number of positives have seen
-    self._heap = []  # max heap of (prediction, actual)
+    # growable buffers of the (prediction, actual) pairs, the first _size
+    # entries are in use. With top_n, the buffers are truncated to the top_n
+    # highest predictions whenever they hold more than twice that many.
+    self._predictions = numpy.zeros([0], dtype=numpy.float32)
+    self._actuals = numpy.zeros([0], dtype=numpy.bool_)
+    self._size = 0
 
   @property
   def heap_size(self):
-    """Gets the heap size maintained in the class."""
-    return len(self._heap)
+    """Gets the number of (prediction, actual) pairs kept in the class."""
+    if self._top_n is None:
+      return self._size
+    return min(self._size, self._top_n)
 
   @property
   def num_accumulated_positives(self):
@@ -116,24 +134,88 @@ class AveragePrecisionCalculator(object):
       if not isinstance(num_positives, numbers.Number) or num_positives < 0:
         raise ValueError("'num_positives' was provided but it wan't a nonzero number.")
 
+    predictions = numpy.asarray(predictions).ravel()
+    actuals = numpy.asarray(actuals).ravel() > 0
     if not num_positives is None:
       self._total_positives += num_positives
     else:
-      self._total_positives += numpy.size(numpy.where(actuals > 0))
-    topk = self._top_n
-    heap = self._heap
-
-    for i in range(numpy.size(predictions)):
-      if topk is None or len(heap) < topk:
-        heapq.heappush(heap, (predictions[i], actuals[i]))
-      else:
-        if predictions[i] > heap[0][0]:  # heap[0] is the smallest
-          heapq.heappop(heap)
-          heapq.heappush(heap, (predictions[i], actuals[i]))
+      self._total_positives += numpy.count_nonzero(actuals)
+    self._append(predictions, actuals)
+
+  def _append(self, predictions, actuals):
+    """Appends (prediction, actual) pairs to the buffers."""
+    if self._top_n == 0 or predictions.size == 0:
+      return
+
+    size = self._size + predictions.size
+    if size > self._predictions.size:
+      capacity = max(size, 2 * self._predictions.size, _MIN_CAPACITY)
+      self._predictions = self._grow(self._predictions, capacity)
+      self._actuals = self._grow(self._actuals, capacity)
+    self._predictions[self._size:size] = predictions
+    self._actuals[self._size:size] = actuals
+    self._size = size
+
+    if self._top_n is not None and self._size > max(2 * self._top_n,
+                                                    _MIN_CAPACITY):
+      self._truncate()
+
+  def _grow(self, buf, capacity):
+    grown = numpy.zeros([capacity], dtype=buf.dtype)
+    grown[:self._size] = buf[:self._size]
+    return grown
+
+  def _truncate(self):
+    """Keeps only the top_n highest predictions in the buffers."""
+    if self._top_n is None or self._size <= self._top_n:
+      return
+    top = numpy.argpartition(-self._predictions[:self._size],
+                             self._top_n - 1)[:self._top_n]
+    top.sort()
+    self._predictions[:self._top_n] = self._predictions[top]
+    self._actuals[:self._top_n] = self._actuals[top]
+    self._size = self._top_n
+
+  def merge(self, other):
+    """Merges the predictions accumulated by another calculator into this one.
+
+    The top_n highest predictions of the union are among the top_n highest
+    of either calculator, so merging calculators fed with disjoint parts of
+    the data gives the average precision of the whole data.
+
+    Args:
+      other: an AveragePrecisionCalculator with the same top_n.
+
+    Raises:
+      ValueError: An error occurred when the top_n of the calculators differ.
+    """
+    if other._top_n != self._top_n:
+      raise ValueError("can not merge calculators with different top_n.")
+    self._append(other._predictions[:other._size], other._actuals[:other._size])
+    self._total_positives += other._total_positives
+
+  def get_state(self):
+    """Returns the accumulated state as a dictionary of numpy arrays."""
+    self._truncate()
+    return {"top_n": numpy.array(-1 if self._top_n is None else self._top_n),
+            "total_positives": numpy.array(self._total_positives),
+            "predictions": self._predictions[:self._size].copy(),
+            "actuals": self._actuals[:self._size].copy()}
+
+  def set_state(self, state):
+    """Replaces the accumulated state with one returned by get_state."""
+    top_n = int(state["top_n"])
+    self._top_n = None if top_n < 0 else top_n
+    self._total_positives = state["total_positives"].item()
+    self._predictions = numpy.array(state["predictions"], dtype=numpy.float32)
+    self._actuals = numpy.array(state["actuals"], dtype=numpy.bool_)
+    self._size = self._predictions.size
 
   def clear(self):
     """Clear the accumulated predictions."""
-    self._heap = []
+    self._predictions = numpy.zeros([0], dtype=numpy.float32)
+    self._actuals = numpy.zeros([0], dtype=numpy.bool_)
+    self._size = 0
     self._total_positives = 0
 
   def peek_ap_at_n(self):
@@ -146,10 +228,10 @@ class AveragePrecisionCalculator(object):
     """
     if self.heap_size <= 0:
       return 0
-    predlists = numpy.array(list(zip(*self._heap)))
+    self._truncate()
 
-    ap = self.ap_at_n(predlists[0],
-                      predlists[1],
+    ap = self.ap_at_n(self._predictions[:self._size],
+                      self._actuals[:self._size],
                       n=self._top_n,
                       total_num_positives=self._total_positives)
     return ap
@@ -208,21 +290,11 @@ class AveragePrecisionCalculator(object):
         raise ValueError("n must be 'None' or a positive integer."
                          " It was '%s'." % n)
 
-    ap = 0.0
-
-    predictions = numpy.array(predictions)
-    actuals = numpy.array(actuals)
-
-    # add a shuffler to avoid overestimating the ap
-    predictions, actuals = AveragePrecisionCalculator._shuffle(predictions,
-                                                               actuals)
-    sortidx = sorted(
-        range(len(predictions)),
-        key=lambda k: predictions[k],
-        reverse=True)
+    predictions = numpy.asarray(predictions).ravel()
+    actuals = numpy.asarray(actuals).ravel() > 0
 
     if total_num_positives is None:
-      numpos = numpy.size(numpy.where(actuals > 0))
+      numpos = numpy.count_nonzero(actuals)
     else:
       numpos = total_num_positives
 
@@ -231,23 +303,28 @@ class AveragePrecisionCalculator(object):
 
     if n is not None:
       numpos = min(numpos, n)
-    delta_recall = 1.0 / numpos
-    poscount = 0.0
 
-    # calculate the ap
-    r = len(sortidx)
+    # add a shuffler to avoid overestimating the ap
+    predictions, actuals = AveragePrecisionCalculator._shuffle(predictions,
+                                                               actuals)
+    r = len(predictions)
     if n is not None:
       r = min(r, n)
-    for i in range(r):
-      if actuals[sortidx[i]] > 0:
-        poscount += 1
-        ap += poscount / (i + 1) * delta_recall
-    return ap
+    if r < len(predictions):
+      sortidx = numpy.argpartition(-predictions, r - 1)[:r]
+      sortidx = sortidx[numpy.argsort(-predictions[sortidx], kind="mergesort")]
+    else:
+      sortidx = numpy.argsort(-predictions, kind="mergesort")
+
+    # calculate the ap
+    hits = actuals[sortidx]
+    poscount = numpy.cumsum(hits)[hits]
+    ranks = numpy.arange(1, r + 1, dtype=numpy.float64)[hits]
+    return float(numpy.sum(poscount / ranks)) / numpos
 
   @staticmethod
   def _shuffle(predictions, actuals):
-    random.seed(0)
-    suffidx = random.sample(range(len(predictions)), len(predictions))
+    suffidx = numpy.random.RandomState(0).permutation(len(predictions))
     predictions = predictions[suffidx]
     actuals = actuals[suffidx]
     return predictions, actuals
@@ -272,3 +349,159 @@ class AveragePrecisionCalculator(object):
     ret = (predictions - numpy.min(predictions)) / numpy.max(denominator,
                                                              epsilon)
     return ret
+
+
+def _harmonic(n):
+  """Returns the harmonic numbers H(n) = 1 + 1/2 + ... + 1/n of a vector."""
+  n = numpy.asarray(n, dtype=numpy.float64)
+  small = n < _HARMONIC_TABLE_SIZE
+  large = numpy.maximum(n, _HARMONIC_TABLE_SIZE)
+  approx = (numpy.log(large) + _EULER_GAMMA + 0.5 / large -
+            1.0 / (12 * large ** 2) + 1.0 / (120 * large ** 4))
+  table = _HARMONIC_TABLE[numpy.minimum(n, _HARMONIC_TABLE_SIZE - 1).astype(
+      numpy.int64)]
+  return numpy.where(small, table, approx)
+
+
+class HistogramAveragePrecisionCalculator(object):
+  """Calculate the average precision of a stream in fixed memory.
+
+  The predictions, expected in [0, 1] (others are clipped), are counted in
+  num_bins equal-width score bins, separately for the positives and the
+  negatives. Only the order of the predictions inside a bin is lost, so the
+  exact average precision lies between the one with the positives of every
+  bin ranked before its negatives and the one with them ranked after.
+  peek_ap_bounds returns these two bounds and peek_ap_at_n their mean, which
+  is within half of their difference of the exact value. The difference
+  shrinks with finer bins and is zero when no bin holds both positives and
+  negatives.
+  """
+
+  def __init__(self, num_bins=10000):
+    """Construct a HistogramAveragePrecisionCalculator.
+
+    Args:
+      num_bins: A positive Integer specifying the number of score bins.
+
+    Raises:
+      ValueError: An error occurred when num_bins is not a positive integer.
+    """
+    if not isinstance(num_bins, int) or num_bins <= 0:
+      raise ValueError("num_bins must be a positive integer.")
+
+    self._num_bins = num_bins
+    self._total_positives = 0  # total number of positives have seen
+    self._positives = numpy.zeros([num_bins], dtype=numpy.int64)
+    self._negatives = numpy.zeros([num_bins], dtype=numpy.int64)
+
+  @property
+  def heap_size(self):
+    """Gets the number of predictions that have been accumulated."""
+    return int(numpy.sum(self._positives) + numpy.sum(self._negatives))
+
+  @property
+  def num_accumulated_positives(self):
+    """Gets the number of positive samples that have been accumulated."""
+    return self._total_positives
+
+  def accumulate(self, predictions, actuals, num_positives=None):
+    """Accumulate the predictions and their ground truth labels.
+
+    Args:
+      predictions: a list storing the prediction scores.
+      actuals: a list storing the ground truth labels. Any value
+      larger than 0 will be treated as positives, otherwise as negatives.
+      num_positives: If the 'predictions' and 'actuals' inputs aren't
+      complete, the total number of positives, to accurately track recall.
+
+    Raises:
+      ValueError: An error occurred when the shape of predictions and actuals
+      does not match.
+    """
+    if len(predictions) != len(actuals):
+      raise ValueError("the shape of predictions and actuals does not match.")
+
+    if not num_positives is None:
+      if not isinstance(num_positives, numbers.Number) or num_positives < 0:
+        raise ValueError("'num_positives' was provided but it wan't a nonzero number.")
+
+    predictions = numpy.asarray(predictions, dtype=numpy.float64).ravel()
+    actuals = numpy.asarray(actuals).ravel() > 0
+    if not num_positives is None:
+      self._total_positives += num_positives
+    else:
+      self._total_positives += numpy.count_nonzero(actuals)
+
+    bins = numpy.clip((predictions * self._num_bins).astype(numpy.int64),
+                      0, self._num_bins - 1)
+    self._positives += numpy.bincount(bins[actuals],
+                                      minlength=self._num_bins)
+    self._negatives += numpy.bincount(bins[~actuals],
+                                      minlength=self._num_bins)
+
+  def merge(self, other):
+    """Merges the counts accumulated by another calculator into this one.
+
+    Raises:
+      ValueError: An error occurred when the number of bins differ.
+    """
+    if not isinstance(other, HistogramAveragePrecisionCalculator) or \
+        other._num_bins != self._num_bins:
+      raise ValueError("can only merge histograms with the same num_bins.")
+    self._positives += other._positives
+    self._negatives += other._negatives
+    self._total_positives += other._total_positives
+
+  def get_state(self):
+    """Returns the accumulated state as a dictionary of numpy arrays."""
+    return {"total_positives": numpy.array(self._total_positives),
+            "positives": self._positives.copy(),
+            "negatives": self._negatives.copy()}
+
+  def set_state(self, state):
+    """Replaces the accumulated state with one returned by get_state."""
+    self._num_bins = state["positives"].size
+    self._total_positives = state["total_positives"].item()
+    self._positives = numpy.array(state["positives"], dtype=numpy.int64)
+    self._negatives = numpy.array(state["negatives"], dtype=numpy.int64)
+
+  def clear(self):
+    """Clear the accumulated counts."""
+    self._positives[:] = 0
+    self._negatives[:] = 0
+    self._total_positives = 0
+
+  def peek_ap_bounds(self):
+    """Peek the bounds of the non-interpolated average precision.
+
+    Returns:
+      A tuple (lower, upper) of the average precision with the positives of
+      every bin ranked after and before its negatives.
+    """
+    if self._total_positives <= 0:
+      return 0.0, 0.0
+    # from the highest scores down
+    positives = self._positives[::-1].astype(numpy.float64)
+    negatives = self._negatives[::-1].astype(numpy.float64)
+    negatives_before = numpy.cumsum(negatives) - negatives
+    ranks_before = numpy.cumsum(positives + negatives) - positives - negatives
+
+    # Sum of the precisions (P0 + j) / (N0 + P0 + j) of the j-th positive of a
+    # bin for j = 1..p, which is p - N0 * (H(N0 + P0 + p) - H(N0 + P0)).
+    upper = positives - negatives_before * (
+        _harmonic(ranks_before + positives) - _harmonic(ranks_before))
+    lower = positives - (negatives_before + negatives) * (
+        _harmonic(ranks_before + negatives + positives) -
+        _harmonic(ranks_before + negatives))
+    numpos = float(self._total_positives)
+    return (float(numpy.sum(lower)) / numpos,
+            float(numpy.sum(upper)) / numpos)
+
+  def peek_ap_at_n(self):
+    """Peek the estimated non-interpolated average precision.
+
+    Returns:
+      The mean of the bounds of peek_ap_bounds (default 0).
+    """
+    lower, upper = self.peek_ap_bounds()
+    return (lower + upper) / 2
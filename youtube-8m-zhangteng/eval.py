@@ -19,6 +19,7 @@ import eval_util
 import losses
 import frame_level_models
 import video_level_models
+import dataset_input
 import readers
 import tensorflow as tf
 from tensorflow import app
@@ -53,6 +54,10 @@ if __name__ == "__main__":
       "Otherwise, --eval_data_pattern must be aggregated video-level "
       "features. The model must also be set appropriately (i.e. to read 3D "
       "batches VS 4D batches.")
+  flags.DEFINE_bool(
+      "use_dataset", False,
+      "If set, the input is read by the tf.data pipeline of dataset_input.py "
+      "instead of queue runners. Requires TensorFlow 1.4 or later.")
   flags.DEFINE_bool(
       "norm", True,
       "If set, then --input_data should be l2-normalized before follow-up processing. "
@@ -75,6 +80,11 @@ if __name__ == "__main__":
                        "How many threads to use for reading input files.")
   flags.DEFINE_boolean("run_once", False, "Whether to run eval only once.")
   flags.DEFINE_integer("top_k", 20, "How many predictions to output per video.")
+  flags.DEFINE_string(
+      "output_metrics_file", "",
+      "If set, the metrics accumulated over the evaluation data are saved to "
+      "this .npz file, to be merged with those of other shards of the data by "
+      "merge-eval-metrics.py.")
 
 
 def find_class_by_name(name, modules):
@@ -109,6 +119,14 @@ def get_input_evaluation_tensors(reader,
     if not files:
       raise IOError("Unable to find the evaluation files.")
     logging.info("number of evaluation files: " + str(len(files)))
+    if FLAGS.use_dataset:
+      return dataset_input.get_input_tensors(
+          reader,
+          sorted(files),
+          batch_size,
+          num_epochs=1,
+          num_parallel_reads=num_readers,
+          num_parallel_calls=num_readers)
     filename_queue = tf.train.string_input_producer(
         files, shuffle=False, num_epochs=1)
     eval_data = [
@@ -267,6 +285,8 @@ def evaluation_loop(video_id_batch, prediction_batch, label_batch, loss,
       # calculate the metrics for the entire epoch
       epoch_info_dict = evl_metrics.get()
       epoch_info_dict["epoch_id"] = global_step_val
+      if FLAGS.output_metrics_file:
+        evl_metrics.save(FLAGS.output_metrics_file)
 
       summary_writer.add_summary(summary_val, global_step_val)
       epochinfo = utils.AddEpochSummary(
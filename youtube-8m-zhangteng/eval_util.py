@@ -14,6 +14,7 @@
 
 """Provides functions to help with evaluating models."""
 import datetime
+import io
 import numpy
 
 from tensorflow.python.platform import gfile
@@ -54,20 +55,22 @@ def calculate_precision_at_equal_recall_rate(predictions, actuals):
   Returns:
     float: The average precision at equal recall rate across the entire batch.
   """
-  aggregated_precision = 0.0
-  num_videos = actuals.shape[0]
-  for row in numpy.arange(num_videos):
-    num_labels = int(numpy.sum(actuals[row]))
-    top_indices = numpy.argpartition(predictions[row],
-                                     -num_labels)[-num_labels:]
-    item_precision = 0.0
-    for label_index in top_indices:
-      if predictions[row][label_index] > 0:
-        item_precision += actuals[row][label_index]
-    item_precision /= top_indices.size
-    aggregated_precision += item_precision
-  aggregated_precision /= num_videos
-  return aggregated_precision
+  num_labels = numpy.sum(actuals > 0, axis=1)
+  max_labels = int(numpy.max(num_labels)) if num_labels.size else 0
+  if max_labels == 0:
+    return 0.0
+  # The num_labels[row] highest predictions of each row are the first
+  # entries of its max_labels highest predictions, sorted.
+  rows = numpy.arange(actuals.shape[0])[:, numpy.newaxis]
+  top_indices = numpy.argpartition(predictions, -max_labels,
+                                   axis=1)[:, -max_labels:]
+  order = numpy.argsort(-predictions[rows, top_indices], axis=1)
+  top_indices = top_indices[rows, order]
+  in_top = numpy.arange(max_labels) < num_labels[:, numpy.newaxis]
+  hits = actuals[rows, top_indices] * (predictions[rows, top_indices] > 0)
+  precision = (numpy.sum(hits * in_top, axis=1) /
+               numpy.maximum(num_labels, 1).astype(numpy.float64))
+  return numpy.mean(precision)
 
 def calculate_gap(predictions, actuals, top_k=20):
   """Performs a local (numpy) calculation of the global average precision.
@@ -85,11 +88,44 @@ def calculate_gap(predictions, actuals, top_k=20):
     float: The global average precision.
   """
   gap_calculator = ap_calculator.AveragePrecisionCalculator()
-  sparse_predictions, sparse_labels, num_positives = top_k_by_class(predictions, actuals, top_k)
-  gap_calculator.accumulate(flatten(sparse_predictions), flatten(sparse_labels), sum(num_positives))
+  _, sparse_predictions, sparse_labels, num_positives = top_k_flat(
+      predictions, actuals, top_k)
+  gap_calculator.accumulate(sparse_predictions, sparse_labels,
+                            numpy.sum(num_positives))
   return gap_calculator.peek_ap_at_n()
 
 
+def top_k_flat(predictions, labels, k=20):
+  """Extracts the top k predictions of every video as flat arrays.
+
+  Args:
+    predictions: A numpy matrix containing the outputs of the model.
+      Dimensions are 'batch' x 'num_classes'.
+    labels: A numpy matrix containing the ground truth labels.
+      Dimensions are 'batch' x 'num_classes'.
+    k: the top k entries to preserve in each prediction.
+
+  Returns:
+    A tuple (classes, predictions, labels, true_positives). The first three
+    are vectors of length 'batch' x k holding the class, the prediction and
+    the ground truth of every entry, grouped by video. 'true_positives' is a
+    vector of the number of true positives for each class in the ground
+    truth.
+
+  Raises:
+    ValueError: An error occurred when the k is not a positive integer.
+  """
+  if k <= 0:
+    raise ValueError("k must be a positive integer.")
+  k = min(k, predictions.shape[1])
+  indices = numpy.argpartition(predictions, -k, axis=1)[:, -k:]
+  rows = numpy.repeat(numpy.arange(predictions.shape[0]), k)
+  classes = indices.ravel()
+  true_positives = numpy.sum(labels > 0, axis=0)
+  return classes, predictions[rows, classes], labels[rows, classes], \
+      true_positives
+
+
 def top_k_by_class(predictions, labels, k=20):
   """Extracts the top k predictions for each video, sorted by class.
 
@@ -100,7 +136,7 @@ def top_k_by_class(predictions, labels, k=20):
 
   Returns:
     A tuple (predictions,labels, true_positives). 'predictions' and 'labels'
-    are lists of lists of floats. 'true_positives' is a list of scalars. The
+    are lists of numpy vectors. 'true_positives' is a vector of scalars. The
     length of the lists are equal to the number of classes. The entries in the
     predictions variable are probability predictions, and
     the corresponding entries in the labels variable are the ground truth for
@@ -110,19 +146,13 @@ def top_k_by_class(predictions, labels, k=20):
   Raises:
     ValueError: An error occurred when the k is not a positive integer.
   """
-  if k <= 0:
-    raise ValueError("k must be a positive integer.")
-  k = min(k, predictions.shape[1])
   num_classes = predictions.shape[1]
-  prediction_triplets= []
-  for video_index in range(predictions.shape[0]):
-    prediction_triplets.extend(top_k_triplets(predictions[video_index],labels[video_index], k))
-  out_predictions = [[] for v in range(num_classes)]
-  out_labels = [[] for v in range(num_classes)]
-  for triplet in prediction_triplets:
-    out_predictions[triplet[0]].append(triplet[1])
-    out_labels[triplet[0]].append(triplet[2])
-  out_true_positives = [numpy.sum(labels[:,i]) for i in range(num_classes)]
+  classes, flat_predictions, flat_labels, out_true_positives = top_k_flat(
+      predictions, labels, k)
+  order = numpy.argsort(classes, kind="mergesort")
+  splits = numpy.cumsum(numpy.bincount(classes, minlength=num_classes))[:-1]
+  out_predictions = numpy.split(flat_predictions[order], splits)
+  out_labels = numpy.split(flat_labels[order], splits)
 
   return out_predictions, out_labels, out_true_positives
 
@@ -137,12 +167,15 @@ def top_k_triplets(predictions, labels, k=20):
 class EvaluationMetrics(object):
   """A class to store the evaluation metrics."""
 
-  def __init__(self, num_class, top_k):
+  def __init__(self, num_class, top_k, gap_histogram_bins=0):
     """Construct an EvaluationMetrics object to store the evaluation metrics.
 
     Args:
       num_class: A positive integer specifying the number of classes.
       top_k: A positive integer specifying how many predictions are considered per video.
+      gap_histogram_bins: If positive, the GAP is estimated in fixed memory
+        from a histogram of this many score bins instead of being computed
+        exactly, see HistogramAveragePrecisionCalculator.
 
     Raises:
       ValueError: An error occurred when MeanAveragePrecisionCalculator cannot
@@ -152,7 +185,12 @@ class EvaluationMetrics(object):
     self.sum_perr = 0.0
     self.sum_loss = 0.0
     self.map_calculator = map_calculator.MeanAveragePrecisionCalculator(num_class)
-    self.global_ap_calculator = ap_calculator.AveragePrecisionCalculator()
+    if gap_histogram_bins > 0:
+      self.global_ap_calculator = \
+          ap_calculator.HistogramAveragePrecisionCalculator(gap_histogram_bins)
+    else:
+      self.global_ap_calculator = ap_calculator.AveragePrecisionCalculator()
+    self.num_class = num_class
     self.top_k = top_k
     self.num_examples = 0
 
@@ -179,9 +217,12 @@ class EvaluationMetrics(object):
     mean_loss = numpy.mean(loss)
 
     # Take the top 20 predictions.
-    sparse_predictions, sparse_labels, num_positives = top_k_by_class(predictions, labels, self.top_k)
-    self.map_calculator.accumulate(sparse_predictions, sparse_labels, num_positives)
-    self.global_ap_calculator.accumulate(flatten(sparse_predictions), flatten(sparse_labels), sum(num_positives))
+    sparse_classes, sparse_predictions, sparse_labels, num_positives = \
+        top_k_flat(predictions, labels, self.top_k)
+    self.map_calculator.accumulate_sparse(sparse_classes, sparse_predictions,
+                                          sparse_labels, num_positives)
+    self.global_ap_calculator.accumulate(sparse_predictions, sparse_labels,
+                                         numpy.sum(num_positives))
 
     self.num_examples += batch_size
     self.sum_hit_at_one += mean_hit_at_one * batch_size
@@ -199,7 +240,7 @@ class EvaluationMetrics(object):
     Returns:
       dictionary: a dictionary storing the evaluation metrics for the epoch. The
         dictionary has the fields: avg_hit_at_one, avg_perr, avg_loss, and
-        aps (default nan).
+        aps (default nan), and gap_bounds in histogram mode.
     """
     if self.num_examples <= 0:
       raise ValueError("total_sample must be positive.")
@@ -210,9 +251,70 @@ class EvaluationMetrics(object):
     aps = self.map_calculator.peek_map_at_n()
     gap = self.global_ap_calculator.peek_ap_at_n()
 
-    epoch_info_dict = {}
-    return {"avg_hit_at_one": avg_hit_at_one, "avg_perr": avg_perr,
-            "avg_loss": avg_loss, "aps": aps, "gap": gap}
+    epoch_info_dict = {"avg_hit_at_one": avg_hit_at_one, "avg_perr": avg_perr,
+                       "avg_loss": avg_loss, "aps": aps, "gap": gap}
+    if isinstance(self.global_ap_calculator,
+                  ap_calculator.HistogramAveragePrecisionCalculator):
+      epoch_info_dict["gap_bounds"] = self.global_ap_calculator.peek_ap_bounds()
+    return epoch_info_dict
+
+  def merge(self, other):
+    """Merges the metrics accumulated by another EvaluationMetrics object.
+
+    The metrics of objects fed with disjoint parts of the data, e.g. in
+    separate processes, merge into exactly the metrics of the whole data.
+
+    Args:
+      other: an EvaluationMetrics object with the same num_class and top_k.
+
+    Raises:
+      ValueError: An error occurred when the num_class or top_k differ.
+    """
+    if other.num_class != self.num_class or other.top_k != self.top_k:
+      raise ValueError("can not merge metrics of different num_class or top_k.")
+    self.sum_hit_at_one += other.sum_hit_at_one
+    self.sum_perr += other.sum_perr
+    self.sum_loss += other.sum_loss
+    self.map_calculator.merge(other.map_calculator)
+    self.global_ap_calculator.merge(other.global_ap_calculator)
+    self.num_examples += other.num_examples
+
+  def save(self, filename):
+    """Writes the accumulated metrics to filename in numpy .npz format."""
+    state = {"num_class": numpy.array(self.num_class),
+             "top_k": numpy.array(self.top_k),
+             "num_examples": numpy.array(self.num_examples),
+             "sum_hit_at_one": numpy.array(self.sum_hit_at_one),
+             "sum_perr": numpy.array(self.sum_perr),
+             "sum_loss": numpy.array(self.sum_loss)}
+    for key, value in self.map_calculator.get_state().items():
+      state["map_" + key] = value
+    for key, value in self.global_ap_calculator.get_state().items():
+      state["gap_" + key] = value
+    buf = io.BytesIO()
+    numpy.savez(buf, **state)
+    with gfile.Open(filename, "wb") as metrics_file:
+      metrics_file.write(buf.getvalue())
+
+  @staticmethod
+  def load(filename):
+    """Reads metrics written by save into a new EvaluationMetrics object."""
+    with gfile.Open(filename, "rb") as metrics_file:
+      state = dict(numpy.load(io.BytesIO(metrics_file.read())).items())
+    gap_histogram_bins = state["gap_positives"].size if "gap_positives" in state else 0
+    metrics = EvaluationMetrics(int(state["num_class"]), int(state["top_k"]),
+                                gap_histogram_bins)
+    metrics.num_examples = int(state["num_examples"])
+    metrics.sum_hit_at_one = float(state["sum_hit_at_one"])
+    metrics.sum_perr = float(state["sum_perr"])
+    metrics.sum_loss = float(state["sum_loss"])
+    metrics.map_calculator.set_state(
+        dict((key[4:], value) for key, value in state.items()
+             if key.startswith("map_")))
+    metrics.global_ap_calculator.set_state(
+        dict((key[4:], value) for key, value in state.items()
+             if key.startswith("gap_")))
+    return metrics
 
   def clear(self):
     """Clear the evaluation metrics and reset the EvaluationMetrics object."""
@@ -222,3 +324,95 @@ class EvaluationMetrics(object):
     self.map_calculator.clear()
     self.global_ap_calculator.clear()
     self.num_examples = 0
+
+
+class SequentialGapEstimator(object):
+  """Bootstrap confidence interval of the GAP over shards of the data.
+
+  The top_k predictions of every shard of the data are counted in a score
+  histogram, see average_precision_calculator.HistogramAveragePrecisionCalculator.
+  A bootstrap replicate resamples the shards with replacement, its GAP is the
+  one of the sum of the histograms of its shards, so the interval is cheap to
+  update after every shard. The shards should be in random order.
+  """
+
+  def __init__(self, top_k=20, num_bins=1000, num_bootstraps=200,
+               confidence=0.95, seed=0):
+    """Construct a SequentialGapEstimator.
+
+    Args:
+      top_k: A positive integer specifying how many predictions are considered
+        per video.
+      num_bins: The number of score bins of the histograms.
+      num_bootstraps: The number of bootstrap replicates.
+      confidence: The confidence level of the interval.
+      seed: The seed of the bootstrap resampling.
+    """
+    self.top_k = top_k
+    self.num_bootstraps = num_bootstraps
+    self.confidence = confidence
+    self.best_gap = None
+    self._num_bins = num_bins
+    self._seed = seed
+    self._shard = ap_calculator.HistogramAveragePrecisionCalculator(num_bins)
+    self.clear()
+
+  @property
+  def num_shards(self):
+    return len(self._positives)
+
+  def clear(self):
+    """Forgets the shards, but not best_gap."""
+    self._shard.clear()
+    self._positives = []
+    self._negatives = []
+    self._total_positives = []
+    self._random = numpy.random.RandomState(self._seed)
+
+  def update_best(self, gap):
+    """Records the GAP of an evaluated checkpoint in best_gap."""
+    if self.best_gap is None or gap > self.best_gap:
+      self.best_gap = gap
+
+  def accumulate(self, predictions, labels):
+    """Adds a batch to the current shard."""
+    _, sparse_predictions, sparse_labels, num_positives = top_k_flat(
+        predictions, labels, self.top_k)
+    self._shard.accumulate(sparse_predictions, sparse_labels,
+                           numpy.sum(num_positives))
+
+  def end_shard(self):
+    """Closes the current shard, empty shards are ignored."""
+    if self._shard.heap_size > 0:
+      state = self._shard.get_state()
+      self._positives.append(state["positives"])
+      self._negatives.append(state["negatives"])
+      self._total_positives.append(state["total_positives"].item())
+    self._shard.clear()
+
+  def confidence_interval(self):
+    """Returns the (lower, upper) bootstrap bounds of the GAP.
+
+    Raises:
+      ValueError: If no shard was closed.
+    """
+    if not self.num_shards:
+      raise ValueError("no shard was accumulated.")
+    weights = self._random.multinomial(
+        self.num_shards, [1.0 / self.num_shards] * self.num_shards,
+        size=self.num_bootstraps)
+    positives = weights.dot(numpy.array(self._positives))
+    negatives = weights.dot(numpy.array(self._negatives))
+    total_positives = weights.dot(numpy.array(self._total_positives))
+
+    calculator = ap_calculator.HistogramAveragePrecisionCalculator(
+        self._num_bins)
+    gaps = []
+    for i in range(self.num_bootstraps):
+      calculator.set_state({"total_positives": numpy.array(total_positives[i]),
+                            "positives": positives[i],
+                            "negatives": negatives[i]})
+      gaps.append(calculator.peek_ap_at_n())
+    alpha = (1.0 - self.confidence) / 2
+    lower, upper = numpy.percentile(gaps, [100 * alpha, 100 * (1 - alpha)])
+    return float(lower), float(upper)
@@ -24,10 +24,13 @@ from tensorflow import app
 from tensorflow import flags
 from tensorflow import gfile
 from tensorflow import logging
+from tensorflow.python.framework import meta_graph
 
 import eval_util
 import losses
+import dataset_input
 import readers
+import submission_writer
 import utils
 
 FLAGS = flags.FLAGS
@@ -52,6 +55,10 @@ if __name__ == '__main__':
       "Otherwise, --eval_data_pattern must be aggregated video-level "
       "features. The model must also be set appropriately (i.e. to read 3D "
       "batches VS 4D batches.")
+  flags.DEFINE_bool(
+      "use_dataset", False,
+      "If set, the input is read by the tf.data pipeline of dataset_input.py "
+      "instead of queue runners. Requires TensorFlow 1.4 or later.")
   flags.DEFINE_integer(
       "batch_size", 1024,
       "How many examples to process per batch.")
@@ -66,18 +73,35 @@ if __name__ == '__main__':
   flags.DEFINE_integer("top_k", 20,
                        "How many predictions to output per video.")
 
-def format_lines(video_ids, predictions, top_k):
-  batch_size = len(video_ids)
-  for video_index in range(batch_size):
-    top_indices = numpy.argpartition(predictions[video_index], -top_k)[-top_k:]
-    line = [(class_index, predictions[video_index][class_index])
-            for class_index in top_indices]
-  #  print("Type - Test :")
-  #  print(type(video_ids[video_index]))
-  #  print(video_ids[video_index].decode('utf-8'))
-    line = sorted(line, key=lambda p: -p[1])
-    yield video_ids[video_index].decode('utf-8') + "," + " ".join("%i %f" % pair
-                                                  for pair in line) + "\n"
+def get_collection_tensor_name(meta_graph_def, key):
+  """Returns the name of the first tensor in a collection of a MetaGraphDef."""
+  return meta_graph_def.collection_def[key].node_list.value[0]
+
+
+def import_model(meta_graph_location, video_batch, num_frames_batch):
+  """Imports a trained graph with its inputs bound to the reader tensors.
+
+  The input_batch_raw and num_frames tensors of the training graph are
+  replaced by video_batch and num_frames_batch, so that the predictions are
+  computed from the decoded batch in the same session call, without copying
+  the batch to the host and feeding it back.
+
+  Args:
+    meta_graph_location: the path of the .meta file of the checkpoint.
+    video_batch: the tensor of the decoded features.
+    num_frames_batch: the tensor of the numbers of frames.
+
+  Returns:
+    The saver of the imported graph.
+  """
+  meta_graph_def = meta_graph.read_meta_graph_file(meta_graph_location)
+  input_map = {
+      get_collection_tensor_name(meta_graph_def, "input_batch_raw"):
+          video_batch,
+      get_collection_tensor_name(meta_graph_def, "num_frames"):
+          num_frames_batch}
+  return tf.train.import_meta_graph(meta_graph_def, clear_devices=True,
+                                    input_map=input_map)
 
 
 def get_input_data_tensors(reader, data_pattern, batch_size, num_readers=1):
@@ -103,6 +127,16 @@ def get_input_data_tensors(reader, data_pattern, batch_size, num_readers=1):
       raise IOError("Unable to find input files. data_pattern='" +
                     data_pattern + "'")
     logging.info("number of input files: " + str(len(files)))
+    if FLAGS.use_dataset:
+      video_id_batch, video_batch, unused_labels, num_frames_batch = (
+          dataset_input.get_input_tensors(
+              reader,
+              sorted(files),
+              batch_size,
+              num_epochs=1,
+              num_parallel_reads=num_readers,
+              num_parallel_calls=num_readers))
+      return video_id_batch, video_batch, num_frames_batch
     filename_queue = tf.train.string_input_producer(
         files, num_epochs=1, shuffle=False)
     examples_and_labels = [reader.prepare_reader(filename_queue)
@@ -127,12 +161,13 @@ def inference(reader, train_dir, data_pattern, out_file_location, batch_size, to
     else:
       meta_graph_location = latest_checkpoint + ".meta"
       logging.info("loading meta-graph: " + meta_graph_location)
-    saver = tf.train.import_meta_graph(meta_graph_location, clear_devices=True)
+    saver = import_model(meta_graph_location, video_batch, num_frames_batch)
     logging.info("restoring variables from " + latest_checkpoint)
     saver.restore(sess, latest_checkpoint)
-    input_tensor = tf.get_collection("input_batch_raw")[0]
-    num_frames_tensor = tf.get_collection("num_frames")[0]
     predictions_tensor = tf.get_collection("predictions")[0]
+    num_classes = predictions_tensor.get_shape().as_list()[1]
+    top_predictions_tensor, top_classes_tensor = tf.nn.top_k(
+        predictions_tensor, k=min(top_k, num_classes or top_k))
 
     # Workaround for num_epochs issue.
     def set_up_init_ops(variables):
@@ -152,18 +187,16 @@ def inference(reader, train_dir, data_pattern, out_file_location, batch_size, to
     num_examples_processed = 0
     start_time = time.time()
     out_file.write("VideoId,LabelConfidencePairs\n")
+    writer = submission_writer.SubmissionWriter(out_file)
+    writer.start()
 
     try:
       while not coord.should_stop():
-          video_id_batch_val, video_batch_val,num_frames_batch_val = sess.run([video_id_batch, video_batch, num_frames_batch])
-          predictions_val, = sess.run([predictions_tensor], feed_dict={input_tensor: video_batch_val, num_frames_tensor: num_frames_batch_val})
+          video_id_batch_val, top_classes_val, top_predictions_val = sess.run([video_id_batch, top_classes_tensor, top_predictions_tensor])
           now = time.time()
-          num_examples_processed += len(video_batch_val)
-          num_classes = predictions_val.shape[1]
+          num_examples_processed += len(video_id_batch_val)
           logging.info("num examples processed: " + str(num_examples_processed) + " elapsed seconds: " + "{0:.2f}".format(now-start_time))
-          for line in format_lines(video_id_batch_val, predictions_val, top_k):
-            out_file.write(line)
-          out_file.flush()
+          writer.submit(video_id_batch_val, top_classes_val, top_predictions_val)
 
 
     except tf.errors.OutOfRangeError:
@@ -172,6 +205,7 @@ def inference(reader, train_dir, data_pattern, out_file_location, batch_size, to
         coord.request_stop()
 
     coord.join(threads)
+    writer.close()
     sess.close()
 
 
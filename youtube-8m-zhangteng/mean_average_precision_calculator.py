@@ -92,6 +92,81 @@ class MeanAveragePrecisionCalculator(object):
     for i in range(len(predictions)):
       calculators[i].accumulate(predictions[i], actuals[i], num_positives[i])
 
+  def accumulate_sparse(self, classes, predictions, actuals, num_positives):
+    """Accumulate flat arrays of predictions of any classes.
+
+    The entries are grouped by class with a stable sort, so each class gets
+    one accumulate call with its slice of the arrays.
+
+    Args:
+      classes: A numpy vector of the class of every entry.
+      predictions: A numpy vector of the prediction scores of the entries.
+      actuals: A numpy vector of the ground truth labels of the entries. Any
+      value larger than 0 will be treated as positives, otherwise as negatives.
+      num_positives: A numpy vector of the number of true positives for each
+      class.
+    """
+    classes = numpy.asarray(classes)
+    order = numpy.argsort(classes, kind="mergesort")
+    counts = numpy.bincount(classes, minlength=self._num_class)
+    offsets = numpy.zeros([self._num_class + 1], dtype=numpy.int64)
+    offsets[1:] = numpy.cumsum(counts)
+    predictions = numpy.asarray(predictions)[order]
+    actuals = numpy.asarray(actuals)[order]
+    num_positives = numpy.asarray(num_positives)
+
+    calculators = self._ap_calculators
+    for i in numpy.nonzero((counts > 0) | (num_positives > 0))[0]:
+      start, end = offsets[i], offsets[i + 1]
+      calculators[i].accumulate(predictions[start:end], actuals[start:end],
+                                num_positives[i])
+
+  def merge(self, other):
+    """Merges the predictions accumulated by another calculator into this one.
+
+    Raises:
+      ValueError: An error occurred when the number of classes differ.
+    """
+    if other._num_class != self._num_class:
+      raise ValueError("can not merge calculators of different num_class.")
+    for calculator, other_calculator in zip(self._ap_calculators,
+                                            other._ap_calculators):
+      calculator.merge(other_calculator)
+
+  def get_state(self):
+    """Returns the accumulated state as a dictionary of numpy arrays.
+
+    The pairs of all the classes are concatenated, with the offsets of the
+    classes in 'offsets'.
+    """
+    states = [calculator.get_state() for calculator in self._ap_calculators]
+    offsets = numpy.zeros([self._num_class + 1], dtype=numpy.int64)
+    offsets[1:] = numpy.cumsum([state["predictions"].size for state in states])
+    return {"top_n": numpy.array([state["top_n"] for state in states]),
+            "total_positives": numpy.array(
+                [state["total_positives"] for state in states]),
+            "predictions": numpy.concatenate(
+                [state["predictions"] for state in states]),
+            "actuals": numpy.concatenate(
+                [state["actuals"] for state in states]),
+            "offsets": offsets}
+
+  def set_state(self, state):
+    """Replaces the accumulated state with one returned by get_state.
+
+    Raises:
+      ValueError: An error occurred when the number of classes differ.
+    """
+    offsets = state["offsets"]
+    if len(offsets) != self._num_class + 1:
+      raise ValueError("the state is not of %d classes." % self._num_class)
+    for i, calculator in enumerate(self._ap_calculators):
+      start, end = offsets[i], offsets[i + 1]
+      calculator.set_state({"top_n": state["top_n"][i],
+                            "total_positives": state["total_positives"][i],
+                            "predictions": state["predictions"][start:end],
+                            "actuals": state["actuals"][start:end]})
+
   def clear(self):
     for calculator in self._ap_calculators:
       calculator.clear()
@@ -55,6 +55,40 @@ def resize_axis(tensor, axis, new_size, fill_value=0):
   resized.set_shape(new_shape)
   return resized
 
+def decode_quantized_frames(serialized_example,
+                            feature_names,
+                            feature_sizes,
+                            max_frames):
+  """Decodes the frame features of one SequenceExample without dequantizing.
+
+  Args:
+    serialized_example: a scalar string tensor holding a SequenceExample.
+    feature_names: the feature name(s) in the tensorflow record as a list.
+    feature_sizes: the feature dimensions as a list.
+    max_frames: number of frames (rows) in the output feature_matrix
+
+  Returns:
+    feature_matrix: uint8 matrix of all frame-features, padded to max_frames
+    num_frames: number of frames in the sequence
+  """
+  _, features = tf.parse_single_sequence_example(
+      serialized_example,
+      sequence_features={
+          feature_name : tf.FixedLenSequenceFeature([], dtype=tf.string)
+          for feature_name in feature_names
+      })
+
+  num_frames = -1
+  feature_matrices = []
+  for feature_name, feature_size in zip(feature_names, feature_sizes):
+    decoded_features = tf.reshape(
+        tf.decode_raw(features[feature_name], tf.uint8), [-1, feature_size])
+    if num_frames == -1:
+      num_frames = tf.minimum(tf.shape(decoded_features)[0], max_frames)
+    feature_matrices.append(resize_axis(decoded_features, 0, max_frames))
+
+  return tf.concat(feature_matrices, 1), num_frames
+
 class BaseReader(object):
   """Inherit from this class when implementing new readers."""
 
@@ -62,6 +96,18 @@ class BaseReader(object):
     """Create a thread for generating prediction and label tensors."""
     raise NotImplementedError()
 
+  def prepare_serialized_examples(self, unused_serialized_examples):
+    """Parses a batch of serialized examples into the prepare_reader tensors.
+
+    Used by the tf.data input pipeline in dataset_input.py.
+    """
+    raise NotImplementedError("%s can not be used with a dataset input." %
+                              type(self).__name__)
+
+  def prepare_batch(self, batch):
+    """Post-processes the tensors of a batch after batching."""
+    return batch
+
 
 class YT8MAggregatedFeatureReader(BaseReader):
   """Reads TFRecords of pre-aggregated Examples.
@@ -102,7 +148,17 @@ class YT8MAggregatedFeatureReader(BaseReader):
     """
     reader = tf.TFRecordReader()
     _, serialized_examples = reader.read_up_to(filename_queue, batch_size)
+    return self.prepare_serialized_examples(serialized_examples)
+
+  def prepare_serialized_examples(self, serialized_examples):
+    """Parses a batch of pre-aggregated YouTube 8M Examples.
 
+    Args:
+      serialized_examples: a vector of serialized Examples.
+
+    Returns:
+      A tuple of video indexes, features, labels, and padding data.
+    """
     # set the mapping from the fields to data types in the proto
     num_features = len(self.feature_names)
     assert num_features > 0, "self.feature_names is empty!"
@@ -258,6 +314,42 @@ class YT8MFrameFeatureReader(BaseReader):
 
     return batch_video_ids, batch_video_matrix, batch_labels, batch_frames
 
+  def prepare_serialized_examples(self,
+                                  serialized_examples,
+                                  max_quantized_value=2,
+                                  min_quantized_value=-2):
+    """Parses a batch of YouTube8M SequenceExamples.
+
+    Args:
+      serialized_examples: a vector of serialized SequenceExamples.
+      max_quantized_value: the maximum of the quantized value.
+      min_quantized_value: the minimum of the quantized value.
+
+    Returns:
+      A tuple of video indexes, video features, labels, and padding data.
+    """
+    # The context of a SequenceExample has the same wire format as an Example,
+    # so video ids and labels of the whole batch are parsed in one op.
+    contexts = tf.parse_example(
+        serialized_examples,
+        features={"video_id": tf.FixedLenFeature([], tf.string),
+                  "labels": tf.VarLenFeature(tf.int64)})
+    labels = tf.sparse_to_indicator(contexts["labels"], self.num_classes)
+    labels.set_shape([None, self.num_classes])
+
+    quantized_matrices, num_frames = tf.map_fn(
+        lambda serialized_example: decode_quantized_frames(
+            serialized_example, self.feature_names, self.feature_sizes,
+            self.max_frames),
+        serialized_examples,
+        dtype=(tf.uint8, tf.int32),
+        back_prop=False)
+    video_matrices = utils.DequantizeFrames(quantized_matrices, num_frames,
+                                            max_quantized_value,
+                                            min_quantized_value)
+
+    return contexts["video_id"], video_matrices, labels, num_frames
+
 class YT8MAggregatedDistillationFeatureReader(BaseReader):
   """Reads TFRecords of pre-aggregated Examples.
 
@@ -297,7 +389,18 @@ class YT8MAggregatedDistillationFeatureReader(BaseReader):
     """
     reader = tf.TFRecordReader()
     _, serialized_examples = reader.read_up_to(filename_queue, batch_size)
+    return self.prepare_serialized_examples(serialized_examples)
+
+  def prepare_serialized_examples(self, serialized_examples):
+    """Parses a batch of pre-aggregated YouTube 8M Examples.
 
+    Args:
+      serialized_examples: a vector of serialized Examples.
+
+    Returns:
+      A tuple of video indexes, features, labels, padding data and
+      distillation predictions.
+    """
     # set the mapping from the fields to data types in the proto
     num_features = len(self.feature_names)
     assert num_features > 0, "self.feature_names is empty!"
@@ -359,7 +462,17 @@ class YT8MDistillationFeatureReader(BaseReader):
         """
         reader = tf.TFRecordReader()
         _, serialized_examples = reader.read_up_to(filename_queue, batch_size)
+        return self.prepare_serialized_examples(serialized_examples)
+
+    def prepare_serialized_examples(self, serialized_examples):
+        """Parses the distillation predictions of a batch of Examples.
+
+        Args:
+          serialized_examples: a vector of serialized Examples.
 
+        Returns:
+          The distillation predictions.
+        """
         # set the mapping from the fields to data types in the proto
         num_features = len(self.feature_names)
         assert num_features > 0, "self.feature_names is empty!"
@@ -511,4 +624,44 @@ class YT8MFrameDistillationFeatureReader(BaseReader):
 
     return batch_video_ids, batch_video_matrix, batch_labels, batch_frames, batch_predictions
 
+  def prepare_serialized_examples(self,
+                                  serialized_examples,
+                                  max_quantized_value=2,
+                                  min_quantized_value=-2):
+    """Parses a batch of YouTube8M SequenceExamples.
+
+    Args:
+      serialized_examples: a vector of serialized SequenceExamples.
+      max_quantized_value: the maximum of the quantized value.
+      min_quantized_value: the minimum of the quantized value.
+
+    Returns:
+      A tuple of video indexes, video features, labels, padding data and
+      distillation predictions.
+    """
+    # The context of a SequenceExample has the same wire format as an Example,
+    # so video ids, labels and predictions of the whole batch are parsed in
+    # one op.
+    contexts = tf.parse_example(
+        serialized_examples,
+        features={"video_id": tf.FixedLenFeature([], tf.string),
+                  "predictions": tf.FixedLenFeature([self.num_classes], tf.float32),
+                  "labels": tf.VarLenFeature(tf.int64)})
+    labels = tf.sparse_to_indicator(contexts["labels"], self.num_classes)
+    labels.set_shape([None, self.num_classes])
+
+    quantized_matrices, num_frames = tf.map_fn(
+        lambda serialized_example: decode_quantized_frames(
+            serialized_example, self.feature_names, self.feature_sizes,
+            self.max_frames),
+        serialized_examples,
+        dtype=(tf.uint8, tf.int32),
+        back_prop=False)
+    video_matrices = utils.DequantizeFrames(quantized_matrices, num_frames,
+                                            max_quantized_value,
+                                            min_quantized_value)
+
+    return (contexts["video_id"], video_matrices, labels, num_frames,
+            contexts["predictions"])
+
 
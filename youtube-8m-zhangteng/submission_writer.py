@@ -0,0 +1,161 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Writes the lines of a submission file in a background thread.
+
+The top predictions of a whole batch are formatted at once: the characters
+of the video ids, of the class ids, taken from a table of formatted ids, and
+of the scores are scattered into a single byte buffer, so the cost does not
+grow with the number of Python string operations. The output is the same as
+"%i %f" formatting of the (class, score) pairs.
+"""
+
+import Queue
+import threading
+
+import numpy
+
+# The number of characters of a score formatted with "%f" in [0, 1].
+_SCORE_WIDTH = 8
+
+
+def _to_chars(strings):
+  """Returns the characters and the lengths of a list of strings."""
+  strings = numpy.asarray(strings, dtype="S")
+  width = max(strings.dtype.itemsize, 1)
+  chars = numpy.frombuffer(strings.tobytes(), dtype=numpy.uint8)
+  chars = chars.reshape(strings.shape + (width,))
+  return chars, (chars != 0).sum(axis=-1)
+
+
+def _scatter(out, offsets, chars, lengths):
+  """Copies chars[i, :lengths[i]] to out[offsets[i]:offsets[i] + lengths[i]]."""
+  for j in range(chars.shape[-1]):
+    mask = lengths > j
+    out[offsets[mask] + j] = chars[..., j][mask]
+
+
+def _format_scores(scores):
+  """Returns the characters of "%f" % score for scores in [0, 1]."""
+  # Exact for float32 scores, whose products by 10^6 fit in a double.
+  scaled = numpy.rint(scores.astype(numpy.float64) * 1e6).astype(numpy.int64)
+  chars = numpy.empty(scores.shape + (_SCORE_WIDTH,), dtype=numpy.uint8)
+  chars[..., 0] = ord("0") + scaled // 1000000
+  chars[..., 1] = ord(".")
+  for j in range(6):
+    chars[..., _SCORE_WIDTH - 1 - j] = ord("0") + scaled % 10
+    scaled //= 10
+  return chars
+
+
+class SubmissionFormatter(object):
+  """Formats the top predictions of batches of videos into CSV lines."""
+
+  def __init__(self):
+    self._class_chars = numpy.zeros((0, 1), dtype=numpy.uint8)
+    self._class_lengths = numpy.zeros(0, dtype=numpy.int64)
+
+  def _class_table(self, num_classes):
+    if num_classes > len(self._class_lengths):
+      self._class_chars, self._class_lengths = _to_chars(
+          [str(i) for i in range(num_classes)])
+    return self._class_chars, self._class_lengths
+
+  def format(self, video_ids, classes, scores):
+    """Returns the lines of a batch as a single string.
+
+    Args:
+      video_ids: the ids of the videos, of shape [batch].
+      classes: the top classes of each video, of shape [batch, k], sorted by
+        decreasing score.
+      scores: the scores of the top classes, of shape [batch, k].
+    """
+    classes = numpy.asarray(classes, dtype=numpy.int64)
+    scores = numpy.asarray(scores)
+    if len(video_ids) == 0:
+      return b""
+    if not numpy.all((scores >= 0) & (scores <= 1)):
+      return b"".join(
+          video_id + b"," + b" ".join(b"%i %f" % pair for pair in zip(
+              video_classes, video_scores)) + b"\n"
+          for video_id, video_classes, video_scores in zip(
+              video_ids, classes.tolist(), scores.tolist()))
+
+    id_chars, id_lengths = _to_chars(video_ids)
+    class_chars, class_lengths = self._class_table(classes.max() + 1)
+    score_chars = _format_scores(scores)
+
+    # Every pair is "<class> <score>" followed by a space or the newline.
+    pair_lengths = class_lengths[classes] + _SCORE_WIDTH + 2
+    line_lengths = id_lengths + 1 + pair_lengths.sum(axis=1)
+    line_starts = numpy.cumsum(line_lengths) - line_lengths
+    pair_starts = (line_starts + id_lengths + 1)[:, None] + (
+        numpy.cumsum(pair_lengths, axis=1) - pair_lengths)
+
+    out = numpy.empty(line_lengths.sum(), dtype=numpy.uint8)
+    _scatter(out, line_starts, id_chars, id_lengths)
+    out[line_starts + id_lengths] = ord(",")
+    score_starts = pair_starts + class_lengths[classes] + 1
+    _scatter(out, pair_starts, class_chars[classes], class_lengths[classes])
+    out[score_starts - 1] = ord(" ")
+    for j in range(_SCORE_WIDTH):
+      out[score_starts + j] = score_chars[..., j]
+    out[score_starts + _SCORE_WIDTH] = ord(" ")
+    out[score_starts[:, -1] + _SCORE_WIDTH] = ord("\n")
+    return out.tobytes()
+
+
+class SubmissionWriter(threading.Thread):
+  """Formats and writes the lines of submitted batches in a thread."""
+
+  def __init__(self, out_file, max_pending=4):
+    """Creates a writer, call start() to run it.
+
+    Args:
+      out_file: the file the lines are written to.
+      max_pending: the number of batches that may wait to be written, the
+        submitting thread blocks when there are more.
+    """
+    super(SubmissionWriter, self).__init__(name="SubmissionWriter")
+    self.daemon = True
+    self._out_file = out_file
+    self._formatter = SubmissionFormatter()
+    self._queue = Queue.Queue(maxsize=max(max_pending, 1))
+    self._error = None
+
+  def submit(self, video_ids, classes, scores):
+    """Hands the top predictions of a batch to the writer."""
+    if self._error is not None:
+      raise self._error
+    self._queue.put((video_ids, classes, scores))
+
+  def close(self):
+    """Writes the pending batches and stops the writer."""
+    self._queue.put(None)
+    self.join()
+    if self._error is not None:
+      raise self._error
+
+  def run(self):
+    while True:
+      item = self._queue.get()
+      if item is None:
+        break
+      if self._error is not None:
+        continue
+      try:
+        self._out_file.write(self._formatter.format(*item))
+        self._out_file.flush()
+      except Exception as e:  # pylint: disable=broad-except
+        self._error = e
@@ -18,9 +18,11 @@ import os
 import time
 
 import eval_util
+import metrics_worker as metrics_worker_lib
 import losses
 import frame_level_models
 import video_level_models
+import dataset_input
 import readers
 import tensorflow as tf
 import tensorflow.contrib.slim as slim
@@ -55,6 +57,10 @@ if __name__ == "__main__":
       "Otherwise, --train_data_pattern must be aggregated video-level "
       "features. The model must also be set appropriately (i.e. to read 3D "
       "batches VS 4D batches.")
+  flags.DEFINE_bool(
+      "use_dataset", False,
+      "If set, the input is read by the tf.data pipeline of dataset_input.py "
+      "instead of queue runners. Requires TensorFlow 1.4 or later.")
   flags.DEFINE_bool(
       "frame_only", False,
       "If set, then --train_data_pattern must be frame-level features. "
@@ -114,6 +120,16 @@ if __name__ == "__main__":
   # Other flags.
   flags.DEFINE_integer("num_readers", 8,
                        "How many threads to use for reading input files.")
+  flags.DEFINE_integer(
+      "metrics_every_n_steps", 1,
+      "How often, in steps, the training metrics are computed and logged.")
+  flags.DEFINE_bool(
+      "async_metrics", False,
+      "If set, the fetched predictions and labels are handed to a background "
+      "thread that computes the training metrics while the next step runs.")
+  flags.DEFINE_integer(
+      "async_metrics_queue_size", 2,
+      "How many batches may wait for the metrics thread, more are dropped.")
   flags.DEFINE_string("optimizer", "AdamOptimizer",
                       "What optimizer class to use.")
   flags.DEFINE_string("gradient", None,
@@ -182,6 +198,15 @@ def get_input_data_tensors(reader,
       raise IOError("Unable to find training files. data_pattern='" +
                     data_pattern + "'.")
     logging.info("Number of training files: %s.", str(len(files)))
+    if FLAGS.use_dataset:
+      return dataset_input.get_input_tensors(
+          reader,
+          files,
+          batch_size,
+          num_epochs=num_epochs,
+          shuffle=True,
+          num_parallel_reads=num_readers,
+          num_parallel_calls=num_readers)
     filename_queue = tf.train.string_input_producer(
         files, num_epochs=num_epochs, shuffle=True)
     training_data = [
@@ -509,16 +534,36 @@ class Trainer(object):
     logging.info("%s: Starting managed session.", task_as_string(self.task))
     with sv.managed_session(target, config=self.config) as sess:
 
+      metrics_worker = None
+      if self.is_master and FLAGS.async_metrics:
+        metrics_worker = metrics_worker_lib.MetricsWorker(
+            sv.summary_writer, task_as_string(self.task),
+            FLAGS.async_metrics_queue_size)
+        metrics_worker.start()
+
+      steps = 0
       try:
         logging.info("%s: Entering training loop.", task_as_string(self.task))
         while not sv.should_stop():
 
+          steps += 1
           batch_start_time = time.time()
-          _, global_step_val, loss_val, reg_loss_val, predictions_val, labels_val = sess.run(
-              [train_op, global_step, loss, reg_loss, predictions, labels])
+          compute_metrics = self.is_master and (
+              steps % max(FLAGS.metrics_every_n_steps, 1) == 0)
+          if compute_metrics:
+            _, global_step_val, loss_val, reg_loss_val, predictions_val, labels_val = sess.run(
+                [train_op, global_step, loss, reg_loss, predictions, labels])
+          else:
+            _, global_step_val, loss_val = sess.run(
+                [train_op, global_step, loss])
           seconds_per_batch = time.time() - batch_start_time
 
-          if self.is_master:
+          if compute_metrics and metrics_worker is not None:
+            metrics_worker.submit(global_step_val, predictions_val, labels_val,
+                                  loss_val,
+                                  labels_val.shape[0] / seconds_per_batch,
+                                  " RegLoss: " + str(reg_loss_val))
+          elif compute_metrics:
             examples_per_second = labels_val.shape[0] / seconds_per_batch
             hit_at_one = eval_util.calculate_hit_at_one(predictions_val,
                                                         labels_val)
@@ -548,6 +593,9 @@ class Trainer(object):
       except tf.errors.OutOfRangeError:
         logging.info("%s: Done training -- epoch limit reached.",
                      task_as_string(self.task))
+      finally:
+        if metrics_worker is not None:
+          metrics_worker.stop()
 
     logging.info("%s: Exited training loop.", task_as_string(self.task))
     sv.Stop()